@@ -0,0 +1,146 @@
+"""Add task rollups
+
+Revision ID: 0a6d3e9b7c14
+Revises: f41c8a7e2b65
+Create Date: 2026-10-17 21:00:00.000000
+
+Агрегаты завершённых задач по минутам, часам и дням для /api/stats/timeseries:
+task_rollups, гистограммы длительностей task_rollup_durations и журнал
+завершений task_finish_events, который пополняют триггеры на tasks. Уже
+завершённые задачи записываются в журнал и сворачиваются в агрегаты фоновым
+циклом приложения. Триггеры и выражения должны совпадать с
+services/task_rollups.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6d3e9b7c14'
+down_revision: Union[str, Sequence[str], None] = 'f41c8a7e2b65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DURATION_SQL = {
+    "sqlite": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN (julianday({row}.finished_at) - julianday({row}.started_at)) * 86400.0 END"
+    ),
+    "postgresql": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN extract(epoch FROM {row}.finished_at - {row}.started_at) END"
+    ),
+}
+
+NOW = {"sqlite": "CURRENT_TIMESTAMP", "postgresql": "now()"}
+
+FINISHED = "{row}.status IN ('completed', 'failed')"
+
+
+def event_insert(dialect: str, row: str) -> str:
+    return (
+        f"INSERT INTO task_finish_events (project_id, agent_id, status, finished_at, duration) "
+        f"VALUES ({row}.project_id, {row}.agent_id, {row}.status, coalesce({row}.finished_at, {NOW[dialect]}), "
+        f"{DURATION_SQL[dialect].format(row=row)})"
+    )
+
+
+def trigger_ddl(dialect: str):
+    if dialect == "postgresql":
+        return (
+            f"CREATE OR REPLACE FUNCTION task_rollups_track() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN {event_insert(dialect, 'NEW')}; RETURN NULL; END $$",
+            f"CREATE OR REPLACE TRIGGER task_rollups_insert AFTER INSERT ON tasks "
+            f"FOR EACH ROW WHEN ({FINISHED.format(row='NEW')}) EXECUTE FUNCTION task_rollups_track()",
+            f"CREATE OR REPLACE TRIGGER task_rollups_update AFTER UPDATE OF status ON tasks "
+            f"FOR EACH ROW WHEN ({FINISHED.format(row='NEW')} AND OLD.status IS DISTINCT FROM NEW.status) "
+            f"EXECUTE FUNCTION task_rollups_track()",
+        )
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS task_rollups_insert AFTER INSERT ON tasks "
+        f"WHEN {FINISHED.format(row='new')} BEGIN {event_insert(dialect, 'new')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_rollups_update AFTER UPDATE OF status ON tasks "
+        f"WHEN {FINISHED.format(row='new')} AND old.status IS NOT new.status BEGIN "
+        f"{event_insert(dialect, 'new')}; END",
+    )
+
+
+def rollup_key():
+    return [
+        sa.Column('granularity', sa.String(length=10), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('agent_id', sa.Integer(), nullable=False),
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    op.create_table('task_finish_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('duration', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('task_rollups',
+    *rollup_key(),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.Column('duration_sum', sa.Float(), nullable=False),
+    sa.Column('duration_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'project_id', 'agent_id')
+    )
+    op.create_index('ix_task_rollups_project', 'task_rollups', ['granularity', 'project_id', 'bucket_start'])
+    op.create_index('ix_task_rollups_agent', 'task_rollups', ['granularity', 'agent_id', 'bucket_start'])
+    op.create_table('task_rollup_durations',
+    *rollup_key(),
+    sa.Column('bin', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('granularity', 'bucket_start', 'project_id', 'agent_id', 'bin')
+    )
+    op.create_index('ix_task_rollup_durations_project', 'task_rollup_durations',
+                    ['granularity', 'project_id', 'bucket_start'])
+    op.create_index('ix_task_rollup_durations_agent', 'task_rollup_durations',
+                    ['granularity', 'agent_id', 'bucket_start'])
+
+    if dialect not in DURATION_SQL:
+        return
+    # На PostgreSQL задачи не завершаются между заполнением журнала и созданием триггеров
+    if dialect == "postgresql":
+        op.execute("LOCK TABLE tasks IN SHARE MODE")
+    op.execute(
+        f"INSERT INTO task_finish_events (project_id, agent_id, status, finished_at, duration) "
+        f"SELECT project_id, agent_id, status, coalesce(finished_at, updated_at, created_at, {NOW[dialect]}), "
+        f"{DURATION_SQL[dialect].format(row='tasks')} "
+        f"FROM tasks WHERE {FINISHED.format(row='tasks')}"
+    )
+    for statement in trigger_ddl(dialect):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS task_rollups_update ON tasks")
+        op.execute("DROP TRIGGER IF EXISTS task_rollups_insert ON tasks")
+        op.execute("DROP FUNCTION IF EXISTS task_rollups_track()")
+    elif dialect == "sqlite":
+        for trigger in ("task_rollups_update", "task_rollups_insert"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    op.drop_index('ix_task_rollup_durations_agent', table_name='task_rollup_durations')
+    op.drop_index('ix_task_rollup_durations_project', table_name='task_rollup_durations')
+    op.drop_table('task_rollup_durations')
+    op.drop_index('ix_task_rollups_agent', table_name='task_rollups')
+    op.drop_index('ix_task_rollups_project', table_name='task_rollups')
+    op.drop_table('task_rollups')
+    op.drop_table('task_finish_events')
@@ -0,0 +1,35 @@
+"""Normalize SQLite task created_at
+
+Revision ID: 5c8e1f4a9b27
+Revises: 0a6d3e9b7c14
+Create Date: 2026-10-17 22:00:00.000000
+
+На SQLite tasks.created_at сравнивается как строка. Значения, записанные
+приложением с нулевой дробной частью ('... 10:00:00.000000'), приводятся к виду
+CURRENT_TIMESTAMP ('... 10:00:00'), в котором их теперь пишет models.Timestamp:
+у каждого момента одно представление, и курсор пагинации не пропускает и не
+повторяет задачи, созданные в одну секунду.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c8e1f4a9b27'
+down_revision: Union[str, Sequence[str], None] = '0a6d3e9b7c14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute("UPDATE tasks SET created_at = substr(created_at, 1, 19) WHERE created_at LIKE '%.000000'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Оба представления читаются одинаково, возвращать дробную часть не нужно
+    pass
@@ -0,0 +1,81 @@
+"""Add project counters
+
+Revision ID: 9d2b7f3e6a41
+Revises: 5c8e1f4a9b27
+Create Date: 2026-10-17 23:00:00.000000
+
+Число проектов для /api/stats хранится в task_counters: каждый проект
+учитывается единицей в строке (project_id, '#project'), изменения пишут
+триггеры на projects в журнал task_counter_deltas. Строки заполняются по
+существующим проектам. Триггеры должны совпадать с services/task_counters.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2b7f3e6a41'
+down_revision: Union[str, Sequence[str], None] = '5c8e1f4a9b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PROJECT_STATUS = "#project"
+
+
+def delta_insert(row: str, sign: int) -> str:
+    return (
+        f"INSERT INTO task_counter_deltas (project_id, status, tasks, duration_sum, duration_count) "
+        f"VALUES ({row}.id, '{PROJECT_STATUS}', {sign}, 0, 0)"
+    )
+
+
+def trigger_ddl(dialect: str):
+    if dialect == "postgresql":
+        return (
+            f"CREATE OR REPLACE FUNCTION task_counters_track_project() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN "
+            f"IF TG_OP = 'DELETE' THEN {delta_insert('OLD', -1)}; "
+            f"ELSE {delta_insert('NEW', 1)}; END IF; "
+            f"RETURN NULL; "
+            f"END $$",
+            "CREATE OR REPLACE TRIGGER task_counters_project AFTER INSERT OR DELETE ON projects "
+            "FOR EACH ROW EXECUTE FUNCTION task_counters_track_project()",
+        )
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_project_insert AFTER INSERT ON projects BEGIN "
+        f"{delta_insert('new', 1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_project_delete AFTER DELETE ON projects BEGIN "
+        f"{delta_insert('old', -1)}; END",
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        return
+    # На PostgreSQL проекты не меняются между заполнением и созданием триггеров
+    if dialect == "postgresql":
+        op.execute("LOCK TABLE projects IN SHARE MODE")
+    op.execute(
+        f"INSERT INTO task_counters (project_id, status, tasks, duration_sum, duration_count) "
+        f"SELECT id, '{PROJECT_STATUS}', 1, 0, 0 FROM projects"
+    )
+    for statement in trigger_ddl(dialect):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS task_counters_project ON projects")
+        op.execute("DROP FUNCTION IF EXISTS task_counters_track_project()")
+    elif dialect == "sqlite":
+        for trigger in ("task_counters_project_delete", "task_counters_project_insert"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    for table in ("task_counter_deltas", "task_counters"):
+        op.execute(f"DELETE FROM {table} WHERE status = '{PROJECT_STATUS}'")
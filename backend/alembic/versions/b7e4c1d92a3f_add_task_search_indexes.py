@@ -0,0 +1,79 @@
+"""Add task search indexes
+
+Revision ID: b7e4c1d92a3f
+Revises: 5d520d8fb1a6
+Create Date: 2026-10-17 12:00:00.000000
+
+PostgreSQL: pg_trgm, GIN индекс по to_tsvector для q= и триграммный индекс
+по title для подстрочного task_name. Индексы строятся CONCURRENTLY, чтобы не
+блокировать запись в tasks.
+
+SQLite: FTS5 таблица tasks_fts (trigram) с триггерами синхронизации.
+Выражения и DDL должны совпадать с services/task_search.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4c1d92a3f'
+down_revision: Union[str, Sequence[str], None] = '5d520d8fb1a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_COLUMNS = ("title", "description", "result", "error_message")
+
+POSTGRES_DOCUMENT = "to_tsvector('simple', " + " || ' ' || ".join(
+    f"coalesce({name}, '')" for name in SEARCH_COLUMNS
+) + ")"
+
+FTS_COLUMNS = ", ".join(SEARCH_COLUMNS)
+NEW_VALUES = ", ".join(f"new.{name}" for name in SEARCH_COLUMNS)
+OLD_VALUES = ", ".join(f"old.{name}" for name in SEARCH_COLUMNS)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        with op.get_context().autocommit_block():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_search ON tasks USING gin ({POSTGRES_DOCUMENT})")
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_title_trgm ON tasks USING gin (title gin_trgm_ops)")
+
+    elif dialect == "sqlite":
+        op.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5({FTS_COLUMNS}, "
+            f"content='tasks', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+            f"INSERT INTO tasks_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+            f"INSERT INTO tasks_fts(tasks_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF {FTS_COLUMNS} ON tasks BEGIN "
+            f"INSERT INTO tasks_fts(tasks_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES}); "
+            f"INSERT INTO tasks_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW_VALUES}); END"
+        )
+        op.execute("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_tasks_title_trgm")
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_tasks_search")
+
+    elif dialect == "sqlite":
+        for trigger in ("tasks_fts_update", "tasks_fts_delete", "tasks_fts_insert"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS tasks_fts")
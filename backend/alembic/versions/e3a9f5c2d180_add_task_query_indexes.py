@@ -0,0 +1,53 @@
+"""Add task query indexes
+
+Revision ID: e3a9f5c2d180
+Revises: b7e4c1d92a3f
+Create Date: 2026-10-17 15:00:00.000000
+
+Составные индексы под формы запросов списков задач: фильтр по проекту,
+агенту или статусу с сортировкой по (created_at, id), частичный индекс
+выполняющихся задач и индекс списка проектов. На PostgreSQL индексы строятся
+CONCURRENTLY, чтобы не блокировать запись в tasks.
+Определения должны совпадать с __table_args__ в models/models.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a9f5c2d180'
+down_revision: Union[str, Sequence[str], None] = 'b7e4c1d92a3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ("ix_tasks_project_created", "tasks (project_id, created_at, id)"),
+    ("ix_tasks_agent_created", "tasks (agent_id, created_at, id)"),
+    ("ix_tasks_status_created", "tasks (status, created_at, id)"),
+    ("ix_tasks_created", "tasks (created_at, id)"),
+    ("ix_tasks_running_started", "tasks (started_at) WHERE status = 'running'"),
+    ("ix_projects_created_at", "projects (created_at)"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, definition in INDEXES:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+    else:
+        for name, definition in INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            for name, _ in reversed(INDEXES):
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    else:
+        for name, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX IF EXISTS {name}")
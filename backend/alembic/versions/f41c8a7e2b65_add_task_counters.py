@@ -0,0 +1,126 @@
+"""Add task counters
+
+Revision ID: f41c8a7e2b65
+Revises: e3a9f5c2d180
+Create Date: 2026-10-17 18:00:00.000000
+
+Счётчики задач для /api/stats: task_counters (число задач по проекту и статусу,
+сумма и число длительностей выполненных задач) и журнал изменений
+task_counter_deltas, который пополняют триггеры на tasks. Счётчики заполняются
+по существующим задачам. Триггеры и выражения должны совпадать с
+services/task_counters.py.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f41c8a7e2b65'
+down_revision: Union[str, Sequence[str], None] = 'e3a9f5c2d180'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COUNTED_COLUMNS = ("status", "project_id", "started_at", "finished_at")
+
+DURATION_SQL = {
+    "sqlite": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN (julianday({row}.finished_at) - julianday({row}.started_at)) * 86400.0 END"
+    ),
+    "postgresql": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN extract(epoch FROM {row}.finished_at - {row}.started_at) END"
+    ),
+}
+
+
+def delta_insert(dialect: str, row: str, sign: int) -> str:
+    duration = DURATION_SQL[dialect].format(row=row)
+    return (
+        f"INSERT INTO task_counter_deltas (project_id, status, tasks, duration_sum, duration_count) "
+        f"VALUES ({row}.project_id, coalesce({row}.status, ''), {sign}, {sign} * coalesce({duration}, 0), "
+        f"CASE WHEN {duration} IS NULL THEN 0 ELSE {sign} END)"
+    )
+
+
+def trigger_ddl(dialect: str):
+    columns = ", ".join(COUNTED_COLUMNS)
+    if dialect == "postgresql":
+        changed = " OR ".join(f"OLD.{name} IS DISTINCT FROM NEW.{name}" for name in COUNTED_COLUMNS)
+        return (
+            f"CREATE OR REPLACE FUNCTION task_counters_track() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN "
+            f"IF TG_OP <> 'INSERT' THEN {delta_insert(dialect, 'OLD', -1)}; END IF; "
+            f"IF TG_OP <> 'DELETE' THEN {delta_insert(dialect, 'NEW', 1)}; END IF; "
+            f"RETURN NULL; "
+            f"END $$",
+            "CREATE OR REPLACE TRIGGER task_counters_insert_delete AFTER INSERT OR DELETE ON tasks "
+            "FOR EACH ROW EXECUTE FUNCTION task_counters_track()",
+            f"CREATE OR REPLACE TRIGGER task_counters_update AFTER UPDATE OF {columns} ON tasks "
+            f"FOR EACH ROW WHEN ({changed}) EXECUTE FUNCTION task_counters_track()",
+        )
+    changed = " OR ".join(f"old.{name} IS NOT new.{name}" for name in COUNTED_COLUMNS)
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_insert AFTER INSERT ON tasks BEGIN "
+        f"{delta_insert(dialect, 'new', 1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_delete AFTER DELETE ON tasks BEGIN "
+        f"{delta_insert(dialect, 'old', -1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_update AFTER UPDATE OF {columns} ON tasks "
+        f"WHEN {changed} BEGIN "
+        f"{delta_insert(dialect, 'old', -1)}; {delta_insert(dialect, 'new', 1)}; END",
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    op.create_table('task_counters',
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('tasks', sa.Integer(), nullable=False),
+    sa.Column('duration_sum', sa.Float(), nullable=False),
+    sa.Column('duration_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('project_id', 'status')
+    )
+    op.create_table('task_counter_deltas',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('project_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('tasks', sa.Integer(), nullable=False),
+    sa.Column('duration_sum', sa.Float(), nullable=False),
+    sa.Column('duration_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    if dialect not in DURATION_SQL:
+        return
+    # На PostgreSQL задачи не меняются между заполнением и созданием триггеров
+    if dialect == "postgresql":
+        op.execute("LOCK TABLE tasks IN SHARE MODE")
+    duration = DURATION_SQL[dialect].format(row="tasks")
+    op.execute(
+        f"INSERT INTO task_counters (project_id, status, tasks, duration_sum, duration_count) "
+        f"SELECT project_id, coalesce(status, ''), count(*), coalesce(sum({duration}), 0), count({duration}) "
+        f"FROM tasks GROUP BY project_id, coalesce(status, '')"
+    )
+    for statement in trigger_ddl(dialect):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS task_counters_update ON tasks")
+        op.execute("DROP TRIGGER IF EXISTS task_counters_insert_delete ON tasks")
+        op.execute("DROP FUNCTION IF EXISTS task_counters_track()")
+    elif dialect == "sqlite":
+        for trigger in ("task_counters_update", "task_counters_delete", "task_counters_insert"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    op.drop_table('task_counter_deltas')
+    op.drop_table('task_counters')
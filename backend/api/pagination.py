@@ -0,0 +1,214 @@
+"""
+Пагинация списков: курсоры (keyset) и режимы подсчёта total
+
+Страница задач выбирается условием по (created_at, id) вместо OFFSET, поэтому
+глубокие страницы стоят столько же, сколько первая. Курсор непрозрачен для
+клиента: это base64 от JSON с ключом граничной задачи и направлением.
+
+Общее число строк (total) считается по режиму:
+  - exact - COUNT по отфильтрованному запросу;
+  - estimate - оценка планировщика PostgreSQL (малые выборки и другие СУБД
+    считаются точно), результат кэшируется на PAGINATION_COUNT_CACHE_TTL секунд
+    по нормализованному запросу;
+  - none - без подсчёта, has_next определяется по лишней строке страницы.
+"""
+
+import base64
+import binascii
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Literal, Optional, Tuple
+
+from sqlalchemy import Row, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from core.config import settings
+from models.models import Task
+
+CURSOR_NEXT = "next"
+CURSOR_PREV = "prev"
+
+TOTAL_EXACT = "exact"
+TOTAL_ESTIMATE = "estimate"
+TOTAL_NONE = "none"
+TotalMode = Literal["exact", "estimate", "none"]
+
+
+class CountCache:
+    """Ограниченный кэш числа строк запроса с коротким TTL"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._counts: "OrderedDict[Hashable, Tuple[float, int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[int]:
+        entry = self._counts.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, count: int):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        self._counts[key] = (time.monotonic() + self.ttl, count)
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+
+    def clear(self):
+        self._counts.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"size": len(self._counts), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+# Глобальный кэш оценок total
+count_cache = CountCache(settings.PAGINATION_COUNT_CACHE_TTL, settings.PAGINATION_COUNT_CACHE_SIZE)
+
+
+class explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) для запроса с привязанными параметрами"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def count_key(query) -> Hashable:
+    """Ключ кэша: SQL запроса и значения параметров (одинаковые фильтры дают одинаковый ключ)"""
+    compiled = query.compile()
+    return str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items()))
+
+
+async def estimate_rows(db: AsyncSession, query) -> Optional[int]:
+    """Оценка числа строк планировщиком PostgreSQL (None для других СУБД)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    plan = await db.scalar(explain(query))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def count_rows(db: AsyncSession, query, mode: str = TOTAL_EXACT) -> Optional[int]:
+    """Число строк запроса в режиме exact, estimate или none (None)"""
+    if mode == TOTAL_NONE:
+        return None
+    count_query = select(func.count()).select_from(query.subquery())
+    if mode == TOTAL_EXACT:
+        return await db.scalar(count_query)
+
+    key = count_key(query)
+    total = count_cache.get(key)
+    if total is None:
+        total = await estimate_rows(db, query)
+        # Для небольших выборок оценка неточна, а COUNT дёшев
+        if total is None or total < settings.PAGINATION_ESTIMATE_EXACT_BELOW:
+            total = await db.scalar(count_query)
+        count_cache.set(key, total)
+    return total
+
+
+def encode_cursor(task, direction: str) -> str:
+    """Курсор страницы после (next) или перед (prev) задачей (объект или строка с created_at и id)"""
+    payload = json.dumps([task.created_at.isoformat(), task.id, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, str]:
+    """
+    Разобрать курсор
+
+    Raises:
+        ValueError: курсор повреждён или создан не этим API
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id, direction = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = datetime.fromisoformat(created_at)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(id, int) or direction not in (CURSOR_NEXT, CURSOR_PREV):
+        raise ValueError("Invalid cursor")
+    return created_at, id, direction
+
+
+async def fetch_page(db: AsyncSession, query, limit: int, offset: int = 0) -> Tuple[List[Row], bool]:
+    """Страница по offset и признак следующей страницы (по лишней строке)"""
+    rows = list((await db.execute(query.offset(offset).limit(limit + 1))).all())
+    has_next = len(rows) > limit
+    del rows[limit:]
+    return rows, has_next
+
+
+async def fetch_task_page(
+    db: AsyncSession, query, limit: int, offset: int = 0, cursor: Optional[str] = None,
+    total_mode: str = TOTAL_EXACT, order_by=None
+) -> Tuple[List[Row], Dict[str, Any]]:
+    """
+    Выбрать страницу задач (новые первыми) по offset или по курсору
+
+    Args:
+        query: SELECT по задачам, в выборке которого есть created_at и id
+        total_mode: режим подсчёта total (exact, estimate, none)
+        order_by: другая сортировка (например, по релевантности) вместо created_at;
+            с ней доступна только пагинация по offset
+
+    Returns:
+        Строки страницы и поля пагинации для PaginatedTaskResponse
+        (total, has_next, has_prev, next_cursor, prev_cursor)
+
+    Raises:
+        ValueError: некорректный курсор
+    """
+    key = tuple_(Task.created_at, Task.id)
+    if order_by is not None and cursor is not None:
+        raise ValueError("Cursor pagination is only supported for created_at ordering")
+
+    if cursor is None:
+        total = await count_rows(db, query, total_mode)
+        order = (order_by, Task.id.desc()) if order_by is not None else (Task.created_at.desc(), Task.id.desc())
+        tasks, has_next = await fetch_page(db, query.order_by(*order), limit, offset)
+        has_prev = offset > 0
+    else:
+        # Курсор проверяется до подсчёта, чтобы не считать строки для некорректного запроса
+        created_at, id, direction = decode_cursor(cursor)
+        total = await count_rows(db, query, total_mode)
+        # Лишняя строка показывает, есть ли страница дальше в направлении обхода
+        if direction == CURSOR_NEXT:
+            page = query.where(key < (created_at, id)).order_by(Task.created_at.desc(), Task.id.desc())
+        else:
+            page = query.where(key > (created_at, id)).order_by(Task.created_at.asc(), Task.id.asc())
+        tasks = list((await db.execute(page.limit(limit + 1))).all())
+        more = len(tasks) > limit
+        del tasks[limit:]
+        if direction == CURSOR_NEXT:
+            has_next, has_prev = more, True
+        else:
+            tasks.reverse()
+            has_next, has_prev = True, more
+
+    return tasks, {
+        "total": total,
+        "has_next": has_next,
+        "has_prev": has_prev,
+        "next_cursor": encode_cursor(tasks[-1], CURSOR_NEXT) if has_next and tasks and order_by is None else None,
+        "prev_cursor": encode_cursor(tasks[0], CURSOR_PREV) if has_prev and tasks and order_by is None else None
+    }
@@ -1,38 +1,54 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from typing import List, Literal, Optional
 from datetime import datetime, timezone
 
-from core.database import get_db
+from core.config import settings
+from core.database import get_async_db
 from core.security import get_api_key
+from api.pagination import TOTAL_EXACT, TotalMode, count_rows, fetch_page, fetch_task_page
+from api.serializers import select_task_rows, json_response
 from models.models import Project, Task, Agent
-from models.schemas import ProjectResponse, TaskResponse, StatsResponse, PaginationParams, PaginatedProjectResponse, PaginatedTaskResponse
+from models.schemas import ProjectResponse, TaskResponse, StatsResponse, ProjectStatsResponse, TimeseriesResponse, PaginationParams, PaginatedProjectResponse, PaginatedTaskResponse
+from services.task_counters import AsyncTaskCounterService
+from services.task_rollups import AsyncTaskRollupService, DEFAULT_WINDOWS, GRANULARITIES, to_utc
+from services.task_search import apply_text_search, apply_title_filter
 from services.websocket_service import websocket_service
 
 api_router = APIRouter()
 
+# Ошибки чтения таблиц статистики (task_counters, task_rollups), например в БД,
+# не обновлённой миграцией: такие таблицы создаются alembic upgrade head или при
+# старте приложения
+STATS_UNAVAILABLE = (OperationalError, ProgrammingError)
+STATS_UNAVAILABLE_DETAIL = "Statistics are not available, run alembic upgrade head"
+
 
 @api_router.get("/projects", response_model=PaginatedProjectResponse)
 async def get_projects(
     limit: int = 50,
     offset: int = 0,
+    total: TotalMode = TOTAL_EXACT,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить список всех проектов с пагинацией
+
+    total: exact - точное число проектов, estimate - оценка, none - без подсчёта.
     """
-    query = db.query(Project)
-    total = query.count()
-    projects = query.order_by(Project.created_at.desc()).offset(offset).limit(limit).all()
+    query = select(Project)
+    count = await count_rows(db, query, total)
+    rows, has_next = await fetch_page(db, query.order_by(Project.created_at.desc()), limit, offset)
 
     return PaginatedProjectResponse(
-        items=projects,
-        total=total,
+        items=[project for project, in rows],
+        total=count,
         limit=limit,
         offset=offset,
-        has_next=offset + limit < total,
+        has_next=has_next,
         has_prev=offset > 0
     )
 
@@ -41,12 +57,12 @@ async def get_projects(
 async def get_project(
     project_name: str,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить информацию о конкретном проекте
     """
-    project = db.query(Project).filter(Project.name == project_name).first()
+    project = await db.scalar(select(Project).where(Project.name == project_name))
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     return project
@@ -57,76 +73,64 @@ async def get_project_tasks(
     project_name: str,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    total: TotalMode = TOTAL_EXACT,
     status: Optional[str] = None,
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
     task_name: Optional[str] = None,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить список задач проекта с пагинацией и расширенной фильтрацией
+
+    Пагинация по offset или по курсору next_cursor/prev_cursor из предыдущего
+    ответа (при cursor параметр offset не используется). total: exact - точное
+    число задач, estimate - оценка, none - без подсчёта (клиентам, которым
+    нужна только кнопка следующей страницы).
     """
-    project = db.query(Project).filter(Project.name == project_name).first()
+    project = await db.scalar(select(Project).where(Project.name == project_name))
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    query = db.query(Task).filter(Task.project_id == project.id)
+    query = select_task_rows().where(Task.project_id == project.id)
 
     # Фильтры
     if status:
-        query = query.filter(Task.status == status)
+        query = query.where(Task.status == status)
 
     
     if task_name:
-        query = query.filter(Task.title.ilike(f"%{task_name}%"))
+        query = apply_title_filter(query, task_name, db.get_bind().dialect.name)
 
     if from_date:
-        query = query.filter(Task.created_at >= from_date)
+        query = query.where(Task.created_at >= from_date)
 
     if to_date:
-        query = query.filter(Task.created_at <= to_date)
-
-    total = query.count()
-    tasks = query.order_by(Task.created_at.desc()).offset(offset).limit(limit).all()
-
-    # Create TaskResponse objects directly from models
-    task_responses = []
-    for task in tasks:
-        task_response = TaskResponse(
-            id=task.id,
-            project_id=task.project_id,
-            task_id=task.task_id,
-            task=task.title,
-            agent=task.agent.name if task.agent else "",
-            status=task.status,
-            created_at=task.created_at,
-            updated_at=task.updated_at,
-            started_at=task.started_at,
-            finished_at=task.finished_at,
-            result=task.result,
-            error_message=task.error_message,
-            duration_seconds=task.duration_seconds,
-            progress=task.progress,
-            task_metadata=task.task_metadata,
-            agent_name=task.agent.name if task.agent else None
-        )
-        task_responses.append(task_response)
-
-    return PaginatedTaskResponse(
-        items=task_responses,
-        total=total,
-        limit=limit,
-        offset=offset,
-        has_next=offset + limit < total,
-        has_prev=offset > 0
-    )
+        query = query.where(Task.created_at <= to_date)
+
+    try:
+        tasks, page = await fetch_task_page(db, query, limit, offset, cursor, total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return json_response({
+        "items": [row._asdict() for row in tasks],
+        "limit": limit,
+        "offset": offset,
+        **page
+    })
 
 
 @api_router.get("/tasks/search", response_model=PaginatedTaskResponse)
 async def search_tasks(
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    total: TotalMode = TOTAL_EXACT,
+    q: Optional[str] = None,
+    sort: Optional[Literal["relevance", "created_at"]] = None,
     status: Optional[str] = None,
     project_name: Optional[str] = None,
     task_name: Optional[str] = None,
@@ -134,149 +138,173 @@ async def search_tasks(
     from_date: Optional[datetime] = None,
     to_date: Optional[datetime] = None,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Поиск задач по всем проектам с расширенной фильтрацией
+
+    q - поиск по title, description, result и error_message (все слова должны
+    встретиться); с q задачи по умолчанию сортируются по релевантности
+    (sort=relevance, только пагинация по offset), sort=created_at - новые первыми.
+    Пагинация и режимы total, как в списке задач проекта.
     """
-    query = db.query(Task)
+    query = select_task_rows()
 
     # Фильтры
     if status:
-        query = query.filter(Task.status == status)
+        query = query.where(Task.status == status)
 
 
     if project_name:
-        query = query.join(Task.project).filter(Project.name == project_name)
+        query = query.join(Task.project).where(Project.name == project_name)
 
     if task_name:
-        query = query.filter(Task.title.ilike(f"%{task_name}%"))
+        query = apply_title_filter(query, task_name, db.get_bind().dialect.name)
 
     if agent:
-        query = query.join(Task.agent).filter(Agent.name == agent)
+        query = query.where(Agent.name == agent)
 
     if from_date:
-        query = query.filter(Task.created_at >= from_date)
+        query = query.where(Task.created_at >= from_date)
 
     if to_date:
-        query = query.filter(Task.created_at <= to_date)
-
-    total = query.count()
-    tasks = query.order_by(Task.created_at.desc()).offset(offset).limit(limit).all()
-
-    # Create TaskResponse objects directly from models
-    task_responses = []
-    for task in tasks:
-        task_response = TaskResponse(
-            id=task.id,
-            project_id=task.project_id,
-            task_id=task.task_id,
-            task=task.title,
-            agent=task.agent.name if task.agent else "",
-            status=task.status,
-            created_at=task.created_at,
-            updated_at=task.updated_at,
-            started_at=task.started_at,
-            finished_at=task.finished_at,
-            result=task.result,
-            error_message=task.error_message,
-            duration_seconds=task.duration_seconds,
-            progress=task.progress,
-            task_metadata=task.task_metadata,
-            agent_name=task.agent.name if task.agent else None
-        )
-        task_responses.append(task_response)
-
-    return PaginatedTaskResponse(
-        items=task_responses,
-        total=total,
-        limit=limit,
-        offset=offset,
-        has_next=offset + limit < total,
-        has_prev=offset > 0
-    )
+        query = query.where(Task.created_at <= to_date)
+
+    relevance = None
+    if q:
+        query, relevance = apply_text_search(query, q, db.get_bind().dialect.name)
+    if sort == "created_at" or (sort is None and cursor is not None):
+        relevance = None
+
+    try:
+        tasks, page = await fetch_task_page(db, query, limit, offset, cursor, total, order_by=relevance)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return json_response({
+        "items": [row._asdict() for row in tasks],
+        "limit": limit,
+        "offset": offset,
+        **page
+    })
 
 
 @api_router.get("/tasks/{task_id}", response_model=TaskResponse)
 async def get_task(
     task_id: str,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить детальную информацию о задаче
     """
-    task = db.query(Task).filter(Task.task_id == task_id).first()
+    task = (await db.execute(select_task_rows().where(Task.task_id == task_id))).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    return TaskResponse(
-        id=task.id,
-        project_id=task.project_id,
-        task_id=task.task_id,
-        task=task.title,
-        agent=task.agent.name if task.agent else "",
-        status=task.status,
-        created_at=task.created_at,
-        updated_at=task.updated_at,
-        started_at=task.started_at,
-        finished_at=task.finished_at,
-        result=task.result,
-        error_message=task.error_message,
-        duration_seconds=task.duration_seconds,
-        progress=task.progress,
-        task_metadata=task.task_metadata,
-        agent_name=task.agent.name if task.agent else None
-    )
+    return json_response(task._asdict())
 
 
 @api_router.get("/stats", response_model=StatsResponse)
 async def get_stats(
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить общую статистику
+
+    Число проектов, число задач по статусам и средняя длительность читаются
+    из счётчиков task_counters, без COUNT по таблицам проектов и задач.
     """
-    # Общая статистика
-    total_projects = db.query(Project).count()
-    total_tasks = db.query(Task).count()
-
-    # Статистика по статусам
-    active_tasks = db.query(Task).filter(Task.status == "running").count()
-    completed_tasks = db.query(Task).filter(Task.status == "completed").count()
-    failed_tasks = db.query(Task).filter(Task.status == "failed").count()
-
-    # Средняя длительность выполненных задач
-    avg_duration_query = db.query(
-        func.avg(func.extract('epoch', Task.finished_at) - func.extract('epoch', Task.started_at))
-    ).filter(
-        and_(
-            Task.status == "completed",
-            Task.finished_at.isnot(None),
-            Task.started_at.isnot(None)
-        )
-    )
+    try:
+        totals = await AsyncTaskCounterService(db).totals()
+    except STATS_UNAVAILABLE:
+        raise HTTPException(status_code=500, detail=STATS_UNAVAILABLE_DETAIL)
 
-    avg_duration = avg_duration_query.scalar()
-    average_duration = float(avg_duration) if avg_duration else None
+    return StatsResponse(**totals)
 
-    return StatsResponse(
-        total_projects=total_projects,
-        total_tasks=total_tasks,
-        active_tasks=active_tasks,
-        completed_tasks=completed_tasks,
-        failed_tasks=failed_tasks,
-        average_duration=average_duration
+
+@api_router.get("/stats/projects/{project_name}", response_model=ProjectStatsResponse)
+async def get_project_stats(
+    project_name: str,
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Получить статистику задач проекта (из счётчиков task_counters)
+    """
+    project_id = await db.scalar(select(Project.id).where(Project.name == project_name))
+    if project_id is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    try:
+        totals = await AsyncTaskCounterService(db).totals(project_id)
+    except STATS_UNAVAILABLE:
+        raise HTTPException(status_code=500, detail=STATS_UNAVAILABLE_DETAIL)
+    return ProjectStatsResponse(project=project_name, **totals)
+
+
+@api_router.get("/stats/timeseries", response_model=TimeseriesResponse)
+async def get_stats_timeseries(
+    granularity: Literal["minute", "hour", "day"] = "hour",
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    project: Optional[str] = None,
+    agent: Optional[str] = None,
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Завершённые задачи, доля ошибок и перцентили длительности по интервалам
+
+    Ответ строится по агрегатам task_rollups без чтения таблицы задач.
+    По умолчанию окно заканчивается сейчас и длится час (minute), неделю
+    (hour) или 90 дней (day). Фильтры project и agent можно сочетать.
+    """
+    # Время без часового пояса считается UTC
+    to_date = to_utc(to_date) if to_date else datetime.now(timezone.utc)
+    from_date = to_utc(from_date) if from_date else to_date - DEFAULT_WINDOWS[granularity]
+    if from_date >= to_date:
+        raise HTTPException(status_code=400, detail="from_date must be earlier than to_date")
+    if (to_date - from_date) / GRANULARITIES[granularity] > settings.STATS_TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail="Too many points, use a coarser granularity or a shorter range")
+
+    project_id = agent_id = None
+    if project:
+        project_id = await db.scalar(select(Project.id).where(Project.name == project))
+        if project_id is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+    if agent:
+        agent_id = await db.scalar(select(Agent.id).where(Agent.name == agent))
+        if agent_id is None:
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+    try:
+        series = await AsyncTaskRollupService(db).timeseries(granularity, from_date, to_date, project_id, agent_id)
+    except STATS_UNAVAILABLE:
+        raise HTTPException(status_code=500, detail=STATS_UNAVAILABLE_DETAIL)
+    return TimeseriesResponse(
+        granularity=granularity,
+        from_date=from_date,
+        to_date=to_date,
+        project=project,
+        agent=agent,
+        **series
     )
 
 
 @api_router.get("/websocket/stats")
 async def get_websocket_stats(
+    connections: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
     api_key: str = Depends(get_api_key)
 ):
     """
     Получить статистику WebSocket подключений
+
+    По умолчанию - только агрегаты; connections=true добавляет страницу
+    (limit, offset) статистики по каждому подключению.
     """
     from fastapi.responses import JSONResponse
-    return JSONResponse(content=websocket_service.get_connection_stats())
\ No newline at end of file
+    return JSONResponse(content=websocket_service.get_connection_stats(connections, limit, offset))
\ No newline at end of file
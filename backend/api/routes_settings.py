@@ -3,16 +3,16 @@ API роуты для работы с настройками пользоват
 """
 
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
 from fastapi import Query
 from pydantic import BaseModel
 
-from core.database import get_db
+from core.database import get_async_db
 from core.security import get_api_key
 from models.models import UserSettings
-from services.settings_service import SettingsService
+from services.settings_service import AsyncSettingsService
 from models.schemas import SettingsResponse, SettingsCreateResponse, SettingsUpdateRequest
 
 settings_router = APIRouter()
@@ -21,17 +21,17 @@ settings_router = APIRouter()
 @settings_router.get("/settings", response_model=List[SettingsResponse])
 async def get_all_settings(
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить все настройки (глобальные + пользовательские)
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
-    settings = service.get_all_settings(user_id=user_id)
+    settings = await service.get_all_settings(user_id=user_id)
 
     return [SettingsResponse(**setting) for setting in settings]
 
@@ -40,17 +40,17 @@ async def get_all_settings(
 async def get_setting(
     setting_key: str,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить конкретную настройку
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
-    setting = service.get_setting(setting_key, user_id)
+    setting = await service.get_setting(setting_key, user_id)
 
     if not setting:
         raise HTTPException(status_code=404, detail="Setting not found")
@@ -61,17 +61,17 @@ async def get_setting(
 @settings_router.get("/user/settings", response_model=List[SettingsResponse])
 async def get_user_settings(
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить только пользовательские настройки
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
-    settings = service.get_user_settings(user_id)
+    settings = await service.get_user_settings(user_id)
 
     return [SettingsResponse(**setting) for setting in settings]
 
@@ -97,12 +97,12 @@ class SettingsCreateRequest(BaseModel):
 async def create_setting(
     request: SettingsCreateRequest,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Создать или обновить настройку
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key if not request.is_global else None
@@ -114,7 +114,7 @@ async def create_setting(
         pass
 
     try:
-        setting = service.set_setting(
+        setting = await service.set_setting(
             key=request.setting_key,
             value=request.value,
             user_id=user_id,
@@ -132,24 +132,24 @@ async def update_setting(
     setting_key: str,
     request: SettingsUpdateRequest,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Обновить существующую настройку
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
     # Проверяем существование настройки
-    existing_setting = service.get_setting(setting_key, user_id)
+    existing_setting = await service.get_setting(setting_key, user_id)
 
     if not existing_setting and not request.is_global:
         raise HTTPException(status_code=404, detail="Setting not found")
 
     try:
-        setting = service.set_setting(
+        setting = await service.set_setting(
             key=setting_key,
             value=request.value,
             user_id=user_id if not request.is_global else None,
@@ -166,23 +166,23 @@ async def update_setting(
 async def delete_setting(
     setting_key: str,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Удалить настройку
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
     # Проверяем существование настройки перед удалением
-    existing_setting = service.get_setting(setting_key, user_id)
+    existing_setting = await service.get_setting(setting_key, user_id)
 
     if not existing_setting:
         raise HTTPException(status_code=404, detail="Setting not found")
 
-    success = service.delete_setting(setting_key, user_id)
+    success = await service.delete_setting(setting_key, user_id)
 
     if not success:
         raise HTTPException(status_code=400, detail="Failed to delete setting")
@@ -193,17 +193,17 @@ async def delete_setting(
 @settings_router.delete("/user/settings")
 async def delete_all_user_settings(
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Удалить все пользовательские настройки
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
 
-    success = service.delete_all_user_settings(user_id)
+    success = await service.delete_all_user_settings(user_id)
 
     if not success:
         raise HTTPException(status_code=400, detail="Failed to delete user settings")
@@ -215,12 +215,12 @@ async def delete_all_user_settings(
 async def get_settings_batch(
     keys: str,  # comma-separated keys
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить несколько настроек по ключам
     """
-    service = SettingsService(db)
+    service = AsyncSettingsService(db)
 
     # Получаем user_id из api_key или используем api_key как user_id
     user_id = api_key
@@ -229,7 +229,7 @@ async def get_settings_batch(
 
     result = {}
     for key in key_list:
-        setting = service.get_setting(key, user_id)
+        setting = await service.get_setting(key, user_id)
         if setting:
             result[key] = setting
 
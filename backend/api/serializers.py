@@ -0,0 +1,47 @@
+"""
+Выборка и сериализация задач для API без построения ORM объектов
+
+Колонки задачи и имя агента выбираются одним запросом (LEFT JOIN agents),
+без загрузки Task.agent на каждую строку. Строки сериализуются в JSON
+напрямую через pydantic-core, минуя построение TaskResponse на каждую
+задачу и повторную валидацию ответа FastAPI. Имена и порядок полей
+совпадают с TaskResponse, формат дат - с сериализацией pydantic.
+"""
+
+from typing import Any
+
+from fastapi import Response
+from pydantic_core import to_json
+from sqlalchemy import func, select
+
+from models.models import Agent, Task
+
+# Колонки в порядке полей TaskResponse
+TASK_RESPONSE_COLUMNS = (
+    Task.project_id,
+    Task.task_id,
+    Task.title.label("task"),
+    func.coalesce(Agent.name, "").label("agent"),
+    Task.status,
+    Task.id,
+    Task.created_at,
+    Task.updated_at,
+    Task.started_at,
+    Task.finished_at,
+    Task.result,
+    Task.error_message,
+    Task.duration_seconds,
+    Task.progress,
+    Task.task_metadata,
+    Agent.name.label("agent_name"),
+)
+
+
+def select_task_rows():
+    """SELECT задач с колонками TaskResponse (Agent уже присоединён для фильтров)"""
+    return select(*TASK_RESPONSE_COLUMNS).select_from(Task).outerjoin(Agent, Task.agent_id == Agent.id)
+
+
+def json_response(content: Any) -> Response:
+    """JSON ответ из строк и словарей; возвращённый Response FastAPI не валидирует по response_model"""
+    return Response(content=to_json(content), media_type="application/json")
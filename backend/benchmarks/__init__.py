@@ -0,0 +1 @@
+"""Скрипты нагрузочных замеров backend"""
@@ -0,0 +1,163 @@
+"""
+Замер числа SQL-запросов и времени на вебхук finish/status/error
+
+Сравнивает прежнюю схему обработки (SELECT задачи, commit, refresh и два
+SELECT проекта/агента для уведомления) с текущей (один UPDATE ... RETURNING
+с именами проекта и агента).
+
+Замер пересоздаёт таблицы, поэтому по умолчанию идёт на временной SQLite
+базе. Другую базу можно указать в --database-url, но не из временного
+каталога - только вместе с --force: все её данные будут удалены.
+
+Запуск из каталога backend:
+    python -m benchmarks.webhook_queries [--tasks 500] [--database-url sqlite:///... [--force]]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from models.models import Base, Project, Agent, Task
+from models.schemas import WebhookStart, WebhookFinish, WebhookStatus, WebhookError
+from services.webhook_service import WebhookService
+from services.id_cache import clear_id_caches
+
+
+def legacy_finish(db: Session, data: WebhookFinish):
+    """Прежняя обработка finish: 5 запросов на событие"""
+    task = db.query(Task).filter(Task.task_id == data.task_id).first()
+    task.status = "completed"
+    task.finished_at = datetime.utcnow()
+    task.result = data.result
+    task.duration_seconds = data.duration_seconds
+    task.task_metadata = data.metadata
+    db.commit()
+    db.refresh(task)
+    db.query(Project).filter(Project.id == task.project_id).first()
+    db.query(Agent).filter(Agent.id == task.agent_id).first()
+
+
+def legacy_status(db: Session, data: WebhookStatus):
+    """Прежняя обработка status со сменой статуса"""
+    task = db.query(Task).filter(Task.task_id == data.task_id).first()
+    old_status = task.status
+    task.status = data.status
+    task.progress = data.progress
+    task.task_metadata = data.metadata
+    db.commit()
+    db.refresh(task)
+    if old_status != data.status:
+        db.query(Project).filter(Project.id == task.project_id).first()
+        db.query(Agent).filter(Agent.id == task.agent_id).first()
+
+
+def legacy_error(db: Session, data: WebhookError):
+    """Прежняя обработка error"""
+    task = db.query(Task).filter(Task.task_id == data.task_id).first()
+    task.status = "failed"
+    task.finished_at = datetime.utcnow()
+    task.error_message = f"{data.error_type}: {data.error_message}"
+    task.task_metadata = data.metadata
+    db.commit()
+    db.refresh(task)
+    db.query(Project).filter(Project.id == task.project_id).first()
+    db.query(Agent).filter(Agent.id == task.agent_id).first()
+
+
+def _events(kind: str, task_ids: List[str]):
+    common = {"project": "bench-project", "task": "bench", "agent": "bench-agent"}
+    if kind == "finish":
+        return [WebhookFinish(task_id=task_id, result="ok", duration_seconds=1, **common) for task_id in task_ids]
+    if kind == "status":
+        return [WebhookStatus(task_id=task_id, status="paused", progress=50, **common) for task_id in task_ids]
+    return [WebhookError(task_id=task_id, error_type="E", error_message="boom", **common) for task_id in task_ids]
+
+
+def _is_temporary(database_url: str) -> bool:
+    """База - SQLite файл во временном каталоге (или в памяти)"""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return False
+    if not url.database or url.database == ":memory:":
+        return True
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    return os.path.commonpath([os.path.realpath(url.database), temp_dir]) == temp_dir
+
+
+def _run(engine, session_factory, handler: Callable, kind: str, tasks: int) -> Dict[str, float]:
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+
+    task_ids = [f"bench-{kind}-{index}" for index in range(tasks)]
+    with session_factory() as db:
+        service = WebhookService(db)
+        for task_id in task_ids:
+            service.handle_start_webhook(WebhookStart(
+                project="bench-project", task="bench", task_id=task_id, agent="bench-agent"
+            ))
+
+    statements = 0
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    started = time.perf_counter()
+    for data in _events(kind, task_ids):
+        # Отдельная сессия на событие, как у обработчика запроса
+        with session_factory() as db:
+            handler(db, data)
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count)
+
+    return {"queries_per_event": statements / tasks, "events_per_second": tasks / elapsed}
+
+
+def run(database_url: str, tasks: int):
+    engine = create_engine(database_url)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    current = {
+        "finish": lambda db, data: WebhookService(db).handle_finish_webhook(data),
+        "status": lambda db, data: WebhookService(db).handle_status_webhook(data),
+        "error": lambda db, data: WebhookService(db).handle_error_webhook(data),
+    }
+    legacy = {"finish": legacy_finish, "status": legacy_status, "error": legacy_error}
+
+    print(f"{'event':<8} {'variant':<8} {'queries/event':>14} {'events/s':>10}")
+    # WebSocket уведомления в замере не отправляются
+    with patch.object(WebhookService, "_notify", staticmethod(lambda coroutine: coroutine.close())):
+        for kind in ("finish", "status", "error"):
+            for variant, handlers in (("before", legacy), ("after", current)):
+                result = _run(engine, session_factory, handlers[kind], kind, tasks)
+                print(f"{kind:<8} {variant:<8} {result['queries_per_event']:>14.1f} {result['events_per_second']:>10.0f}")
+
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--database-url", help="база для замера (по умолчанию временная SQLite)")
+    parser.add_argument("--force", action="store_true", help="разрешить замер на базе вне временного каталога")
+    args = parser.parse_args()
+
+    if args.database_url and not args.force and not _is_temporary(args.database_url):
+        parser.error("benchmark drops all tables; use a temporary SQLite database or pass --force")
+
+    with tempfile.TemporaryDirectory(prefix="webhook_queries_") as directory:
+        run(args.database_url or f"sqlite:///{os.path.join(directory, 'bench.db')}", args.tasks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Нагрузочный замер рассылки WebSocket уведомлений
+
+Запускает в отдельном процессе сервер uvicorn с роутерами вебхуков и WebSocket
+на временной SQLite базе (без Redis), открывает N клиентов с подписками на
+разные проекты (часть клиентов - без фильтра, как глобальный дашборд) и
+отправляет POST /webhook/status (или /webhook/start) с заданной частотой.
+Каждое событие проходит весь путь: приём вебхука, запись в БД и рассылку.
+Вебхуки статуса чередуют paused/running, чтобы каждый менял статус задачи
+и порождал уведомление.
+
+Сообщает задержку доставки от отправки вебхука до получения клиентом
+(p50/p90/p99/max), задержку ответа на вебхук, число доставленных сообщений
+в секунду, CPU и память сервера на подключение и записывает результат в JSON
+для сравнения между коммитами.
+
+Запуск из каталога backend:
+    python -m benchmarks.ws_load [--clients 1000] [--projects 20] [--rate 200] [--duration 10]
+                                 [--event status] [--batch-ms 0] [--output ws_load.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Флаг запуска процесса-сервера замера
+SERVE_FLAG = "--serve"
+
+# Вебхук события и поле уведомления, по которому клиент находит номер события
+EVENT_WEBHOOKS = {
+    "status": ("/webhook/status", "message"),
+    "started": ("/webhook/start", "title"),
+}
+
+# Статусы, которые чередуют вебхуки статуса одной задачи
+STATUS_CYCLE = ("paused", "running")
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux), иначе пиковый"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def create_app():
+    """
+    Приложение сервера замера: роутеры вебхуков и WebSocket и статистика процесса
+
+    БД берётся из DATABASE_URL, который задаёт процесс замера.
+    """
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from core.database import engine, async_engine
+    from models.models import Base
+    from services.progress_buffer import progress_buffer
+    from services.task_counters import ensure_task_counters, task_counters_job
+    from services.task_rollups import ensure_task_rollups
+    from services.task_search import ensure_search_index
+    from services.websocket_service import websocket_service
+    from webhook.routes import webhook_router
+    from webhook.websocket_routes import websocket_router
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        Base.metadata.create_all(bind=engine)
+        ensure_search_index(engine)
+        ensure_task_counters(engine)
+        ensure_task_rollups(engine)
+        await progress_buffer.start()
+        await task_counters_job.start()
+        yield
+        await progress_buffer.stop()
+        await task_counters_job.stop()
+        await websocket_service.close()
+        await async_engine.dispose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(webhook_router, prefix="/webhook")
+    app.include_router(websocket_router, prefix="/webhook")
+
+    @app.get("/bench/stats")
+    async def bench_stats() -> Dict[str, Any]:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        stats = websocket_service.get_connection_stats()
+        return {
+            "cpu_seconds": usage.ru_utime + usage.ru_stime,
+            "rss_bytes": _rss_bytes(),
+            "connections": stats["total_connections"],
+            "evicted": stats["evicted_slow_clients"],
+            "dropped": stats["dropped_messages"],
+            "coalesced": stats["coalesced_messages"]
+        }
+
+    return app
+
+
+def serve(port: int):
+    import uvicorn
+    uvicorn.run(create_app(), host="127.0.0.1", port=port, log_level="warning")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _task_id(index: int, tasks: int) -> str:
+    return f"bench-task-{index % tasks}"
+
+
+def _project(index: int, tasks: int, projects: int) -> str:
+    # Проект закреплён за задачей, как у настоящих вебхуков
+    return f"bench-{index % tasks % projects}"
+
+
+class LoadClients:
+    """Клиенты замера: считают полученные события и задержку доставки"""
+
+    def __init__(self, field: str):
+        self.field = field
+        # Время отправки вебхука по номеру события (часы этого же процесса)
+        self.sent: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.received = 0
+        self.frames = 0
+        self.closed = 0
+        self.last_received = time.monotonic()
+
+    def handle(self, raw: str):
+        self.frames += 1
+        messages = json.loads(raw)
+        now = time.time()
+        for message in messages if isinstance(messages, list) else (messages,):
+            marker = (message.get("data") or {}).get(self.field) or ""
+            sent_at = self.sent.get(int(marker[6:])) if marker.startswith("bench ") else None
+            if sent_at is None:
+                continue
+            self.received += 1
+            self.latencies.append(now - sent_at)
+        self.last_received = time.monotonic()
+
+    async def run(self, url: str, connected: asyncio.Event):
+        import websockets
+        try:
+            async with websockets.connect(url, max_queue=None, open_timeout=60) as websocket:
+                await websocket.recv()  # приветствие
+                connected.set()
+                async for raw in websocket:
+                    self.handle(raw)
+        except Exception:
+            self.closed += 1
+        finally:
+            connected.set()
+
+
+async def create_tasks(http, args):
+    """Создать задачи замера пачками до подключения клиентов"""
+    from core.config import settings
+
+    for start in range(0, args.tasks, settings.WEBHOOK_BATCH_MAX_SIZE):
+        events = [
+            {
+                "event": "start",
+                "task_id": _task_id(index, args.tasks),
+                "project": _project(index, args.tasks, args.projects),
+                "agent": "bench-agent",
+                "task": f"bench task {index}"
+            }
+            for index in range(start, min(start + settings.WEBHOOK_BATCH_MAX_SIZE, args.tasks))
+        ]
+        response = await http.post("/webhook/batch", json={"events": events})
+        response.raise_for_status()
+
+
+async def drive(http, args, clients: LoadClients) -> Dict[str, Any]:
+    """Отправлять rate вебхуков в секунду в течение duration секунд"""
+    path, _ = EVENT_WEBHOOKS[args.event]
+    slots = asyncio.Semaphore(args.http_concurrency)
+    webhook_latencies: List[float] = []
+    failed = 0
+
+    async def post(index: int, body: Dict[str, Any]):
+        nonlocal failed
+        try:
+            clients.sent[index] = time.time()
+            started = time.perf_counter()
+            response = await http.post(path, json=body)
+            webhook_latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failed += 1
+        except Exception:
+            failed += 1
+        finally:
+            slots.release()
+
+    loop = asyncio.get_running_loop()
+    total = int(args.rate * args.duration)
+    pending = []
+    started = loop.time()
+    for index in range(total):
+        delay = started + index / args.rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = {
+            "task_id": _task_id(index, args.tasks),
+            "project": _project(index, args.tasks, args.projects),
+            "agent": "bench-agent",
+            "task": f"bench {index}"
+        }
+        if args.event == "status":
+            body.update({
+                "status": STATUS_CYCLE[index // args.tasks % 2],
+                "progress": index % 100,
+                "message": f"bench {index}"
+            })
+        await slots.acquire()
+        pending.append(asyncio.create_task(post(index, body)))
+    await asyncio.gather(*pending)
+
+    webhook_latencies.sort()
+    return {
+        "events": total,
+        "failed": failed,
+        "elapsed": loop.time() - started,
+        "webhook_latency_ms": {
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (
+                ("p50", _percentile(webhook_latencies, 50)),
+                ("p99", _percentile(webhook_latencies, 99)),
+            )
+        }
+    }
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    import httpx
+    from core.config import settings
+
+    port = _free_port()
+    database = tempfile.TemporaryDirectory(prefix="ws_load_")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(database.name, 'bench.db')}",
+        WEBHOOK_INGEST_MODE="sync",
+        DEBUG="false"
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.ws_load", SERVE_FLAG, "--port", str(port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    clients = LoadClients(EVENT_WEBHOOKS[args.event][1])
+    tasks: List[asyncio.Task] = []
+    limits = httpx.Limits(max_connections=args.http_concurrency)
+
+    try:
+        async with httpx.AsyncClient(
+            base_url=base_url, timeout=None, limits=limits, headers={"X-API-Key": settings.API_KEY}
+        ) as http:
+            for _ in range(100):
+                try:
+                    idle = (await http.get("/bench/stats")).json()
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("Benchmark server did not start")
+
+            if args.event == "status":
+                await create_tasks(http, args)
+
+            # Подключение клиентов пачками, чтобы не переполнить очередь accept
+            global_clients = int(args.clients * args.global_ratio)
+            subscribers = {project: 0 for project in range(args.projects)}
+            connect_started = time.perf_counter()
+            for start in range(0, args.clients, args.connect_batch):
+                events = []
+                for index in range(start, min(start + args.connect_batch, args.clients)):
+                    url = f"ws://127.0.0.1:{port}/webhook/ws?batch_ms={args.batch_ms}"
+                    if index >= global_clients:
+                        project = index % args.projects
+                        subscribers[project] += 1
+                        url += f"&project=bench-{project}"
+                    connected = asyncio.Event()
+                    tasks.append(asyncio.create_task(clients.run(url, connected)))
+                    events.append(connected)
+                await asyncio.gather(*(event.wait() for event in events))
+            connect_seconds = time.perf_counter() - connect_started
+
+            loaded = (await http.get("/bench/stats")).json()
+            drive_started = time.monotonic()
+            driven = await drive(http, args, clients)
+
+            # Дожидаемся доставки хвоста очередей
+            while time.monotonic() - clients.last_received < 1.0:
+                await asyncio.sleep(0.2)
+            delivery_seconds = clients.last_received - drive_started
+            finished = (await http.get("/bench/stats")).json()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        server.terminate()
+        server.wait()
+        database.cleanup()
+
+    # Ожидаемое число доставок: события проекта получают его подписчики и глобальные клиенты
+    expected = sum(
+        subscribers[index % args.tasks % args.projects] + global_clients for index in range(driven["events"])
+    )
+    latencies = sorted(clients.latencies)
+    connections = max(loaded["connections"], 1)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "params": vars(args),
+        "connected": loaded["connections"],
+        "connect_seconds": round(connect_seconds, 3),
+        "events": driven["events"],
+        "webhook_failures": driven["failed"],
+        "webhook_latency_ms": driven["webhook_latency_ms"],
+        "expected_deliveries": expected,
+        "delivered": clients.received,
+        "frames": clients.frames,
+        "dropped": finished["dropped"],
+        "coalesced": finished["coalesced"],
+        "evicted": finished["evicted"],
+        "client_errors": clients.closed,
+        "messages_per_second": round(clients.received / max(delivery_seconds, 1e-9), 1),
+        "latency_ms": {
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (
+                ("p50", _percentile(latencies, 50)),
+                ("p90", _percentile(latencies, 90)),
+                ("p99", _percentile(latencies, 99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+        "server": {
+            "rss_idle_bytes": idle["rss_bytes"],
+            "rss_loaded_bytes": loaded["rss_bytes"],
+            "memory_per_connection_bytes": round((loaded["rss_bytes"] - idle["rss_bytes"]) / connections),
+            "cpu_seconds_drive": round(finished["cpu_seconds"] - loaded["cpu_seconds"], 3),
+            "cpu_ms_per_connection": round(
+                (finished["cpu_seconds"] - loaded["cpu_seconds"]) * 1000 / connections, 3
+            ),
+            "cpu_us_per_delivery": round(
+                (finished["cpu_seconds"] - loaded["cpu_seconds"]) * 1e6 / max(clients.received, 1), 3
+            )
+        }
+    }
+
+
+def main():
+    if SERVE_FLAG in sys.argv:
+        serve(int(sys.argv[sys.argv.index("--port") + 1]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--global-ratio", type=float, default=0.1, help="доля клиентов без фильтра по проекту")
+    parser.add_argument("--rate", type=float, default=200, help="вебхуков в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="длительность генерации, секунд")
+    parser.add_argument("--tasks", type=int, default=500, help="число разных task_id в вебхуках")
+    parser.add_argument("--event", choices=sorted(EVENT_WEBHOOKS), default="status")
+    parser.add_argument("--http-concurrency", type=int, default=50, help="одновременных запросов вебхуков")
+    parser.add_argument("--batch-ms", type=int, default=0, help="окно пакетной отправки клиентов")
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--output", default="ws_load.json", help="файл с результатом в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+
+    latency = result["latency_ms"]
+    server = result["server"]
+    print(f"clients:          {result['connected']} (connected in {result['connect_seconds']} s)")
+    print(f"webhooks:         {result['events']} ({result['webhook_failures']} failed), "
+          f"latency ms p50 {result['webhook_latency_ms']['p50']}  p99 {result['webhook_latency_ms']['p99']}")
+    print(f"events:           {result['events']} -> {result['delivered']} of {result['expected_deliveries']} "
+          f"deliveries in {result['frames']} frames "
+          f"(coalesced {result['coalesced']}, dropped {result['dropped']}, evicted {result['evicted']})")
+    print(f"throughput:       {result['messages_per_second']} msg/s")
+    print(f"latency ms:       p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"memory/conn:      {server['memory_per_connection_bytes']} B")
+    print(f"cpu:              {server['cpu_seconds_drive']} s total, {server['cpu_ms_per_connection']} ms/conn, "
+          f"{server['cpu_us_per_delivery']} us/delivery")
+    print(f"result written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,80 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     BASE_URL: str = f"http://localhost:8002"
 
+    # Webhooks
+    WEBHOOK_BATCH_MAX_SIZE: int = 1000
+    NAME_ID_CACHE_SIZE: int = 10000
+
+    # Слияние обновлений прогресса: интервал сброса в БД (0 - писать сразу)
+    PROGRESS_FLUSH_INTERVAL: float = 1.0
+    PROGRESS_KNOWN_TASKS_SIZE: int = 100000
+    # Сколько секунд статус задачи в кэше буфера считается актуальным без сверки с БД
+    # (его подтверждают запись статуса и каждый сброс прогресса задачи)
+    PROGRESS_STATUS_TTL: float = 5.0
+
+    # Ingestion: sync - запись в БД в обработчике, stream - через Redis stream и воркер
+    WEBHOOK_INGEST_MODE: str = "sync"
+    WEBHOOK_STREAM_KEY: str = "webhook:events"
+    WEBHOOK_STREAM_DEAD_LETTER_KEY: str = "webhook:events:dead"
+    WEBHOOK_STREAM_GROUP: str = "webhook-workers"
+    WEBHOOK_STREAM_MAXLEN: int = 1000000
+    WEBHOOK_CONSUMER_BATCH_SIZE: int = 500
+    WEBHOOK_CONSUMER_BLOCK_MS: int = 1000
+    WEBHOOK_CONSUMER_CLAIM_IDLE_MS: int = 60000
+    # Временные ошибки БД: запись остаётся неподтверждённой и доставляется повторно,
+    # в dead-letter - после стольких доставок
+    WEBHOOK_CONSUMER_MAX_DELIVERIES: int = 10
+    WEBHOOK_CONSUMER_IN_PROCESS: bool = False
+
+    # Идемпотентность вебхуков: TTL для Idempotency-Key и для ключей, вычисленных по содержимому.
+    # Дедупликация запросов без ключа включается WEBHOOK_DEDUP_TTL > 0 (не больше 10 секунд,
+    # только для повторов транспорта: одинаковый вебхук может прийти и законно)
+    WEBHOOK_IDEMPOTENCY_TTL: int = 86400
+    WEBHOOK_DEDUP_TTL: int = 0
+    WEBHOOK_IDEMPOTENCY_LOCK_TTL: int = 30
+
+    # Потоковый импорт NDJSON: размер пачки событий на одну транзакцию
+    WEBHOOK_IMPORT_CHUNK_SIZE: int = 5000
+
+    # Пагинация: кэш total для ?total=estimate и порог, ниже которого оценка заменяется точным COUNT
+    PAGINATION_COUNT_CACHE_TTL: float = 10.0
+    PAGINATION_COUNT_CACHE_SIZE: int = 1024
+    PAGINATION_ESTIMATE_EXACT_BELOW: int = 10000
+
+    # Счётчики задач для /api/stats: интервал свёртки журнала изменений (0 - без фонового цикла)
+    # и интервал сверки с таблицей tasks (0 - без сверки)
+    TASK_COUNTERS_FLUSH_INTERVAL: float = 1.0
+    TASK_COUNTERS_RECONCILE_INTERVAL: float = 3600.0
+
+    # Агрегаты завершённых задач для /api/stats/timeseries: срок хранения минутных и часовых
+    # агрегатов (0 - хранить всегда; дневные хранятся всегда) и максимум точек в ответе
+    STATS_ROLLUP_MINUTE_RETENTION_HOURS: float = 48.0
+    STATS_ROLLUP_HOUR_RETENTION_DAYS: float = 90.0
+    STATS_TIMESERIES_MAX_POINTS: int = 5000
+
+    # Рассылка WebSocket уведомлений: memory (один процесс) | redis (pub/sub между воркерами)
+    WEBSOCKET_BROADCAST_BACKEND: str = "memory"
+    WEBSOCKET_CHANNEL_PREFIX: str = "ws:events"
+    # Таймаут отправки одному клиенту; не успевший клиент отключается
+    WEBSOCKET_SEND_TIMEOUT: float = 5.0
+    # Очередь исходящих сообщений на клиента и допустимое отставание до отключения
+    WEBSOCKET_QUEUE_SIZE: int = 256
+    WEBSOCKET_MAX_LAG_SECONDS: float = 30.0
+    # Сколько последних событий хранить для повтора при переподключении (?since=<seq>)
+    WEBSOCKET_REPLAY_SIZE: int = 1000
+    # Максимум задач в снимке, если пропущенные события уже вытеснены из журнала
+    WEBSOCKET_SNAPSHOT_LIMIT: int = 1000
+    # Максимальное окно пакетной отправки событий (?batch_ms=), мс
+    WEBSOCKET_MAX_BATCH_MS: int = 1000
+    # SSE (/webhook/events): интервал keepalive-комментариев и задержка переподключения клиента
+    SSE_KEEPALIVE_SECONDS: float = 15.0
+    SSE_RETRY_MS: int = 3000
+    # Интервал ping от сервера и время без входящих сообщений, после которого WebSocket закрывается
+    WEBSOCKET_PING_INTERVAL: float = 25.0
+    WEBSOCKET_IDLE_TIMEOUT: float = 75.0
+    # Сколько задача-писатель WebSocket клиента ждёт новых сообщений, прежде чем завершиться
+    WEBSOCKET_WRITER_LINGER_SECONDS: float = 1.0
+
     # Security
     SECRET_KEY: str = "dev-secret-key"
     API_KEY: str = "dev-api-key"
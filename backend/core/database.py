@@ -1,8 +1,26 @@
 from sqlalchemy import create_engine
+from sqlalchemy.util import await_only
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
+# Асинхронные драйверы для синхронных URL из настроек
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """Преобразовать DATABASE_URL в URL с асинхронным драйвером (asyncpg/aiosqlite)"""
+    scheme, separator, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}"
+
+
 # Создание engine для PostgreSQL
 engine = create_engine(
     settings.DATABASE_URL,
@@ -11,16 +29,58 @@ engine = create_engine(
     echo=settings.DEBUG
 )
 
+# Асинхронный engine для обработчиков FastAPI
+async_engine = create_async_engine(
+    get_async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=300,
+    echo=settings.DEBUG
+)
+
 # Создание сессии
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Базовый класс для моделей
 Base = declarative_base()
 
+
+def dialect_insert(db, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта сессии (PostgreSQL, SQLite)"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"ON CONFLICT is not supported for dialect {dialect}")
+
+
+def supports_copy(db) -> bool:
+    """Поддерживает ли соединение сессии COPY (PostgreSQL через asyncpg)"""
+    bind = db.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "asyncpg"
+
+
+def copy_records(db, table_name: str, columns, records) -> None:
+    """
+    Загрузить записи в таблицу через COPY в транзакции сессии
+
+    Вызывается из синхронного кода внутри AsyncSession.run_sync.
+    """
+    driver_connection = db.connection().connection.driver_connection
+    await_only(driver_connection.copy_records_to_table(table_name, records=records, columns=list(columns)))
+
+
 # Зависимость для получения сессии БД
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Зависимость для получения асинхронной сессии БД
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
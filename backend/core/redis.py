@@ -1,5 +1,5 @@
 import redis.asyncio as redis
-from typing import Optional
+from typing import Optional, Dict, List, Tuple
 import json
 import pickle
 from core.config import settings
@@ -26,9 +26,9 @@ class RedisClient:
             await self.redis.close()
             print("Disconnected from Redis")
 
-    async def set(self, key: str, value: str, expire: Optional[int] = None):
-        """Сохранение строки"""
-        await self.redis.set(key, value, ex=expire)
+    async def set(self, key: str, value: str, expire: Optional[int] = None, nx: bool = False) -> bool:
+        """Сохранение строки (nx=True - только если ключа ещё нет)"""
+        return bool(await self.redis.set(key, value, ex=expire, nx=nx))
 
     async def get(self, key: str) -> Optional[str]:
         """Получение строки"""
@@ -72,6 +72,98 @@ class RedisClient:
         keys = await self.redis.keys(pattern)
         return [key.decode('utf-8') for key in keys]
 
+    async def xadd(self, stream: str, fields: dict, maxlen: Optional[int] = None) -> str:
+        """Добавление записи в stream"""
+        entry_id = await self.redis.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        return entry_id.decode('utf-8')
+
+    async def xadd_many(self, stream: str, entries: List[dict], maxlen: Optional[int] = None) -> List[str]:
+        """Добавление нескольких записей в stream за один round trip"""
+        pipe = self.redis.pipeline(transaction=False)
+        for fields in entries:
+            pipe.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        return [entry_id.decode('utf-8') for entry_id in await pipe.execute()]
+
+    async def xgroup_create(self, stream: str, group: str, id: str = "0"):
+        """Создание группы потребителей (и самого stream), если её ещё нет"""
+        try:
+            await self.redis.xgroup_create(stream, group, id=id, mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def xreadgroup(self, group: str, consumer: str, stream: str, count: Optional[int] = None,
+                         block: Optional[int] = None, last_id: str = ">") -> List[Tuple[str, dict]]:
+        """
+        Чтение записей stream в составе группы
+
+        last_id=">" - новые записи, "0" - неподтверждённые записи этого потребителя
+        (записи, уже удалённые из stream, пропускаются)
+        """
+        response = await self.redis.xreadgroup(group, consumer, {stream: last_id}, count=count, block=block)
+        if not response:
+            return []
+        return [self._decode_entry(entry) for entry in response[0][1] if entry[1]]
+
+    async def xautoclaim(self, stream: str, group: str, consumer: str, min_idle_time: int,
+                         count: Optional[int] = None) -> List[Tuple[str, dict]]:
+        """Перехват записей, зависших у других потребителей дольше min_idle_time мс"""
+        response = await self.redis.xautoclaim(stream, group, consumer, min_idle_time, count=count)
+        return [self._decode_entry(entry) for entry in response[1] if entry[1]]
+
+    async def xack(self, stream: str, group: str, *ids: str) -> int:
+        """Подтверждение обработки записей"""
+        if not ids:
+            return 0
+        return await self.redis.xack(stream, group, *ids)
+
+    async def xdelivery_counts(self, stream: str, group: str, ids: List[str]) -> Dict[str, int]:
+        """Число доставок ожидающих подтверждения записей (XPENDING) за один round trip"""
+        pipe = self.redis.pipeline(transaction=False)
+        for entry_id in ids:
+            pipe.xpending_range(stream, group, min=entry_id, max=entry_id, count=1)
+        return {
+            entry["message_id"].decode('utf-8'): entry["times_delivered"]
+            for pending in await pipe.execute()
+            for entry in pending
+        }
+
+    async def xrange(self, stream: str, min: str = "-", max: str = "+",
+                     count: Optional[int] = None) -> List[Tuple[str, dict]]:
+        """Чтение диапазона записей stream"""
+        entries = await self.redis.xrange(stream, min=min, max=max, count=count)
+        return [self._decode_entry(entry) for entry in entries]
+
+    async def xlen(self, stream: str) -> int:
+        """Длина stream"""
+        return await self.redis.xlen(stream)
+
+    async def xinfo_groups(self, stream: str) -> List[dict]:
+        """Информация о группах потребителей stream"""
+        try:
+            groups = await self.redis.xinfo_groups(stream)
+        except redis.ResponseError:
+            return []
+        return [
+            {
+                key: value.decode('utf-8') if isinstance(value, bytes) else value
+                for key, value in group.items()
+            }
+            for group in groups
+        ]
+
+    @staticmethod
+    def _decode_entry(entry) -> Tuple[str, dict]:
+        entry_id, fields = entry
+        return entry_id.decode('utf-8'), {
+            key.decode('utf-8'): value.decode('utf-8')
+            for key, value in fields.items()
+        }
+
+    async def run_script(self, script: str, keys: List[str], args: List) -> any:
+        """Выполнение Lua-скрипта (EVALSHA с загрузкой скрипта при необходимости)"""
+        return await self.redis.register_script(script)(keys=keys, args=args)
+
     async def flushdb(self):
         """Очистка текущей базы данных"""
         await self.redis.flushdb()
@@ -4,13 +4,21 @@ from contextlib import asynccontextmanager
 import uvicorn
 
 from core.config import settings
-from core.database import engine, get_db
+from core.database import engine, async_engine, get_db, SessionLocal
 from core.redis import redis_client
 from models.models import Base
 from webhook.routes import webhook_router
 from api.routes import api_router
 from webhook.websocket_routes import websocket_router
+from webhook.sse_routes import sse_router
 from api.routes_settings import settings_router
+from services.ingest_service import webhook_consumer
+from services.id_cache import warm_id_caches
+from services.progress_buffer import progress_buffer
+from services.task_counters import ensure_task_counters, task_counters_job
+from services.task_rollups import ensure_task_rollups
+from services.task_search import ensure_search_index
+from services.websocket_service import websocket_service
 
 
 @asynccontextmanager
@@ -19,13 +27,47 @@ async def lifespan(app: FastAPI):
     print("Creating database tables...")
     Base.metadata.create_all(bind=engine)
     print("Database tables created successfully!")
+    # Поисковый индекс задач SQLite для БД, созданной до его появления
+    ensure_search_index(engine)
+    # Триггеры счётчиков задач для /api/stats (и их заполнение для существующей БД)
+    ensure_task_counters(engine)
+    # Журнал завершений и агрегаты для /api/stats/timeseries
+    ensure_task_rollups(engine)
+
+    # Прогрев кэша id проектов и агентов
+    with SessionLocal() as db:
+        warm_id_caches(db)
+
+    # Фоновый сброс отложенных обновлений прогресса
+    await progress_buffer.start()
+
+    # Свёртка журнала счётчиков задач и периодическая сверка с tasks
+    await task_counters_job.start()
 
     # Подключение к Redis
     print("Connecting to Redis...")
     await redis_client.connect()
 
+    # Приём WebSocket уведомлений от других воркеров через Redis pub/sub
+    await websocket_service.start_broadcast()
+
+    # Ping WebSocket клиентов и закрытие не отвечающих соединений
+    await websocket_service.start_heartbeat()
+
+    # Потребитель Redis stream вебхуков в текущем процессе
+    if settings.WEBHOOK_CONSUMER_IN_PROCESS:
+        print("Starting webhook stream consumer...")
+        await webhook_consumer.start()
+
     yield
-    # Shutdown: отключение от Redis
+    # Shutdown: остановка потребителя, сброс прогресса и отключение от Redis
+    await webhook_consumer.stop()
+    await progress_buffer.stop()
+    await task_counters_job.stop()
+    await websocket_service.stop_heartbeat()
+    await websocket_service.stop_broadcast()
+    await websocket_service.close()
+    await async_engine.dispose()
     print("Disconnecting from Redis...")
     await redis_client.disconnect()
 
@@ -50,6 +92,7 @@ app.add_middleware(
 app.include_router(webhook_router, prefix="/webhook", tags=["webhook"])
 app.include_router(api_router, prefix="/api", tags=["api"])
 app.include_router(websocket_router, prefix="/webhook", tags=["websocket"])
+app.include_router(sse_router, prefix="/webhook", tags=["sse"])
 app.include_router(settings_router, prefix="/api", tags=["settings"])
 
 
@@ -68,8 +111,8 @@ async def db_check():
     """Проверка подключения к базе данных"""
     try:
         from sqlalchemy import text
-        with engine.connect() as connection:
-            result = connection.execute(text("SELECT version()"))
+        async with async_engine.connect() as connection:
+            result = await connection.execute(text("SELECT version()"))
             version = result.fetchone()[0]
         return {
             "status": "connected",
@@ -6,6 +6,7 @@ MCP Adapter for Agent Task Tracker
 """
 
 import json
+import uuid
 import asyncio
 import logging
 from typing import Dict, Any, Optional, List
@@ -57,21 +58,36 @@ class MCPAdapter:
         self,
         method: str,
         endpoint: str,
-        data: Optional[Dict[str, Any]] = None
+        data: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Выполнить HTTP-запрос к API"""
+        """
+        Выполнить HTTP-запрос к API
+
+        POST-запросы отправляются с заголовком Idempotency-Key, одинаковым для всех
+        повторов, чтобы сервер не обрабатывал одно событие дважды.
+        """
         if not self.session:
             raise RuntimeError("MCPAdapter must be used as async context manager")
 
         url = f"{self.config.base_url}{endpoint}"
+        headers = {}
+        if method == "POST":
+            headers["Idempotency-Key"] = idempotency_key or uuid.uuid4().hex
 
         for attempt in range(self.config.retry_attempts):
             try:
                 logger.info(f"MCP Request: {method} {url} (attempt {attempt + 1})")
 
-                response = await self.session.request(method, url, json=data)
+                response = await self.session.request(method, url, json=data, headers=headers)
+
+                if response.status_code == 409 and attempt < self.config.retry_attempts - 1:
+                    # Предыдущая попытка ещё обрабатывается сервером
+                    logger.info(f"MCP Request in progress on server, retrying: {url}")
+                    await asyncio.sleep(1 * (attempt + 1))
+                    continue
 
-                if response.status_code == 200:
+                if 200 <= response.status_code < 300:
                     result = response.json()
                     logger.info(f"MCP Response: {result}")
                     return result
@@ -1,16 +1,54 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, JSON, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, JSON, ForeignKey, UniqueConstraint, Index, text, literal_column
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 from core.database import Base
 
 
+class _SQLiteTimestamp(sqlite.DATETIME):
+    """DATETIME SQLite, время без микросекунд записывается как CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS')"""
+
+    def bind_processor(self, dialect):
+        process = super().bind_processor(dialect)
+
+        def bind(value):
+            if isinstance(value, datetime) and not value.microsecond:
+                return value.strftime("%Y-%m-%d %H:%M:%S")
+            return process(value)
+
+        return bind
+
+
+class Timestamp(TypeDecorator):
+    """
+    DateTime(timezone=True) с единственным текстовым представлением момента на SQLite
+
+    SQLite сравнивает даты как строки: значение по умолчанию CURRENT_TIMESTAMP
+    хранится без дробной части, а SQLAlchemy по умолчанию пишет '.000000', и
+    '10:00:00' < '10:00:00.000000'. Здесь дробная часть пишется только ненулевой,
+    поэтому сравнения с параметром (курсор пагинации, фильтры по дате) совпадают
+    с порядком ORDER BY.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(_SQLiteTimestamp(timezone=True))
+        return dialect.type_descriptor(DateTime(timezone=True))
+
+
 class Project(Base):
     __tablename__ = "projects"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, index=True, nullable=False)
     description = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Индекс для списка проектов (новые первыми)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # Отношения
@@ -43,8 +81,8 @@ class Task(Base):
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=False, index=True)
 
-    # Временные метки
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Временные метки (created_at - ключ курсорной пагинации)
+    created_at = Column(Timestamp, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     started_at = Column(DateTime(timezone=True), nullable=True)
     finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -62,6 +100,102 @@ class Task(Base):
     project = relationship("Project", back_populates="tasks")
     agent = relationship("Agent", back_populates="tasks")
 
+    # Индексы под формы запросов списков: фильтр по проекту, агенту или статусу
+    # с сортировкой по (created_at, id), включая курсорную пагинацию; частичный
+    # индекс выполняющихся задач - для снимка WebSocket
+    __table_args__ = (
+        Index("ix_tasks_project_created", "project_id", "created_at", "id"),
+        Index("ix_tasks_agent_created", "agent_id", "created_at", "id"),
+        Index("ix_tasks_status_created", "status", "created_at", "id"),
+        Index("ix_tasks_created", "created_at", "id"),
+        Index(
+            "ix_tasks_running_started", "started_at",
+            postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'")
+        ),
+    )
+
+
+# Условие частичного индекса ix_tasks_running_started. Статус в запросах - литерал,
+# а не параметр: по параметру планировщик (и подготовленный план asyncpg) не может
+# доказать условие индекса
+TASK_IS_RUNNING = Task.status == literal_column("'running'")
+
+
+class TaskCounter(Base):
+    """Число задач и сумма длительностей выполненных задач по проекту и статусу"""
+    __tablename__ = "task_counters"
+
+    project_id = Column(Integer, primary_key=True)
+    status = Column(String(50), primary_key=True)
+    tasks = Column(Integer, nullable=False, default=0)
+    duration_sum = Column(Float, nullable=False, default=0.0)
+    duration_count = Column(Integer, nullable=False, default=0)
+
+
+class TaskCounterDelta(Base):
+    """
+    Изменение счётчиков, записанное триггером на tasks
+
+    Журнал только пополняется (без блокировки строк task_counters в транзакции
+    вебхука) и периодически сворачивается в task_counters.
+    """
+    __tablename__ = "task_counter_deltas"
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, nullable=False)
+    status = Column(String(50), nullable=False)
+    tasks = Column(Integer, nullable=False)
+    duration_sum = Column(Float, nullable=False)
+    duration_count = Column(Integer, nullable=False)
+
+
+class TaskFinishEvent(Base):
+    """Завершение задачи (completed/failed), записанное триггером на tasks; сворачивается в TaskRollup"""
+    __tablename__ = "task_finish_events"
+
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, nullable=False)
+    agent_id = Column(Integer, nullable=False)
+    status = Column(String(50), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=False)
+    duration = Column(Float, nullable=True)  # Только для completed
+
+
+class TaskRollup(Base):
+    """Число завершённых задач и длительности за интервал времени (minute, hour, day) по проекту и агенту"""
+    __tablename__ = "task_rollups"
+
+    granularity = Column(String(10), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    project_id = Column(Integer, primary_key=True)
+    agent_id = Column(Integer, primary_key=True)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    duration_sum = Column(Float, nullable=False, default=0.0)
+    duration_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_task_rollups_project", "granularity", "project_id", "bucket_start"),
+        Index("ix_task_rollups_agent", "granularity", "agent_id", "bucket_start"),
+    )
+
+
+class TaskRollupDuration(Base):
+    """Гистограмма длительностей выполненных задач интервала: число задач в логарифмической корзине bin"""
+    __tablename__ = "task_rollup_durations"
+
+    granularity = Column(String(10), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    project_id = Column(Integer, primary_key=True)
+    agent_id = Column(Integer, primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_task_rollup_durations_project", "granularity", "project_id", "bucket_start"),
+        Index("ix_task_rollup_durations_agent", "granularity", "agent_id", "bucket_start"),
+    )
+
 
 class UserSettings(Base):
     __tablename__ = "user_settings"
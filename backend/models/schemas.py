@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Literal, Union, Annotated
 from datetime import datetime
 
 
@@ -34,6 +34,73 @@ class WebhookError(WebhookBase):
     metadata: Optional[Dict[str, Any]] = Field(default=None, description="Дополнительные метаданные")
 
 
+# Batch Webhook Models
+class WebhookBatchStart(WebhookStart):
+    event: Literal["start"] = Field(..., description="Тип события")
+
+
+class WebhookBatchFinish(WebhookFinish):
+    event: Literal["finish"] = Field(..., description="Тип события")
+
+
+class WebhookBatchStatus(WebhookStatus):
+    event: Literal["status"] = Field(..., description="Тип события")
+
+
+class WebhookBatchError(WebhookError):
+    event: Literal["error"] = Field(..., description="Тип события")
+
+
+WebhookBatchEvent = Annotated[
+    Union[WebhookBatchStart, WebhookBatchFinish, WebhookBatchStatus, WebhookBatchError],
+    Field(discriminator="event")
+]
+
+
+# Import Webhook Models
+class WebhookImportStart(WebhookBatchStart):
+    occurred_at: Optional[datetime] = Field(default=None, description="Время события (по умолчанию - время импорта)")
+
+
+class WebhookImportFinish(WebhookBatchFinish):
+    occurred_at: Optional[datetime] = Field(default=None, description="Время события (по умолчанию - время импорта)")
+
+
+class WebhookImportStatus(WebhookBatchStatus):
+    occurred_at: Optional[datetime] = Field(default=None, description="Время события (по умолчанию - время импорта)")
+
+
+class WebhookImportError(WebhookBatchError):
+    occurred_at: Optional[datetime] = Field(default=None, description="Время события (по умолчанию - время импорта)")
+
+
+WebhookImportEvent = Annotated[
+    Union[WebhookImportStart, WebhookImportFinish, WebhookImportStatus, WebhookImportError],
+    Field(discriminator="event")
+]
+
+
+class WebhookBatchRequest(BaseModel):
+    events: List[WebhookBatchEvent] = Field(..., min_length=1, description="События жизненного цикла задач в порядке применения")
+
+
+class WebhookBatchItemResult(BaseModel):
+    index: int
+    event: str
+    task_id: str
+    status: str  # accepted, not_found
+    database_id: Optional[int] = None
+    status_in_db: Optional[str] = None
+
+
+class WebhookBatchResponse(BaseModel):
+    status: str
+    processed: int
+    accepted: int
+    not_found: int
+    results: List[WebhookBatchItemResult]
+
+
 # Database Models
 class ProjectBase(BaseModel):
     name: str
@@ -119,7 +186,8 @@ class PaginationParams(BaseModel):
 
 class PaginatedProjectResponse(BaseModel):
     items: List[ProjectResponse]
-    total: int
+    # None при ?total=none, оценка при ?total=estimate
+    total: Optional[int] = None
     limit: int
     offset: int
     has_next: bool
@@ -128,11 +196,15 @@ class PaginatedProjectResponse(BaseModel):
 
 class PaginatedTaskResponse(BaseModel):
     items: List[TaskResponse]
-    total: int
+    # None при ?total=none, оценка при ?total=estimate
+    total: Optional[int] = None
     limit: int
     offset: int
     has_next: bool
     has_prev: bool
+    # Курсоры соседних страниц для keyset пагинации (?cursor=)
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
 
 class StatsResponse(BaseModel):
@@ -144,6 +216,37 @@ class StatsResponse(BaseModel):
     average_duration: Optional[float] = None
 
 
+class ProjectStatsResponse(BaseModel):
+    project: str
+    total_tasks: int
+    active_tasks: int
+    completed_tasks: int
+    failed_tasks: int
+    average_duration: Optional[float] = None
+
+
+class TimeseriesPoint(BaseModel):
+    # Начало интервала (для summary - отсутствует)
+    bucket: Optional[datetime] = None
+    completed: int
+    failed: int
+    failure_rate: Optional[float] = None
+    average_duration: Optional[float] = None
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+
+class TimeseriesResponse(BaseModel):
+    granularity: str
+    from_date: datetime
+    to_date: datetime
+    project: Optional[str] = None
+    agent: Optional[str] = None
+    points: List[TimeseriesPoint]
+    summary: TimeseriesPoint
+
+
 # Settings API Schemas
 class SettingsResponse(BaseModel):
     id: int
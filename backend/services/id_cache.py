@@ -0,0 +1,97 @@
+"""
+Кэш соответствия имя -> id для проектов и агентов
+
+Имена проектов и агентов уникальны и не переименовываются, поэтому id можно
+держать в памяти процесса и не ходить в БД на каждый вебхук. Кэш ограничен
+по размеру (LRU) и прогревается при старте приложения.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from models.models import Project, Agent
+
+
+class NameIdCache:
+    """Ограниченный LRU-кэш имя -> id с обратным индексом id -> имя"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str) -> Optional[int]:
+        """Получить id по имени"""
+        with self._lock:
+            entity_id = self._ids.get(name)
+            if entity_id is None:
+                self.misses += 1
+                return None
+            self._ids.move_to_end(name)
+            self.hits += 1
+            return entity_id
+
+    def get_name(self, entity_id: int) -> Optional[str]:
+        """Получить имя по id"""
+        return self._names.get(entity_id)
+
+    def set(self, name: str, entity_id: int):
+        """Сохранить соответствие, вытесняя самые давние записи"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._ids[name] = entity_id
+            self._ids.move_to_end(name)
+            self._names[entity_id] = name
+            while len(self._ids) > self.maxsize:
+                evicted_name, evicted_id = self._ids.popitem(last=False)
+                self._names.pop(evicted_id, None)
+
+    def clear(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._ids),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Глобальные кэши
+project_id_cache = NameIdCache(settings.NAME_ID_CACHE_SIZE)
+agent_id_cache = NameIdCache(settings.NAME_ID_CACHE_SIZE)
+
+
+def warm_id_caches(db: Session):
+    """Прогреть кэши последними созданными проектами и агентами"""
+    for model, cache in ((Project, project_id_cache), (Agent, agent_id_cache)):
+        rows = db.execute(
+            select(model.id, model.name).order_by(model.id.desc()).limit(cache.maxsize)
+        ).all()
+        # Самые свежие записи добавляются последними, чтобы вытеснялись первыми старые
+        for row in reversed(rows):
+            cache.set(row.name, row.id)
+
+
+def clear_id_caches():
+    """Сбросить кэши (например, после пересоздания таблиц)"""
+    project_id_cache.clear()
+    agent_id_cache.clear()
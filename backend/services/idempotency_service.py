@@ -0,0 +1,129 @@
+"""
+Идемпотентность вебхуков
+
+MCPAdapter повторяет запросы при сетевых ошибках, поэтому один и тот же вебхук
+может прийти несколько раз. Ключ запроса берётся из заголовка Idempotency-Key.
+Запросы без заголовка по умолчанию не дедуплицируются: тот же вебхук может
+прийти и законно (перезапуск задачи, возврат к прежнему статусу). С
+WEBHOOK_DEDUP_TTL > 0 для них вычисляется ключ по (тип события, task_id, хэш
+содержимого) на несколько секунд - против повторов транспорта. Первый запрос
+резервирует ключ в Redis (SET NX), после успешной обработки под ключом
+сохраняется ответ, и повторы получают его без обращения к БД.
+
+При недоступности Redis вебхуки обрабатываются как обычно.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Dict, Any, Optional
+
+from pydantic import BaseModel
+
+from core.config import settings
+from core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+
+# Предельное окно дедупликации запросов без Idempotency-Key, секунд
+MAX_DEDUP_TTL = 10
+
+
+class IdempotencyConflict(Exception):
+    """Запрос с тем же ключом ещё обрабатывается"""
+
+
+class IdempotencyService:
+    """Набор обработанных вебхуков в Redis с сохранёнными ответами"""
+
+    def __init__(self, prefix: str = "webhook:idempotency"):
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.errors = 0
+
+    def make_key(self, event: str, data: BaseModel, idempotency_key: Optional[str] = None) -> str:
+        """Ключ запроса: из заголовка или по содержимому события"""
+        if idempotency_key:
+            return f"{self.prefix}:key:{event}:{idempotency_key}"
+
+        payload_hash = hashlib.sha256(data.model_dump_json().encode("utf-8")).hexdigest()
+        task_id = getattr(data, "task_id", None) or "-"
+        return f"{self.prefix}:auto:{event}:{task_id}:{payload_hash}"
+
+    @staticmethod
+    def _ttl(key: str) -> int:
+        if ":key:" in key:
+            return settings.WEBHOOK_IDEMPOTENCY_TTL
+        return min(settings.WEBHOOK_DEDUP_TTL, MAX_DEDUP_TTL)
+
+    async def begin(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Зарезервировать ключ перед обработкой
+
+        Returns:
+            Сохранённый ответ, если запрос уже обработан, иначе None
+
+        Raises:
+            IdempotencyConflict: запрос с тем же ключом ещё обрабатывается
+        """
+        if not redis_client.redis or self._ttl(key) <= 0:
+            return None
+
+        try:
+            if await redis_client.set(key, PENDING, expire=settings.WEBHOOK_IDEMPOTENCY_LOCK_TTL, nx=True):
+                self.misses += 1
+                return None
+            cached = await redis_client.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Idempotency check failed, processing webhook anyway: {e}")
+            return None
+
+        if cached is None:
+            # Ключ истёк между SET NX и GET - обрабатываем как новый запрос
+            self.misses += 1
+            return None
+        if cached == PENDING:
+            self.conflicts += 1
+            raise IdempotencyConflict(key)
+
+        self.hits += 1
+        return json.loads(cached)
+
+    async def complete(self, key: str, response: Dict[str, Any]):
+        """Сохранить ответ под ключом на время TTL"""
+        if not redis_client.redis or self._ttl(key) <= 0:
+            return
+        try:
+            await redis_client.set(key, json.dumps(response, ensure_ascii=False), expire=self._ttl(key))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to store idempotent response: {e}")
+
+    async def release(self, key: str):
+        """Снять резервирование после ошибки, чтобы повтор мог быть обработан"""
+        if not redis_client.redis or self._ttl(key) <= 0:
+            return
+        try:
+            await redis_client.delete(key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to release idempotency key: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "conflicts": self.conflicts,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# Глобальный экземпляр сервиса
+idempotency_service = IdempotencyService()
@@ -0,0 +1,170 @@
+"""
+Потоковый импорт исторических вебхуков из NDJSON
+
+Каждая строка - событие в формате пакетного вебхука (поле event: start, finish,
+status или error) с необязательным временем события occurred_at: по нему
+записываются started_at, finished_at и created_at задачи. Тело читается и разбирается по частям (при необходимости с
+распаковкой gzip), события применяются пачками по WEBHOOK_IMPORT_CHUNK_SIZE
+через WebhookService.import_events, каждая пачка - отдельная транзакция.
+После каждой пачки отдаётся запись о прогрессе.
+
+Импорт файла напрямую в БД:
+    python -m services.import_service events.ndjson.gz [--chunk-size 5000]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import zlib
+from typing import Dict, Any, List, AsyncIterator, AsyncIterable, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from models.schemas import WebhookImportEvent
+from services.webhook_service import AsyncWebhookService
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Сколько ошибок разбора возвращать в отчёте
+MAX_REPORTED_ERRORS = 20
+
+import_event_adapter = TypeAdapter(WebhookImportEvent)
+
+
+async def iter_lines(chunks: AsyncIterable[bytes], gzipped: Optional[bool] = None) -> AsyncIterator[bytes]:
+    """
+    Разбить поток байтов на строки, не загружая его в память целиком
+
+    Args:
+        chunks: Части тела запроса или файла
+        gzipped: Сжат ли поток gzip (None - определить по сигнатуре)
+    """
+    decompressor = None
+    buffer = b""
+
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if gzipped is None:
+            gzipped = chunk.startswith(GZIP_MAGIC)
+        if gzipped:
+            if decompressor is None:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunk = decompressor.decompress(chunk)
+
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line
+
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    if buffer:
+        yield buffer
+
+
+class WebhookImportService:
+    """Импорт потока NDJSON событий пачками"""
+
+    def __init__(self, session_factory=AsyncSessionLocal, chunk_size: Optional[int] = None):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size or settings.WEBHOOK_IMPORT_CHUNK_SIZE
+
+    async def _apply(self, events: List[Any]) -> Dict[str, int]:
+        async with self.session_factory() as db:
+            return await AsyncWebhookService(db).import_events(events)
+
+    async def run(self, chunks: AsyncIterable[bytes], gzipped: Optional[bool] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Импортировать поток и отдавать прогресс после каждой пачки
+
+        Последняя запись имеет status "completed" или "failed" (пачки,
+        применённые до ошибки, остаются зафиксированными).
+        """
+        started = time.perf_counter()
+        totals = {"lines": 0, "events": 0, "invalid": 0, "upserted": 0, "updated": 0, "not_found": 0, "chunks": 0}
+        errors: List[Dict[str, Any]] = []
+        pending: List[Any] = []
+
+        def progress(status: str, **extra) -> Dict[str, Any]:
+            elapsed = time.perf_counter() - started
+            return {
+                "status": status,
+                **totals,
+                "elapsed_seconds": round(elapsed, 3),
+                "events_per_second": round(totals["events"] / elapsed, 1) if elapsed else 0.0,
+                **extra
+            }
+
+        async def apply_pending() -> Dict[str, Any]:
+            result = await self._apply(pending)
+            totals["chunks"] += 1
+            totals["events"] += result["events"]
+            for key in ("upserted", "updated", "not_found"):
+                totals[key] += result[key]
+            pending.clear()
+            return progress("in_progress")
+
+        try:
+            async for line in iter_lines(chunks, gzipped):
+                totals["lines"] += 1
+                if not line.strip():
+                    continue
+                try:
+                    pending.append(import_event_adapter.validate_json(line))
+                except ValidationError as e:
+                    totals["invalid"] += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({"line": totals["lines"], "error": e.errors(include_url=False)[0]["msg"]})
+                    continue
+
+                if len(pending) >= self.chunk_size:
+                    yield await apply_pending()
+
+            if pending:
+                yield await apply_pending()
+        except Exception as e:
+            logger.error(f"Webhook import failed at line {totals['lines']}: {e}")
+            yield progress("failed", error=str(e), errors=errors)
+            return
+
+        yield progress("completed", errors=errors)
+
+
+# Глобальный экземпляр сервиса
+import_service = WebhookImportService()
+
+
+async def _read_file(path: str, block_size: int = 1 << 20) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while block := file.read(block_size):
+            yield block
+
+
+async def main():
+    """Точка входа CLI импорта"""
+    parser = argparse.ArgumentParser(description="Import NDJSON webhook events into the database")
+    parser.add_argument("path", help="NDJSON file, optionally gzip-compressed")
+    parser.add_argument("--chunk-size", type=int, default=settings.WEBHOOK_IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = WebhookImportService(chunk_size=args.chunk_size)
+
+    report = {}
+    async for report in service.run(_read_file(args.path)):
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+
+    if report.get("status") != "completed":
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
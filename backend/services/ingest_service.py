@@ -0,0 +1,340 @@
+"""
+Асинхронный приём вебхуков через Redis stream
+
+В режиме WEBHOOK_INGEST_MODE=stream эндпоинты /webhook/* только валидируют
+событие и добавляют его в stream. WebhookStreamConsumer читает stream в составе
+группы потребителей, применяет события пачками через WebhookService.handle_batch
+(один commit на пачку) и подтверждает их XACK только после commit.
+
+Невалидные события и события, упавшие с постоянной ошибкой, перекладываются в
+dead-letter stream. При временной ошибке БД (недоступность, блокировка,
+разрыв соединения) запись остаётся неподтверждённой: потребитель перечитывает
+свои отложенные записи (XREADGROUP с id 0) раньше новых, чтобы события задачи
+применялись по порядку, а в dead-letter запись попадает только после
+WEBHOOK_CONSUMER_MAX_DELIVERIES доставок.
+
+Запуск отдельного воркера:
+    python -m services.ingest_service
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+from core.redis import redis_client
+from models.schemas import WebhookBatchEvent
+from services.webhook_service import AsyncWebhookService
+
+logger = logging.getLogger(__name__)
+
+batch_event_adapter = TypeAdapter(WebhookBatchEvent)
+
+# Классы SQLSTATE временных ошибок: соединение, откат транзакции (deadlock,
+# serialization failure), нехватка ресурсов, вмешательство оператора; 55P03 - lock timeout
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+TRANSIENT_SQLSTATES = ("55P03",)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Ошибка, после которой событие стоит применить повторно, а не в dead-letter"""
+    if isinstance(error, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError, OSError)):
+        return True
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        code = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+        return bool(code) and (code[:2] in TRANSIENT_SQLSTATE_CLASSES or code in TRANSIENT_SQLSTATES)
+    return False
+
+
+def _encode_event(event: str, data: BaseModel) -> Dict[str, str]:
+    return {
+        "event": event,
+        "data": data.model_dump_json(exclude={"event"}),
+        "received_at": str(time.time())
+    }
+
+
+class WebhookIngestService:
+    """
+    Постановка вебхуков в Redis stream и метрики отставания потребителей
+    """
+
+    def __init__(self, stream: Optional[str] = None, group: Optional[str] = None):
+        self.stream = stream or settings.WEBHOOK_STREAM_KEY
+        self.group = group or settings.WEBHOOK_STREAM_GROUP
+
+    async def enqueue(self, event: str, data: BaseModel) -> str:
+        """Добавить событие в stream, вернуть ID записи"""
+        return await redis_client.xadd(
+            self.stream, _encode_event(event, data), maxlen=settings.WEBHOOK_STREAM_MAXLEN
+        )
+
+    async def enqueue_many(self, events: List[BaseModel]) -> List[str]:
+        """Добавить пачку событий (WebhookBatch*) в stream за один round trip"""
+        return await redis_client.xadd_many(
+            self.stream,
+            [_encode_event(event.event, event) for event in events],
+            maxlen=settings.WEBHOOK_STREAM_MAXLEN
+        )
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Длина stream, отставание и pending по группам потребителей"""
+        groups = []
+        for group in await redis_client.xinfo_groups(self.stream):
+            last_delivered = group.get("last-delivered-id") or "0-0"
+            oldest_undelivered = await redis_client.xrange(
+                self.stream, min=f"({last_delivered}", count=1
+            )
+            lag_seconds = 0.0
+            if oldest_undelivered:
+                enqueued_ms = int(oldest_undelivered[0][0].split("-")[0])
+                lag_seconds = max(0.0, time.time() - enqueued_ms / 1000)
+
+            groups.append({
+                "name": group.get("name"),
+                "consumers": group.get("consumers"),
+                "pending": group.get("pending"),
+                "lag": group.get("lag"),
+                "lag_seconds": round(lag_seconds, 3),
+                "last_delivered_id": last_delivered
+            })
+
+        return {
+            "mode": settings.WEBHOOK_INGEST_MODE,
+            "stream": self.stream,
+            "length": await redis_client.xlen(self.stream),
+            "groups": groups,
+            "consumer": webhook_consumer.get_stats() if webhook_consumer.running else None
+        }
+
+
+class WebhookStreamConsumer:
+    """
+    Потребитель Redis stream с групповой фиксацией (group commit)
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, consumer_name: Optional[str] = None,
+                 stream: Optional[str] = None, group: Optional[str] = None):
+        self.session_factory = session_factory
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.stream = stream or settings.WEBHOOK_STREAM_KEY
+        self.group = group or settings.WEBHOOK_STREAM_GROUP
+        self.running = False
+        self._task: Optional[asyncio.Task] = None
+        self._group_ready = False
+        # Есть ли у потребителя неподтверждённые записи (после перезапуска или отложенные)
+        self._read_pending = True
+
+        self.processed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.last_deferred = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+
+    async def start(self):
+        """Запустить фоновый цикл потребления в текущем процессе"""
+        if self._task:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановить фоновый цикл"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Основной цикл: читать пачки, пока потребитель запущен"""
+        self.running = True
+        while self.running:
+            try:
+                await self.process_once()
+                # БД временно недоступна: не вычитывать stream дальше вхолостую
+                if self.last_deferred:
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook consumer error: {e}")
+                await asyncio.sleep(1)
+
+    async def process_once(self) -> int:
+        """Обработать одну пачку записей, вернуть количество обработанных"""
+        if not self._group_ready:
+            await redis_client.xgroup_create(self.stream, self.group)
+            self._group_ready = True
+
+        # Сначала забираем записи, зависшие у упавших потребителей
+        entries = await redis_client.xautoclaim(
+            self.stream, self.group, self.consumer_name,
+            min_idle_time=settings.WEBHOOK_CONSUMER_CLAIM_IDLE_MS,
+            count=settings.WEBHOOK_CONSUMER_BATCH_SIZE
+        )
+        # Затем свои отложенные записи: новые события задачи не должны
+        # примениться раньше отложенных start или прежнего статуса
+        if not entries and self._read_pending:
+            entries = await redis_client.xreadgroup(
+                self.group, self.consumer_name, self.stream,
+                count=settings.WEBHOOK_CONSUMER_BATCH_SIZE, last_id="0"
+            )
+            self._read_pending = bool(entries)
+        if not entries:
+            entries = await redis_client.xreadgroup(
+                self.group, self.consumer_name, self.stream,
+                count=settings.WEBHOOK_CONSUMER_BATCH_SIZE,
+                block=settings.WEBHOOK_CONSUMER_BLOCK_MS
+            )
+        if not entries:
+            return 0
+
+        started = time.perf_counter()
+        events, invalid = self._decode(entries)
+
+        applied_ids, failed, deferred = await self._apply(events)
+        failed += await self._exhausted(deferred)
+        deferred_ids = {entry_id for entry_id, _, _ in deferred} - {entry_id for entry_id, _, _ in failed}
+
+        dead = invalid + failed
+        if dead:
+            await self._dead_letter(dead)
+
+        # Отложенные записи не подтверждаются: следующий вызов перечитает их раньше новых
+        await redis_client.xack(self.stream, self.group, *applied_ids, *(entry_id for entry_id, _, _ in dead))
+        if deferred_ids:
+            self._read_pending = True
+
+        self.processed += len(applied_ids)
+        self.failed += len(dead)
+        self.deferred += len(deferred_ids)
+        self.last_deferred = len(deferred_ids)
+        self.batches += 1
+        self.last_batch_size = len(entries)
+        self.last_batch_ms = (time.perf_counter() - started) * 1000
+        return len(entries)
+
+    def _decode(self, entries: List[Tuple[str, dict]]):
+        events = []
+        invalid = []
+        for entry_id, fields in entries:
+            try:
+                payload = json.loads(fields["data"])
+                payload["event"] = fields["event"]
+                events.append((entry_id, batch_event_adapter.validate_python(payload)))
+            except (KeyError, ValueError, ValidationError) as e:
+                invalid.append((entry_id, fields, str(e)))
+        return events, invalid
+
+    async def _apply(self, events: List[Tuple[str, Any]]):
+        """
+        Применить пачку одним commit; при постоянной ошибке - по одному событию
+
+        Returns:
+            ID применённых записей, упавшие с постоянной ошибкой и отложенные
+            из-за временной ошибки (entry_id, поля записи, текст ошибки)
+        """
+        if not events:
+            return [], [], []
+
+        async with self.session_factory() as db:
+            webhook_service = AsyncWebhookService(db)
+            try:
+                await webhook_service.handle_batch([event for _, event in events])
+                return [entry_id for entry_id, _ in events], [], []
+            except Exception as e:
+                await db.rollback()
+                if is_transient_error(e):
+                    logger.warning(f"Webhook batch deferred after transient error: {e}")
+                    return [], [], [(entry_id, _encode_event(event.event, event), str(e)) for entry_id, event in events]
+                logger.warning(f"Webhook batch failed, retrying events one by one: {e}")
+
+            applied, failed, deferred = [], [], []
+            for index, (entry_id, event) in enumerate(events):
+                try:
+                    await webhook_service.handle_batch([event])
+                    applied.append(entry_id)
+                except Exception as e:
+                    await db.rollback()
+                    entry = (entry_id, _encode_event(event.event, event), str(e))
+                    if not is_transient_error(e):
+                        failed.append(entry)
+                        continue
+                    # Остаток пачки тоже откладывается: более поздние события задачи
+                    # не должны примениться раньше отложенного
+                    deferred.append(entry)
+                    deferred.extend(
+                        (rest_id, _encode_event(rest.event, rest), str(e)) for rest_id, rest in events[index + 1:]
+                    )
+                    break
+            return applied, failed, deferred
+
+    async def _exhausted(self, deferred: List[Tuple[str, dict, str]]) -> List[Tuple[str, dict, str]]:
+        """Отложенные записи, доставленные уже WEBHOOK_CONSUMER_MAX_DELIVERIES раз"""
+        if not deferred:
+            return []
+        counts = await redis_client.xdelivery_counts(
+            self.stream, self.group, [entry_id for entry_id, _, _ in deferred]
+        )
+        return [
+            (entry_id, fields, f"{error} (after {counts[entry_id]} deliveries)")
+            for entry_id, fields, error in deferred
+            if counts.get(entry_id, 0) >= settings.WEBHOOK_CONSUMER_MAX_DELIVERIES
+        ]
+
+    async def _dead_letter(self, entries: List[Tuple[str, dict, str]]):
+        """Переложить необрабатываемые записи в dead-letter stream"""
+        await redis_client.xadd_many(
+            settings.WEBHOOK_STREAM_DEAD_LETTER_KEY,
+            [dict(fields, source_id=entry_id, error=error) for entry_id, fields, error in entries],
+            maxlen=settings.WEBHOOK_STREAM_MAXLEN
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счётчики потребителя"""
+        return {
+            "name": self.consumer_name,
+            "processed": self.processed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 3)
+        }
+
+
+# Глобальные экземпляры
+ingest_service = WebhookIngestService()
+webhook_consumer = WebhookStreamConsumer()
+
+
+async def main():
+    """Точка входа отдельного воркера"""
+    logging.basicConfig(level=logging.INFO)
+    await redis_client.connect()
+    logger.info(f"Webhook consumer {webhook_consumer.consumer_name} started on {webhook_consumer.stream}")
+    try:
+        await webhook_consumer.run()
+    finally:
+        await redis_client.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+"""
+Буфер слияния частых обновлений прогресса задач
+
+Вебхуки status без смены статуса (только progress/message/metadata) не пишутся
+в БД сразу: для каждой задачи в памяти хранится только последнее обновление,
+которое сбрасывается в БД раз в PROGRESS_FLUSH_INTERVAL секунд одним
+пакетным UPDATE. Смена статуса, start, finish и error по-прежнему пишутся сразу.
+
+Статус задачи для слияния берётся из кэша процесса. Его могли изменить другие
+воркеры или потребитель stream, поэтому запись кэша действительна только
+PROGRESS_STATUS_TTL секунд после подтверждения: записью статуса в этом процессе
+или сбросом прогресса задачи (он читает статусы в той же транзакции). Без
+подтверждённой записи статус читается из БД. Если статус сменился уже после
+слияния, UPDATE сброса не находит строку в прежнем статусе: такое обновление
+вытеснено более поздней записью и только учитывается в статистике (superseded),
+а кэш получает статус из БД.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+from core.config import settings
+from core.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class TaskProgressState:
+    """Последнее известное состояние задачи и отложенное обновление прогресса"""
+
+    __slots__ = ("id", "task_id", "status", "progress", "message", "metadata", "checked_at")
+
+    def __init__(self, id: int, task_id: str, status: str, progress: Optional[float] = None):
+        self.id = id
+        self.task_id = task_id
+        self.status = status
+        self.progress = progress
+        self.message: Optional[str] = None
+        self.metadata: Optional[Dict[str, Any]] = None
+        # Когда статус последний раз подтверждён БД (time.monotonic)
+        self.checked_at = time.monotonic()
+
+
+class ProgressCoalescer:
+    """
+    Слияние обновлений прогресса по task_id
+
+    Пока фоновый цикл сброса не запущен (например, в тестах без lifespan),
+    буфер отключен и все обновления пишутся в БД сразу.
+    """
+
+    def __init__(self, flush_interval: float, max_known_tasks: int, session_factory=AsyncSessionLocal,
+                 status_ttl: Optional[float] = None):
+        self.flush_interval = flush_interval
+        self.max_known_tasks = max_known_tasks
+        self.status_ttl = settings.PROGRESS_STATUS_TTL if status_ttl is None else status_ttl
+        self.session_factory = session_factory
+        self._known: "OrderedDict[str, TaskProgressState]" = OrderedDict()
+        self._pending: Dict[str, TaskProgressState] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        self.buffered = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.superseded = 0
+        self.status_hits = 0
+        self.status_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    def remember(self, task_id: str, id: int, status: str, progress: Optional[float] = None):
+        """Запомнить состояние задачи после записи в БД; отложенное обновление отбрасывается"""
+        self._pending.pop(task_id, None)
+        if not self.enabled:
+            return
+        self._track(TaskProgressState(id, task_id, status, progress))
+
+    def _track(self, state: TaskProgressState):
+        self._known[state.task_id] = state
+        self._known.move_to_end(state.task_id)
+        while len(self._known) > self.max_known_tasks:
+            evicted_id, _ = self._known.popitem(last=False)
+            self._pending.pop(evicted_id, None)
+
+    def known_status(self, task_id: str) -> Optional[tuple]:
+        """
+        id и статус задачи из кэша, если они подтверждены БД не дольше status_ttl секунд назад
+
+        Returns:
+            (id, status) или None - статус нужно прочитать из БД и передать в confirm
+        """
+        state = self._known.get(task_id)
+        if state is None or time.monotonic() - state.checked_at > self.status_ttl:
+            self.status_misses += 1
+            return None
+        self.status_hits += 1
+        return state.id, state.status
+
+    def confirm(self, task_id: str, id: int, status: str) -> tuple:
+        """Запомнить статус задачи, прочитанный из БД"""
+        state = self._known.get(task_id)
+        if state is None or state.id != id:
+            state = TaskProgressState(id, task_id, status)
+        state.status = status
+        state.checked_at = time.monotonic()
+        if self.enabled:
+            self._track(state)
+        return id, status
+
+    def forget(self, task_id: str):
+        """Забыть состояние задачи, изменённой в обход обработчиков (например, импортом)"""
+        self._pending.pop(task_id, None)
+        self._known.pop(task_id, None)
+
+    def try_buffer(self, data, id: int, status: str) -> Optional[TaskProgressState]:
+        """
+        Отложить обновление WebhookStatus, если статус задачи не меняется
+
+        Args:
+            id, status: id и текущий статус задачи (known_status или confirm)
+
+        Returns:
+            Состояние задачи с учётом обновления или None, если нужна запись в БД
+        """
+        if not self.enabled or status != data.status:
+            return None
+
+        state = self._known.get(data.task_id)
+        if state is None or state.id != id:
+            state = TaskProgressState(id, data.task_id, status)
+        state.status = status
+        state.progress = data.progress
+        state.metadata = data.metadata
+        if data.message:
+            state.message = data.message
+        self._track(state)
+        self._pending[data.task_id] = state
+        self.buffered += 1
+        return state
+
+    def pending(self, task_id: str) -> Optional[TaskProgressState]:
+        """Ещё не сброшенное в БД обновление задачи"""
+        return self._pending.get(task_id)
+
+    def take_pending(self) -> List[TaskProgressState]:
+        """Забрать все отложенные обновления"""
+        pending = list(self._pending.values())
+        self._pending.clear()
+        return pending
+
+    async def flush(self) -> int:
+        """Сбросить отложенные обновления в БД одним пакетным UPDATE"""
+        pending = self.take_pending()
+        if not pending:
+            return 0
+
+        # Импорт здесь, чтобы избежать циклического импорта с webhook_service
+        from services.webhook_service import AsyncWebhookService
+
+        try:
+            async with self.session_factory() as db:
+                statuses = await AsyncWebhookService(db).flush_progress(pending)
+        except Exception:
+            # Возвращаем обновления в буфер, если за это время не пришли более свежие
+            for state in pending:
+                self._pending.setdefault(state.task_id, state)
+            raise
+
+        # Прочитанные при сбросе статусы подтверждают (или исправляют) кэш
+        now = time.monotonic()
+        updated = 0
+        for state in pending:
+            status = statuses.get(state.task_id)
+            if status == state.status:
+                updated += 1
+            if self._known.get(state.task_id) is not state:
+                continue
+            if status is None:
+                self._known.pop(state.task_id)
+            else:
+                state.status = status
+                state.checked_at = now
+
+        self.flushes += 1
+        self.flushed_rows += updated
+        if updated < len(pending):
+            self.superseded += len(pending) - updated
+            logger.debug(f"Progress flush skipped {len(pending) - updated} tasks with a newer status")
+        return updated
+
+    async def start(self):
+        """Запустить фоновый цикл сброса"""
+        if self._task or self.flush_interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить цикл и сбросить оставшиеся обновления"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self._known.clear()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Progress flush failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "flush_interval": self.flush_interval,
+            "known_tasks": len(self._known),
+            "pending": len(self._pending),
+            "buffered": self.buffered,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "superseded": self.superseded,
+            "status_hits": self.status_hits,
+            "status_misses": self.status_misses
+        }
+
+
+# Глобальный экземпляр буфера
+progress_buffer = ProgressCoalescer(settings.PROGRESS_FLUSH_INTERVAL, settings.PROGRESS_KNOWN_TASKS_SIZE)
@@ -3,6 +3,7 @@
 """
 
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
 from models.models import UserSettings
@@ -280,5 +281,36 @@ class SettingsService:
         return False
 
 
+class AsyncSettingsService:
+    """
+    Асинхронная версия SettingsService для обработчиков FastAPI
+    Выполняет методы SettingsService через AsyncSession.run_sync
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_setting(self, key: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return await self.db.run_sync(lambda session: SettingsService(session).get_setting(key, user_id))
+
+    async def get_user_settings(self, user_id: str) -> List[Dict[str, Any]]:
+        return await self.db.run_sync(lambda session: SettingsService(session).get_user_settings(user_id))
+
+    async def get_all_settings(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return await self.db.run_sync(lambda session: SettingsService(session).get_all_settings(user_id))
+
+    async def set_setting(self, key: str, value: Any, user_id: Optional[str] = None,
+                          description: Optional[str] = None, is_global: bool = False) -> Dict[str, Any]:
+        return await self.db.run_sync(lambda session: SettingsService(session).set_setting(
+            key, value, user_id=user_id, description=description, is_global=is_global
+        ))
+
+    async def delete_setting(self, key: str, user_id: Optional[str] = None) -> bool:
+        return await self.db.run_sync(lambda session: SettingsService(session).delete_setting(key, user_id))
+
+    async def delete_all_user_settings(self, user_id: str) -> bool:
+        return await self.db.run_sync(lambda session: SettingsService(session).delete_all_user_settings(user_id))
+
+
 # Глобальный экземпляр сервиса для использования в роутерах
 settings_service = SettingsService
\ No newline at end of file
@@ -0,0 +1,426 @@
+"""
+Счётчики задач для /api/stats без COUNT по таблице tasks
+
+Число задач по (проекту, статусу), сумма и число длительностей выполненных
+задач хранятся в task_counters. Изменения пишут триггеры на tasks в той же
+транзакции, что и сама задача, поэтому счётчики учитывают любую запись:
+вебхуки, пакетную обработку, импорт (в том числе через COPY) и прямые
+изменения в БД. Число проектов хранится там же: каждый проект учитывается
+единицей в строке (project_id, PROJECT_STATUS), которую ведут триггеры на
+projects.
+
+Триггеры не обновляют task_counters напрямую: строка счётчика проекта была бы
+общей блокировкой для всех транзакций вебхуков проекта, а пакеты, меняющие
+несколько строк в разном порядке, могли бы взаимно блокироваться. Вместо этого
+триггер добавляет строки изменений в журнал task_counter_deltas, который
+фоновый цикл сворачивает в task_counters раз в TASK_COUNTERS_FLUSH_INTERVAL
+секунд. Чтение складывает task_counters и ещё не свёрнутый журнал, поэтому
+результат точен независимо от отставания свёртки.
+
+Сверка раз в TASK_COUNTERS_RECONCILE_INTERVAL секунд пересчитывает счётчики
+по tasks и исправляет расхождения (например, после TRUNCATE или записи
+с отключёнными триггерами).
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal_column, select, union_all
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import AsyncSessionLocal, dialect_insert
+from models.models import Project, Task, TaskCounter, TaskCounterDelta
+
+logger = logging.getLogger(__name__)
+
+# Длительность выполненной задачи в секундах (NULL для остальных) в строке {row}
+DURATION_SQL = {
+    "sqlite": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN (julianday({row}.finished_at) - julianday({row}.started_at)) * 86400.0 END"
+    ),
+    "postgresql": (
+        "CASE WHEN {row}.status = 'completed' AND {row}.finished_at IS NOT NULL AND {row}.started_at IS NOT NULL "
+        "THEN extract(epoch FROM {row}.finished_at - {row}.started_at) END"
+    ),
+}
+
+# Статус строки счётчиков, в которой учитывается сам проект (не задача)
+PROJECT_STATUS = "#project"
+
+# Колонки, от которых зависит вклад задачи в счётчики
+COUNTED_COLUMNS = ("status", "project_id", "started_at", "finished_at")
+
+
+def _delta_insert(dialect: str, row: str, sign: int) -> str:
+    """INSERT в журнал вклада строки {row} (old/new) со знаком sign"""
+    duration = DURATION_SQL[dialect].format(row=row)
+    return (
+        f"INSERT INTO task_counter_deltas (project_id, status, tasks, duration_sum, duration_count) "
+        f"VALUES ({row}.project_id, coalesce({row}.status, ''), {sign}, {sign} * coalesce({duration}, 0), "
+        f"CASE WHEN {duration} IS NULL THEN 0 ELSE {sign} END)"
+    )
+
+
+def _project_delta_insert(row: str, sign: int) -> str:
+    """INSERT в журнал вклада проекта {row} (old/new) в число проектов"""
+    return (
+        f"INSERT INTO task_counter_deltas (project_id, status, tasks, duration_sum, duration_count) "
+        f"VALUES ({row}.id, '{PROJECT_STATUS}', {sign}, 0, 0)"
+    )
+
+
+_sqlite_changed = " OR ".join(f"old.{name} IS NOT new.{name}" for name in COUNTED_COLUMNS)
+_postgres_changed = " OR ".join(f"OLD.{name} IS DISTINCT FROM NEW.{name}" for name in COUNTED_COLUMNS)
+
+COUNTER_DDL = {
+    "sqlite": (
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_insert AFTER INSERT ON tasks BEGIN "
+        f"{_delta_insert('sqlite', 'new', 1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_delete AFTER DELETE ON tasks BEGIN "
+        f"{_delta_insert('sqlite', 'old', -1)}; END",
+        # Обновления прогресса и описания не меняют вклад задачи и триггер не вызывают
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_update AFTER UPDATE OF {', '.join(COUNTED_COLUMNS)} ON tasks "
+        f"WHEN {_sqlite_changed} BEGIN "
+        f"{_delta_insert('sqlite', 'old', -1)}; {_delta_insert('sqlite', 'new', 1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_project_insert AFTER INSERT ON projects BEGIN "
+        f"{_project_delta_insert('new', 1)}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_counters_project_delete AFTER DELETE ON projects BEGIN "
+        f"{_project_delta_insert('old', -1)}; END",
+    ),
+    "postgresql": (
+        f"CREATE OR REPLACE FUNCTION task_counters_track() RETURNS trigger LANGUAGE plpgsql AS $$ "
+        f"BEGIN "
+        f"IF TG_OP <> 'INSERT' THEN {_delta_insert('postgresql', 'OLD', -1)}; END IF; "
+        f"IF TG_OP <> 'DELETE' THEN {_delta_insert('postgresql', 'NEW', 1)}; END IF; "
+        f"RETURN NULL; "
+        f"END $$",
+        "CREATE OR REPLACE TRIGGER task_counters_insert_delete AFTER INSERT OR DELETE ON tasks "
+        "FOR EACH ROW EXECUTE FUNCTION task_counters_track()",
+        f"CREATE OR REPLACE TRIGGER task_counters_update AFTER UPDATE OF {', '.join(COUNTED_COLUMNS)} ON tasks "
+        f"FOR EACH ROW WHEN ({_postgres_changed}) EXECUTE FUNCTION task_counters_track()",
+        f"CREATE OR REPLACE FUNCTION task_counters_track_project() RETURNS trigger LANGUAGE plpgsql AS $$ "
+        f"BEGIN "
+        f"IF TG_OP = 'DELETE' THEN {_project_delta_insert('OLD', -1)}; "
+        f"ELSE {_project_delta_insert('NEW', 1)}; END IF; "
+        f"RETURN NULL; "
+        f"END $$",
+        "CREATE OR REPLACE TRIGGER task_counters_project AFTER INSERT OR DELETE ON projects "
+        "FOR EACH ROW EXECUTE FUNCTION task_counters_track_project()",
+    ),
+}
+
+# Триггер, по которому проверяется, установлены ли счётчики (последний добавленный)
+_TRIGGER_EXISTS = {
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'task_counters_project_insert'",
+    "postgresql": "SELECT 1 FROM pg_trigger WHERE tgname = 'task_counters_project'",
+}
+
+
+def install_counter_triggers(connection):
+    """Создать триггеры счётчиков на tasks и projects (идемпотентно)"""
+    for statement in COUNTER_DDL.get(connection.dialect.name, ()):
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Task.__table__, "after_create")
+def _create_counter_triggers(target, connection, **kw):
+    install_counter_triggers(connection)
+
+
+def ensure_task_counters(engine: Engine):
+    """Установить триггеры счётчиков для БД, созданной до их появления, и заполнить счётчики"""
+    if engine.dialect.name not in COUNTER_DDL:
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(_TRIGGER_EXISTS[engine.dialect.name]).first()
+        install_counter_triggers(connection)
+    if not exists:
+        with Session(engine) as db:
+            TaskCounterService(db).reconcile()
+        logger.info("Task counters created")
+
+
+def _counter_rows(project_id: Optional[int] = None):
+    """Строки task_counters и ещё не свёрнутого журнала (подзапрос)"""
+    queries = []
+    for model in (TaskCounter, TaskCounterDelta):
+        query = select(model.project_id, model.status, model.tasks, model.duration_sum, model.duration_count)
+        if project_id is not None:
+            query = query.where(model.project_id == project_id)
+        queries.append(query)
+    return union_all(*queries).subquery("counter_rows")
+
+
+class TaskCounterService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def totals(self, project_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Число задач по статусам и средняя длительность выполненных задач
+
+        Args:
+            project_id: проект (None - все проекты)
+
+        Returns:
+            Поля StatsResponse: total_tasks, active_tasks, completed_tasks,
+            failed_tasks, average_duration, а для всех проектов и total_projects
+        """
+        rows = _counter_rows(project_id)
+        query = select(
+            rows.c.status, func.sum(rows.c.tasks), func.sum(rows.c.duration_sum), func.sum(rows.c.duration_count)
+        ).group_by(rows.c.status)
+
+        by_status: Dict[str, int] = {}
+        duration_sum, duration_count = 0.0, 0
+        for status, tasks, status_duration_sum, status_duration_count in self.db.execute(query):
+            by_status[status] = tasks
+            duration_sum += status_duration_sum
+            duration_count += status_duration_count
+        projects = by_status.pop(PROJECT_STATUS, 0)
+
+        totals = {
+            "total_tasks": sum(by_status.values()),
+            "active_tasks": by_status.get("running", 0),
+            "completed_tasks": by_status.get("completed", 0),
+            "failed_tasks": by_status.get("failed", 0),
+            "average_duration": duration_sum / duration_count if duration_count else None
+        }
+        if project_id is None:
+            totals["total_projects"] = projects
+        return totals
+
+    def flush(self) -> int:
+        """
+        Свернуть журнал изменений в task_counters
+
+        Строки журнала забираются DELETE ... RETURNING, поэтому параллельная
+        свёртка в другом процессе не учтёт их повторно. Счётчики обновляются
+        в порядке ключа, чтобы свёртки не блокировали друг друга.
+
+        Returns:
+            Число свёрнутых строк журнала
+        """
+        deltas = self.db.execute(delete(TaskCounterDelta).returning(
+            TaskCounterDelta.project_id, TaskCounterDelta.status, TaskCounterDelta.tasks,
+            TaskCounterDelta.duration_sum, TaskCounterDelta.duration_count
+        )).all()
+        if not deltas:
+            self.db.commit()
+            return 0
+
+        sums: Dict[Tuple[int, str], list] = {}
+        for project_id, status, tasks, duration_sum, duration_count in deltas:
+            total = sums.setdefault((project_id, status), [0, 0.0, 0])
+            total[0] += tasks
+            total[1] += duration_sum
+            total[2] += duration_count
+
+        stmt = dialect_insert(self.db, TaskCounter)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TaskCounter.project_id, TaskCounter.status],
+            set_={
+                "tasks": TaskCounter.tasks + stmt.excluded.tasks,
+                "duration_sum": TaskCounter.duration_sum + stmt.excluded.duration_sum,
+                "duration_count": TaskCounter.duration_count + stmt.excluded.duration_count
+            }
+        )
+        self.db.execute(stmt, [
+            {"project_id": project_id, "status": status,
+             "tasks": tasks, "duration_sum": duration_sum, "duration_count": duration_count}
+            for (project_id, status), (tasks, duration_sum, duration_count) in sorted(sums.items())
+        ])
+        self.db.commit()
+        return len(deltas)
+
+    def reconcile(self) -> int:
+        """
+        Пересчитать счётчики по tasks и projects и заменить ими task_counters
+
+        На PostgreSQL таблицы счётчиков блокируются от записи на время сверки:
+        транзакции, изменившие задачи, но ещё не записавшие журнал, дождутся
+        её окончания и добавят свои изменения поверх пересчитанных значений.
+
+        Returns:
+            Число исправленных счётчиков (проект, статус)
+        """
+        dialect = self.db.get_bind().dialect.name
+        if dialect == "postgresql":
+            self.db.connection().exec_driver_sql("LOCK TABLE task_counters, task_counter_deltas IN EXCLUSIVE MODE")
+
+        rows = _counter_rows()
+        current = {
+            (project_id, status): (tasks, duration_sum, duration_count)
+            for project_id, status, tasks, duration_sum, duration_count in self.db.execute(
+                select(rows.c.project_id, rows.c.status, func.sum(rows.c.tasks),
+                       func.sum(rows.c.duration_sum), func.sum(rows.c.duration_count))
+                .group_by(rows.c.project_id, rows.c.status)
+            )
+        }
+
+        duration = literal_column(DURATION_SQL[dialect].format(row="tasks"))
+        status = func.coalesce(Task.status, "")
+        actual = {
+            (project_id, status): (tasks, duration_sum or 0.0, duration_count)
+            for project_id, status, tasks, duration_sum, duration_count in self.db.execute(
+                select(Task.project_id, status, func.count(), func.sum(duration), func.count(duration))
+                .group_by(Task.project_id, status)
+            )
+        }
+        for project_id in self.db.scalars(select(Project.id)):
+            actual[(project_id, PROJECT_STATUS)] = (1, 0.0, 0)
+
+        drifted = [
+            key for key in current.keys() | actual.keys()
+            if not _same_counters(current.get(key, (0, 0.0, 0)), actual.get(key, (0, 0.0, 0)))
+        ]
+
+        self.db.execute(delete(TaskCounterDelta))
+        self.db.execute(delete(TaskCounter))
+        if actual:
+            self.db.execute(insert(TaskCounter), [
+                {"project_id": project_id, "status": status,
+                 "tasks": tasks, "duration_sum": duration_sum, "duration_count": duration_count}
+                for (project_id, status), (tasks, duration_sum, duration_count) in sorted(actual.items())
+            ])
+        self.db.commit()
+
+        # Первое заполнение пустых счётчиков - не расхождение
+        if drifted and current:
+            logger.warning(f"Task counters drift corrected for {len(drifted)} counters")
+        return len(drifted)
+
+
+def _same_counters(left: tuple, right: tuple) -> bool:
+    """Совпадают ли счётчики (суммы длительностей - с точностью до округления)"""
+    return (left[0] == right[0] and left[2] == right[2]
+            and math.isclose(left[1], right[1], rel_tol=1e-9, abs_tol=1e-6))
+
+
+class AsyncTaskCounterService:
+    """Асинхронная версия TaskCounterService (через AsyncSession.run_sync)"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def totals(self, project_id: Optional[int] = None) -> Dict[str, Any]:
+        return await self.db.run_sync(lambda session: TaskCounterService(session).totals(project_id))
+
+    async def flush(self) -> int:
+        return await self.db.run_sync(lambda session: TaskCounterService(session).flush())
+
+    async def reconcile(self) -> int:
+        return await self.db.run_sync(lambda session: TaskCounterService(session).reconcile())
+
+
+class TaskCountersJob:
+    """
+    Фоновая свёртка журналов счётчиков и завершений задач, периодическая
+    сверка счётчиков с tasks и удаление устаревших агрегатов по времени
+    """
+
+    # Как часто удалять минутные и часовые агрегаты старше срока хранения, секунд
+    PRUNE_INTERVAL = 3600.0
+
+    def __init__(self, flush_interval: float, reconcile_interval: float, session_factory=AsyncSessionLocal):
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+        self._last_reconcile = time.monotonic()
+        self._last_prune = 0.0
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.rollup_events = 0
+        self.pruned_rows = 0
+        self.reconciliations = 0
+        self.corrected = 0
+
+    async def flush(self) -> int:
+        """Свернуть журналы; возвращает число свёрнутых строк журнала счётчиков"""
+        # Импорт здесь, чтобы избежать циклического импорта с task_rollups
+        from services.task_rollups import AsyncTaskRollupService
+
+        async with self.session_factory() as db:
+            flushed = await AsyncTaskCounterService(db).flush()
+            events = await AsyncTaskRollupService(db).flush()
+        self.flushes += 1
+        self.flushed_rows += flushed
+        self.rollup_events += events
+        return flushed
+
+    async def prune(self) -> int:
+        from services.task_rollups import AsyncTaskRollupService
+
+        async with self.session_factory() as db:
+            pruned = await AsyncTaskRollupService(db).prune()
+        self._last_prune = time.monotonic()
+        self.pruned_rows += pruned
+        return pruned
+
+    async def reconcile(self) -> int:
+        async with self.session_factory() as db:
+            corrected = await AsyncTaskCounterService(db).reconcile()
+        self._last_reconcile = time.monotonic()
+        self.reconciliations += 1
+        self.corrected += corrected
+        return corrected
+
+    async def start(self):
+        """Запустить фоновый цикл"""
+        if self._task or self.flush_interval <= 0:
+            return
+        self._last_reconcile = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить цикл и свернуть оставшийся журнал"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Task counters flush failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if 0 < self.reconcile_interval <= time.monotonic() - self._last_reconcile:
+                    await self.reconcile()
+                if time.monotonic() - self._last_prune >= self.PRUNE_INTERVAL:
+                    await self.prune()
+            except Exception as e:
+                logger.error(f"Task counters maintenance failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None,
+            "flush_interval": self.flush_interval,
+            "reconcile_interval": self.reconcile_interval,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "reconciliations": self.reconciliations,
+            "corrected": self.corrected,
+            "rollup_events": self.rollup_events,
+            "pruned_rows": self.pruned_rows
+        }
+
+
+# Глобальный фоновый цикл счётчиков
+task_counters_job = TaskCountersJob(settings.TASK_COUNTERS_FLUSH_INTERVAL, settings.TASK_COUNTERS_RECONCILE_INTERVAL)
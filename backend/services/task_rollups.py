@@ -0,0 +1,367 @@
+"""
+Агрегаты завершённых задач по времени для графиков /api/stats/timeseries
+
+Для каждого интервала (minute, hour, day), проекта и агента хранится число
+выполненных и упавших задач, сумма длительностей и гистограмма длительностей
+выполненных задач (task_rollups, task_rollup_durations). Графики за недели
+строятся по агрегатам, без чтения tasks.
+
+Завершения записывают триггеры на tasks в журнал task_finish_events: при
+переходе задачи в completed или failed (в том числе при импорте). Журнал
+сворачивается в агрегаты тем же фоновым циклом, что и счётчики
+(services/task_counters.py), поэтому агрегаты отстают от задач не больше чем
+на TASK_COUNTERS_FLUSH_INTERVAL секунд. Агрегаты учитывают события
+завершения: перезапуск завершённой задачи их не уменьшает.
+
+Перцентили считаются по логарифмической гистограмме (как в DDSketch и HDR
+Histogram): длительность попадает в корзину с границами, растущими
+в геометрической прогрессии, значение корзины отличается от любой
+длительности в ней не больше чем на RELATIVE_ACCURACY. Гистограммы разных
+интервалов, проектов и агентов складываются покорзинно, поэтому перцентили
+за произвольное окно и по любому срезу считаются так же точно, как за один
+интервал.
+"""
+
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database import dialect_insert
+from models.models import Task, TaskFinishEvent, TaskRollup, TaskRollupDuration
+from services.task_counters import DURATION_SQL
+
+logger = logging.getLogger(__name__)
+
+# Интервалы агрегатов
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Окно графика по умолчанию для каждого интервала
+DEFAULT_WINDOWS = {
+    "minute": timedelta(hours=1),
+    "hour": timedelta(days=7),
+    "day": timedelta(days=90),
+}
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class DurationSketch:
+    """Мёрджируемая логарифмическая гистограмма длительностей (корзина -> число задач)"""
+
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    # Более короткие длительности (и отрицательные из-за расхождения часов) попадают в одну корзину
+    MIN_DURATION = 0.001
+
+    def __init__(self, bins: Optional[Dict[int, int]] = None):
+        self.bins: Dict[int, int] = dict(bins or {})
+
+    @classmethod
+    def bin_of(cls, seconds: float) -> int:
+        return math.ceil(math.log(max(seconds, cls.MIN_DURATION), cls.GAMMA))
+
+    @classmethod
+    def value_of(cls, bin: int) -> float:
+        """Значение корзины: относительная ошибка до RELATIVE_ACCURACY для любой длительности в ней"""
+        return 2 * cls.GAMMA ** bin / (cls.GAMMA + 1)
+
+    @property
+    def count(self) -> int:
+        return sum(self.bins.values())
+
+    def add(self, seconds: float, count: int = 1):
+        bin = self.bin_of(seconds)
+        self.bins[bin] = self.bins.get(bin, 0) + count
+
+    def merge(self, other: "DurationSketch"):
+        for bin, count in other.bins.items():
+            self.bins[bin] = self.bins.get(bin, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Длительность q-квантиля (None для пустой гистограммы)"""
+        total = self.count
+        if not total:
+            return None
+        # Ранг по методу ближайшего ранга: p99 из двух значений - большее
+        rank = max(math.ceil(q * total), 1)
+        seen = 0
+        for bin in sorted(self.bins):
+            seen += self.bins[bin]
+            if seen >= rank:
+                return self.value_of(bin)
+        return self.value_of(max(self.bins))
+
+
+def to_utc(moment: datetime) -> datetime:
+    """Время в UTC с часовым поясом (SQLite возвращает время без пояса)"""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """Начало интервала granularity, в который попадает moment (UTC)"""
+    moment = to_utc(moment)
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _event_insert(dialect: str, row: str) -> str:
+    """INSERT в журнал завершения задачи из строки {row}"""
+    now = "now()" if dialect == "postgresql" else "CURRENT_TIMESTAMP"
+    return (
+        f"INSERT INTO task_finish_events (project_id, agent_id, status, finished_at, duration) "
+        f"VALUES ({row}.project_id, {row}.agent_id, {row}.status, coalesce({row}.finished_at, {now}), "
+        f"{DURATION_SQL[dialect].format(row=row)})"
+    )
+
+
+# Условие завершённой задачи в строке {row}
+_finished = "{row}.status IN ('completed', 'failed')"
+
+ROLLUP_DDL = {
+    "sqlite": (
+        f"CREATE TRIGGER IF NOT EXISTS task_rollups_insert AFTER INSERT ON tasks "
+        f"WHEN {_finished.format(row='new')} BEGIN {_event_insert('sqlite', 'new')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS task_rollups_update AFTER UPDATE OF status ON tasks "
+        f"WHEN {_finished.format(row='new')} AND old.status IS NOT new.status BEGIN "
+        f"{_event_insert('sqlite', 'new')}; END",
+    ),
+    "postgresql": (
+        f"CREATE OR REPLACE FUNCTION task_rollups_track() RETURNS trigger LANGUAGE plpgsql AS $$ "
+        f"BEGIN {_event_insert('postgresql', 'NEW')}; RETURN NULL; END $$",
+        f"CREATE OR REPLACE TRIGGER task_rollups_insert AFTER INSERT ON tasks "
+        f"FOR EACH ROW WHEN ({_finished.format(row='NEW')}) EXECUTE FUNCTION task_rollups_track()",
+        f"CREATE OR REPLACE TRIGGER task_rollups_update AFTER UPDATE OF status ON tasks "
+        f"FOR EACH ROW WHEN ({_finished.format(row='NEW')} AND OLD.status IS DISTINCT FROM NEW.status) "
+        f"EXECUTE FUNCTION task_rollups_track()",
+    ),
+}
+
+_TRIGGER_EXISTS = {
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'task_rollups_update'",
+    "postgresql": "SELECT 1 FROM pg_trigger WHERE tgname = 'task_rollups_update'",
+}
+
+
+def install_rollup_triggers(connection):
+    """Создать триггеры журнала завершений на tasks (идемпотентно)"""
+    for statement in ROLLUP_DDL.get(connection.dialect.name, ()):
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Task.__table__, "after_create")
+def _create_rollup_triggers(target, connection, **kw):
+    install_rollup_triggers(connection)
+
+
+def backfill_finish_events(connection):
+    """Записать в журнал уже завершённые задачи (для агрегатов БД, созданной до их появления)"""
+    dialect = connection.dialect.name
+    now = "now()" if dialect == "postgresql" else "CURRENT_TIMESTAMP"
+    connection.exec_driver_sql(
+        f"INSERT INTO task_finish_events (project_id, agent_id, status, finished_at, duration) "
+        f"SELECT project_id, agent_id, status, coalesce(finished_at, updated_at, created_at, {now}), "
+        f"{DURATION_SQL[dialect].format(row='tasks')} "
+        f"FROM tasks WHERE {_finished.format(row='tasks')}"
+    )
+
+
+def ensure_task_rollups(engine: Engine):
+    """Установить триггеры для БД, созданной до их появления, и построить агрегаты по завершённым задачам"""
+    if engine.dialect.name not in ROLLUP_DDL:
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(_TRIGGER_EXISTS[engine.dialect.name]).first()
+        install_rollup_triggers(connection)
+        if not exists:
+            backfill_finish_events(connection)
+    if not exists:
+        with Session(engine) as db:
+            events = TaskRollupService(db).flush()
+        logger.info(f"Task rollups created from {events} finished tasks")
+
+
+class TaskRollupService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def flush(self) -> int:
+        """
+        Свернуть журнал завершений в агрегаты всех интервалов
+
+        Как и для счётчиков, журнал забирается DELETE ... RETURNING, а агрегаты
+        увеличиваются upsert в порядке ключа.
+
+        Returns:
+            Число свёрнутых завершений
+        """
+        events = self.db.execute(delete(TaskFinishEvent).returning(
+            TaskFinishEvent.project_id, TaskFinishEvent.agent_id, TaskFinishEvent.status,
+            TaskFinishEvent.finished_at, TaskFinishEvent.duration
+        )).all()
+        if not events:
+            self.db.commit()
+            return 0
+
+        rollups: Dict[tuple, List] = {}
+        bins: Dict[tuple, int] = {}
+        for project_id, agent_id, status, finished_at, duration in events:
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(finished_at, granularity), project_id, agent_id)
+                totals = rollups.setdefault(key, [0, 0, 0.0, 0])
+                totals[0 if status == "completed" else 1] += 1
+                if duration is not None:
+                    totals[2] += duration
+                    totals[3] += 1
+                    bin_key = key + (DurationSketch.bin_of(duration),)
+                    bins[bin_key] = bins.get(bin_key, 0) + 1
+
+        key_columns = ("granularity", "bucket_start", "project_id", "agent_id")
+        stmt = dialect_insert(self.db, TaskRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={
+                name: getattr(TaskRollup, name) + stmt.excluded[name]
+                for name in ("completed", "failed", "duration_sum", "duration_count")
+            }
+        )
+        self.db.execute(stmt, [
+            {**dict(zip(key_columns, key)),
+             "completed": completed, "failed": failed, "duration_sum": duration_sum, "duration_count": duration_count}
+            for key, (completed, failed, duration_sum, duration_count) in sorted(rollups.items())
+        ])
+
+        if bins:
+            stmt = dialect_insert(self.db, TaskRollupDuration)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[*key_columns, "bin"],
+                set_={"count": TaskRollupDuration.count + stmt.excluded.count}
+            )
+            self.db.execute(stmt, [
+                {**dict(zip((*key_columns, "bin"), key)), "count": count}
+                for key, count in sorted(bins.items())
+            ])
+
+        self.db.commit()
+        return len(events)
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """Удалить минутные и часовые агрегаты старше срока хранения; дневные хранятся всегда"""
+        now = to_utc(now or datetime.now(timezone.utc))
+        retention = {
+            "minute": timedelta(hours=settings.STATS_ROLLUP_MINUTE_RETENTION_HOURS),
+            "hour": timedelta(days=settings.STATS_ROLLUP_HOUR_RETENTION_DAYS),
+        }
+        deleted = 0
+        for granularity, keep in retention.items():
+            if keep.total_seconds() <= 0:
+                continue
+            for model in (TaskRollup, TaskRollupDuration):
+                deleted += self.db.execute(delete(model).where(
+                    model.granularity == granularity, model.bucket_start < now - keep
+                )).rowcount
+        self.db.commit()
+        return deleted
+
+    def _filtered(self, query, model, granularity: str, start: datetime, end: datetime,
+                  project_id: Optional[int], agent_id: Optional[int]):
+        query = query.where(model.granularity == granularity, model.bucket_start >= start, model.bucket_start < end)
+        if project_id is not None:
+            query = query.where(model.project_id == project_id)
+        if agent_id is not None:
+            query = query.where(model.agent_id == agent_id)
+        return query
+
+    def timeseries(self, granularity: str, start: datetime, end: datetime,
+                   project_id: Optional[int] = None, agent_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Точки графика за [start, end) и итог за всё окно
+
+        Интервалы без завершённых задач возвращаются с нулями, чтобы ряд был
+        непрерывным.
+
+        Returns:
+            {"points": [...], "summary": {...}}; поля точки: bucket, completed,
+            failed, failure_rate, average_duration, p50, p95, p99
+        """
+        start, end = bucket_start(start, granularity), to_utc(end)
+
+        totals: Dict[datetime, Tuple[int, int, float, int]] = {}
+        query = self._filtered(
+            select(TaskRollup.bucket_start, func.sum(TaskRollup.completed), func.sum(TaskRollup.failed),
+                   func.sum(TaskRollup.duration_sum), func.sum(TaskRollup.duration_count)),
+            TaskRollup, granularity, start, end, project_id, agent_id
+        ).group_by(TaskRollup.bucket_start)
+        for bucket, completed, failed, duration_sum, duration_count in self.db.execute(query):
+            totals[to_utc(bucket)] = (completed, failed, duration_sum, duration_count)
+
+        sketches: Dict[datetime, DurationSketch] = {}
+        query = self._filtered(
+            select(TaskRollupDuration.bucket_start, TaskRollupDuration.bin, func.sum(TaskRollupDuration.count)),
+            TaskRollupDuration, granularity, start, end, project_id, agent_id
+        ).group_by(TaskRollupDuration.bucket_start, TaskRollupDuration.bin)
+        for bucket, bin, count in self.db.execute(query):
+            sketches.setdefault(to_utc(bucket), DurationSketch()).bins[bin] = count
+
+        points = []
+        window = DurationSketch()
+        window_totals = [0, 0, 0.0, 0]
+        step = GRANULARITIES[granularity]
+        bucket = start
+        while bucket < end:
+            bucket_totals = totals.get(bucket, (0, 0, 0.0, 0))
+            sketch = sketches.get(bucket, DurationSketch())
+            points.append({"bucket": bucket, **_point(bucket_totals, sketch)})
+            window.merge(sketch)
+            window_totals = [total + value for total, value in zip(window_totals, bucket_totals)]
+            bucket += step
+
+        return {"points": points, "summary": _point(window_totals, window)}
+
+
+def _point(totals: Iterable, sketch: DurationSketch) -> Dict[str, Any]:
+    completed, failed, duration_sum, duration_count = totals
+    finished = completed + failed
+    point = {
+        "completed": completed,
+        "failed": failed,
+        "failure_rate": failed / finished if finished else None,
+        "average_duration": duration_sum / duration_count if duration_count else None,
+    }
+    for q in PERCENTILES:
+        point[f"p{round(q * 100)}"] = sketch.quantile(q)
+    return point
+
+
+class AsyncTaskRollupService:
+    """Асинхронная версия TaskRollupService (через AsyncSession.run_sync)"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def flush(self) -> int:
+        return await self.db.run_sync(lambda session: TaskRollupService(session).flush())
+
+    async def prune(self, now: Optional[datetime] = None) -> int:
+        return await self.db.run_sync(lambda session: TaskRollupService(session).prune(now))
+
+    async def timeseries(self, granularity: str, start: datetime, end: datetime,
+                         project_id: Optional[int] = None, agent_id: Optional[int] = None) -> Dict[str, Any]:
+        return await self.db.run_sync(
+            lambda session: TaskRollupService(session).timeseries(granularity, start, end, project_id, agent_id)
+        )
@@ -0,0 +1,188 @@
+"""
+Индексированный поиск задач по title, description, result и error_message
+
+PostgreSQL: GIN индекс по выражению to_tsvector('simple', ...) для q= и
+триграммный (pg_trgm) GIN индекс по title для подстрочного task_name
+(ILIKE '%x%'). Индексы создаёт миграция Alembic b7e4c1d92a3f, а для БД,
+созданной create_all, - создание tasks или ensure_search_index при старте.
+
+SQLite: FTS5 таблица tasks_fts (external content над tasks, токенизатор
+trigram - поиск подстрок). Таблицу синхронизируют триггеры на tasks, поэтому
+индекс обновляется в той же транзакции при любой записи WebhookService:
+upsert start, UPDATE ... RETURNING, пакетная обработка, импорт и сброс прогресса.
+Таблица и триггеры создаются вместе с tasks (create_all) или ensure_search_index
+для существующей БД.
+
+Релевантность: ts_rank_cd на PostgreSQL, bm25 на SQLite.
+"""
+
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, literal_column, or_, select, text
+from sqlalchemy.engine import Engine
+
+from models.models import Task
+
+logger = logging.getLogger(__name__)
+
+# Колонки задачи, по которым выполняется поиск q=
+SEARCH_COLUMNS = ("title", "description", "result", "error_message")
+
+# Минимальная длина подстроки, которую находит триграммный индекс FTS5
+TRIGRAM_MIN_LENGTH = 3
+
+
+
+def _postgres_document(prefix: str = "") -> str:
+    """Выражение to_tsvector по колонкам поиска (prefix - квалификатор колонок)"""
+    return "to_tsvector('simple', " + " || ' ' || ".join(
+        f"coalesce({prefix}{name}, '')" for name in SEARCH_COLUMNS
+    ) + ")"
+
+
+# Документ для полнотекстового поиска PostgreSQL; выражение должно совпадать с индексом ix_tasks_search
+POSTGRES_DOCUMENT = _postgres_document("tasks.")
+
+# Индексы поиска PostgreSQL (те же, что в миграции b7e4c1d92a3f); {concurrently} - для заполненной tasks
+POSTGRES_SEARCH_INDEXES = (
+    f"CREATE INDEX {{concurrently}}IF NOT EXISTS ix_tasks_search ON tasks USING gin ({_postgres_document()})",
+    "CREATE INDEX {concurrently}IF NOT EXISTS ix_tasks_title_trgm ON tasks USING gin (title gin_trgm_ops)",
+)
+
+_fts_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{name}" for name in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{name}" for name in SEARCH_COLUMNS)
+
+SQLITE_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5({_fts_columns}, "
+    f"content='tasks', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+    f"INSERT INTO tasks_fts(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+    f"INSERT INTO tasks_fts(tasks_fts, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    # Срабатывает только если UPDATE меняет индексируемые колонки (не на обновления прогресса)
+    f"CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF {_fts_columns} ON tasks BEGIN "
+    f"INSERT INTO tasks_fts(tasks_fts, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO tasks_fts(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+)
+
+
+def install_sqlite_search(connection, rebuild: bool = False):
+    """Создать FTS5 таблицу и триггеры (идемпотентно); rebuild - проиндексировать существующие задачи"""
+    for statement in SQLITE_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    if rebuild:
+        connection.exec_driver_sql("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+
+
+def install_postgres_search(connection, concurrently: bool = False):
+    """
+    Создать pg_trgm и GIN индексы поиска (идемпотентно)
+
+    concurrently - строить индексы без блокировки записи в tasks; требует
+    соединения в режиме AUTOCOMMIT.
+    """
+    connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for statement in POSTGRES_SEARCH_INDEXES:
+        connection.exec_driver_sql(statement.format(concurrently="CONCURRENTLY " if concurrently else ""))
+
+
+@event.listens_for(Task.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        install_sqlite_search(connection)
+    elif connection.dialect.name == "postgresql":
+        install_postgres_search(connection)
+
+
+@event.listens_for(Task.__table__, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS tasks_fts")
+
+
+def ensure_search_index(engine: Engine):
+    """Создать поисковый индекс для БД, созданной до его появления или без миграций"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            install_postgres_search(connection, concurrently=True)
+        return
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+        ).first()
+        install_sqlite_search(connection, rebuild=not exists)
+    if not exists:
+        logger.info("Task search index created")
+
+
+def search_tokens(q: str) -> List[str]:
+    """Слова запроса в нижнем регистре (без операторов и пунктуации)"""
+    return re.findall(r"\w+", q.lower())
+
+
+def _fts_phrase(value: str) -> str:
+    """Строка FTS5: подстрока в кавычках (кавычки внутри удваиваются)"""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _sqlite_match(expression: str):
+    """Подзапрос (id, rank) задач, найденных FTS5; меньший bm25 - выше релевантность"""
+    return (
+        select(literal_column("tasks_fts.rowid").label("id"), literal_column("bm25(tasks_fts)").label("rank"))
+        .select_from(text("tasks_fts"))
+        .where(literal_column("tasks_fts").op("MATCH")(expression))
+        .subquery("search_match")
+    )
+
+
+def apply_text_search(query, q: str, dialect: str) -> Tuple[object, Optional[object]]:
+    """
+    Отфильтровать запрос задач по q во всех колонках поиска
+
+    Все слова запроса должны встретиться в задаче (на PostgreSQL - как
+    префиксы слов, на SQLite - как подстроки).
+
+    Returns:
+        Запрос и выражение сортировки по релевантности (None - релевантность недоступна)
+    """
+    tokens = search_tokens(q)
+    if not tokens:
+        return query, None
+
+    if dialect == "postgresql":
+        document = literal_column(POSTGRES_DOCUMENT)
+        ts_query = func.to_tsquery(literal_column("'simple'"), " & ".join(f"{token}:*" for token in tokens))
+        rank = func.ts_rank_cd(document, ts_query)
+        return query.where(document.op("@@")(ts_query)), rank.desc()
+
+    columns = [getattr(Task, name) for name in SEARCH_COLUMNS]
+    # Слова короче триграммы индекс не находит - они проверяются LIKE по уже найденным задачам
+    short = [token for token in tokens if len(token) < TRIGRAM_MIN_LENGTH]
+    long = [token for token in tokens if len(token) >= TRIGRAM_MIN_LENGTH]
+    if short:
+        query = query.where(and_(*(
+            or_(*(column.icontains(token, autoescape=True) for column in columns)) for token in short
+        )))
+    if not long:
+        return query, None
+
+    match = _sqlite_match(" ".join(_fts_phrase(token) for token in long))
+    return query.join(match, match.c.id == Task.id), match.c.rank.asc()
+
+
+def apply_title_filter(query, task_name: str, dialect: str):
+    """
+    Фильтр по подстроке в названии задачи
+
+    На PostgreSQL ILIKE обслуживает триграммный индекс, на SQLite - колонка
+    title таблицы tasks_fts (подстроки от трёх символов).
+    """
+    if dialect == "sqlite" and len(task_name) >= TRIGRAM_MIN_LENGTH:
+        match = _sqlite_match("title : " + _fts_phrase(task_name))
+        return query.where(Task.id.in_(select(match.c.id)))
+    return query.where(Task.title.ilike(f"%{task_name}%"))
@@ -1,198 +1,736 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from typing import Optional, Dict, Any
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, select, func, update, bindparam, table, column, text
+from sqlalchemy.dialects import postgresql
+from typing import Optional, Dict, Any, List, Iterable, Union
 from datetime import datetime, timezone
+import asyncio
+import json
 
-from models.models import Project, Agent, Task
+from core.config import settings
+from core.database import dialect_insert, supports_copy, copy_records
+from models.models import Project, Agent, Task, TASK_IS_RUNNING
 from models.schemas import WebhookStart, WebhookFinish, WebhookStatus, WebhookError
 from services.websocket_service import websocket_service
+from services.id_cache import NameIdCache, project_id_cache, agent_id_cache
+from services.progress_buffer import progress_buffer, TaskProgressState
 
 
 class WebhookService:
     def __init__(self, db: Session):
         self.db = db
+        # Созданные в текущей транзакции проекты/агенты попадают в кэш только после commit
+        self._created_names = []
 
-    def _get_or_create_project(self, project_name: str) -> Project:
-        """Получить или создать проект"""
-        project = self.db.query(Project).filter(Project.name == project_name).first()
-        if not project:
-            project = Project(name=project_name)
-            self.db.add(project)
-            self.db.commit()
-            self.db.refresh(project)
-        return project
-
-    def _get_or_create_agent(self, agent_name: str) -> Agent:
-        """Получить или создать агента"""
-        agent = self.db.query(Agent).filter(Agent.name == agent_name).first()
-        if not agent:
-            agent = Agent(name=agent_name)
-            self.db.add(agent)
-            self.db.commit()
-            self.db.refresh(agent)
-        return agent
+    def _commit(self):
+        """Зафиксировать транзакцию и добавить созданные имена в кэш"""
+        self.db.commit()
+        for cache, name, entity_id in self._created_names:
+            cache.set(name, entity_id)
+        self._created_names.clear()
+
+    def _resolve_id(self, model, cache: NameIdCache, name: str) -> int:
+        """Получить id проекта/агента по имени, создав его при необходимости"""
+        entity_id = cache.get(name)
+        if entity_id is not None:
+            return entity_id
+        return self._resolve_ids(model, cache, [name])[name]
+
+    def _resolve_ids(self, model, cache: NameIdCache, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Получить id проектов/агентов по именам
+
+        Промахи кэша разрешаются одним INSERT ... ON CONFLICT DO NOTHING RETURNING;
+        имена, уже существующие в БД (в том числе созданные конкурентно),
+        дочитываются одним SELECT.
+        """
+        ids: Dict[str, int] = {}
+        missing = []
+        for name in set(names):
+            entity_id = cache.get(name)
+            if entity_id is None:
+                missing.append(name)
+            else:
+                ids[name] = entity_id
+
+        if not missing:
+            return ids
+
+        stmt = (
+            dialect_insert(self.db, model)
+            .values([{"name": name} for name in missing])
+            .on_conflict_do_nothing(index_elements=[model.name])
+            .returning(model.id, model.name)
+        )
+        for row in self.db.execute(stmt):
+            ids[row.name] = row.id
+            self._created_names.append((cache, row.name, row.id))
+
+        conflicted = [name for name in missing if name not in ids]
+        if conflicted:
+            for row in self.db.execute(select(model.id, model.name).where(model.name.in_(conflicted))):
+                ids[row.name] = row.id
+                cache.set(row.name, row.id)
+
+        return ids
+
+    def _load_names(self, model, cache: NameIdCache, ids: Iterable[int]) -> Dict[int, str]:
+        """Получить имена проектов/агентов по id: из кэша, остальные одним запросом"""
+        names = {}
+        missing = set()
+        for entity_id in set(ids):
+            name = cache.get_name(entity_id)
+            if name is None:
+                missing.add(entity_id)
+            else:
+                names[entity_id] = name
+
+        if missing:
+            for row in self.db.execute(select(model.id, model.name).where(model.id.in_(missing))):
+                names[row.id] = row.name
+                cache.set(row.name, row.id)
+        return names
+
+    @staticmethod
+    def _event_time(data) -> datetime:
+        """Время события в UTC: occurred_at исторического события или текущее"""
+        occurred_at = getattr(data, "occurred_at", None)
+        if occurred_at is None:
+            return datetime.now(timezone.utc)
+        if occurred_at.tzinfo is None:
+            return occurred_at.replace(tzinfo=timezone.utc)
+        return occurred_at.astimezone(timezone.utc)
+
+    @classmethod
+    def _start_values(cls, data: WebhookStart, project_id: int, agent_id: int) -> Dict[str, Any]:
+        return {
+            "task_id": data.task_id,
+            "title": data.task,
+            "description": data.task,  # Используем то же поле для описания
+            "status": "running",
+            "started_at": cls._event_time(data),
+            "task_metadata": data.metadata,
+            "project_id": project_id,
+            "agent_id": agent_id
+        }
 
-    def handle_start_webhook(self, data: WebhookStart) -> Task:
-        """Обработать вебхук начала задачи"""
-        # Получаем или создаем проект и агента
-        project = self._get_or_create_project(data.project)
-        agent = self._get_or_create_agent(data.agent)
-
-        # Проверяем, существует ли задача
-        task = self.db.query(Task).filter(Task.task_id == data.task_id).first()
-
-        if task:
-            # Обновляем существующую задачу
-            task.title = data.task
-            task.description = data.task  # Используем то же поле для описания
-            task.status = "running"
-            task.started_at = datetime.now(timezone.utc)
-            task.task_metadata = data.metadata
-            task.project_id = project.id
-            task.agent_id = agent.id
-        else:
-            # Создаем новую задачу
-            task = Task(
-                task_id=data.task_id,
-                title=data.task,
-                description=data.task,
-                status="running",
-                started_at=datetime.now(timezone.utc),
-                task_metadata=data.metadata,
-                project_id=project.id,
-                agent_id=agent.id
+    def _upsert_started_task(self, data: WebhookStart, project_id: int, agent_id: int) -> Task:
+        """Создать или перезапустить задачу одним INSERT ... ON CONFLICT DO UPDATE RETURNING"""
+        values = self._start_values(data, project_id, agent_id)
+        stmt = dialect_insert(self.db, Task).values(**values)
+        update_values = {key: stmt.excluded[key] for key in values if key != "task_id"}
+        update_values["updated_at"] = func.now()
+        stmt = stmt.on_conflict_do_update(index_elements=[Task.task_id], set_=update_values)
+
+        return self.db.scalars(
+            stmt.returning(Task), execution_options={"populate_existing": True}
+        ).one()
+
+    @staticmethod
+    def _notify(coroutine):
+        """Запланировать WebSocket уведомление"""
+        asyncio.create_task(coroutine)
+
+    # Применение событий к задаче
+
+    @classmethod
+    def _apply_start(cls, task: Task, data: WebhookStart, project_id: int, agent_id: int):
+        task.title = data.task
+        task.description = data.task  # Используем то же поле для описания
+        task.status = "running"
+        task.started_at = cls._event_time(data)
+        task.task_metadata = data.metadata
+        task.project_id = project_id
+        task.agent_id = agent_id
+
+    @classmethod
+    def _finish_values(cls, data: WebhookFinish) -> Dict[str, Any]:
+        return {
+            "status": "completed",
+            "finished_at": cls._event_time(data),
+            "result": data.result,
+            "duration_seconds": data.duration_seconds,
+            "task_metadata": data.metadata
+        }
+
+    @staticmethod
+    def _status_values(data: WebhookStatus) -> Dict[str, Any]:
+        values = {
+            "status": data.status,
+            "progress": data.progress,
+            "task_metadata": data.metadata
+        }
+        if data.message:
+            values["description"] = data.message
+        return values
+
+    @classmethod
+    def _error_values(cls, data: WebhookError) -> Dict[str, Any]:
+        values = {
+            "status": "failed",
+            "finished_at": cls._event_time(data),
+            "error_message": f"{data.error_type}: {data.error_message}",
+            "task_metadata": data.metadata
+        }
+        if data.stack_trace:
+            values["description"] = data.stack_trace
+        return values
+
+    @staticmethod
+    def _apply_values(task: Task, values: Dict[str, Any]):
+        for key, value in values.items():
+            setattr(task, key, value)
+
+    def _apply_finish(self, task: Task, data: WebhookFinish):
+        self._apply_values(task, self._finish_values(data))
+
+    def _apply_status(self, task: Task, data: WebhookStatus):
+        self._apply_values(task, self._status_values(data))
+
+    def _apply_error(self, task: Task, data: WebhookError):
+        self._apply_values(task, self._error_values(data))
+
+    def _update_task(self, task_id: str, values: Dict[str, Any], *criteria, returning: tuple = ()):
+        """
+        Обновить задачу одним UPDATE ... RETURNING
+
+        Имена проекта и агента для уведомления возвращаются тем же запросом
+        через коррелированные подзапросы, поэтому refresh и дополнительные
+        SELECT не нужны.
+
+        Returns:
+            Строка (Task, project_name, agent_name, *returning) или None, если задача не найдена
+        """
+        task_project = aliased(Project, name="task_project")
+        task_agent = aliased(Agent, name="task_agent")
+        project_name = select(task_project.name).where(task_project.id == Task.project_id).correlate(Task)
+        agent_name = select(task_agent.name).where(task_agent.id == Task.agent_id).correlate(Task)
+
+        stmt = (
+            update(Task)
+            .where(Task.task_id == task_id, *criteria)
+            .values(**values)
+            .returning(
+                Task,
+                project_name.scalar_subquery().label("project_name"),
+                agent_name.scalar_subquery().label("agent_name"),
+                *returning
             )
-            self.db.add(task)
+        )
+        return self.db.execute(stmt).first()
 
-        self.db.commit()
-        self.db.refresh(task)
+    @staticmethod
+    def _task_state(task: Task) -> tuple:
+        """Состояние задачи для буфера прогресса (читается до commit, пока атрибуты загружены)"""
+        return task.task_id, task.id, task.status, task.progress
 
-        # Отправляем WebSocket уведомление
-        task_data = {
+    # Данные для WebSocket уведомлений
+
+    @staticmethod
+    def _started_payload(task: Task, project_name: str, agent_name: str) -> Dict[str, Any]:
+        return {
             "task_id": task.task_id,
             "title": task.title,
-            "project": project.name,
-            "agent": agent.name,
+            "project": project_name,
+            "agent": agent_name,
             "status": task.status,
             "started_at": task.started_at.isoformat() if task.started_at else None,
-            "project_id": project.id
+            "project_id": task.project_id
         }
-        import asyncio
-        asyncio.create_task(websocket_service.notify_task_started(task_data))
+
+    @staticmethod
+    def _finished_payload(task: Task, project_name: str, agent_name: Optional[str]) -> Dict[str, Any]:
+        return {
+            "task_id": task.task_id,
+            "title": task.title,
+            "project": project_name,
+            "agent": agent_name or "Unknown",
+            "status": task.status,
+            "duration_seconds": task.duration_seconds,
+            "finished_at": task.finished_at.isoformat() if task.finished_at else None,
+            "result": task.result,
+            "project_id": task.project_id
+        }
+
+    @staticmethod
+    def _status_payload(task: Task, project_name: str, agent_name: Optional[str], message: Optional[str]) -> Dict[str, Any]:
+        return {
+            "task_id": task.task_id,
+            "title": task.title,
+            "project": project_name,
+            "agent": agent_name or "Unknown",
+            "status": task.status,
+            "progress": task.progress,
+            "message": message,
+            "project_id": task.project_id
+        }
+
+    @staticmethod
+    def _error_payload(task: Task, project_name: str, agent_name: Optional[str], data: WebhookError) -> Dict[str, Any]:
+        return {
+            "task_id": task.task_id,
+            "title": task.title,
+            "project": project_name,
+            "agent": agent_name or "Unknown",
+            "status": task.status,
+            "error_type": data.error_type,
+            "error_message": data.error_message,
+            "finished_at": task.finished_at.isoformat() if task.finished_at else None,
+            "project_id": task.project_id
+        }
+
+    def handle_start_webhook(self, data: WebhookStart) -> Task:
+        """Обработать вебхук начала задачи"""
+        # Получаем или создаем проект и агента (обычно из кэша, без запросов)
+        project_id = self._resolve_id(Project, project_id_cache, data.project)
+        agent_id = self._resolve_id(Agent, agent_id_cache, data.agent)
+
+        # Создаем задачу или перезапускаем существующую
+        task = self._upsert_started_task(data, project_id, agent_id)
+        task_data = self._started_payload(task, data.project, data.agent)
+        task_state = self._task_state(task)
+
+        self._commit()
+        progress_buffer.remember(*task_state)
+
+        # Отправляем WebSocket уведомление
+        self._notify(websocket_service.notify_task_started(task_data))
 
         return task
 
     def handle_finish_webhook(self, data: WebhookFinish) -> Optional[Task]:
         """Обработать вебхук завершения задачи"""
-        task = self.db.query(Task).filter(Task.task_id == data.task_id).first()
+        row = self._update_task(data.task_id, self._finish_values(data))
 
-        if not task:
+        if not row:
             return None
 
-        task.status = "completed"
-        task.finished_at = datetime.utcnow()
-        task.result = data.result
-        task.duration_seconds = data.duration_seconds
-        task.task_metadata = data.metadata
+        task, project_name, agent_name = row
+        task_data = self._finished_payload(task, project_name, agent_name) if project_name else None
+        task_state = self._task_state(task)
 
         self.db.commit()
-        self.db.refresh(task)
+        progress_buffer.remember(*task_state)
 
         # Отправляем WebSocket уведомление
-        project = self.db.query(Project).filter(Project.id == task.project_id).first()
-        agent = self.db.query(Agent).filter(Agent.id == task.agent_id).first()
-
-        if project:
-            task_data = {
-                "task_id": task.task_id,
-                "title": task.title,
-                "project": project.name,
-                "agent": agent.name if agent else "Unknown",
-                "status": task.status,
-                "duration_seconds": task.duration_seconds,
-                "finished_at": task.finished_at.isoformat() if task.finished_at else None,
-                "result": task.result,
-                "project_id": project.id
-            }
-            import asyncio
-            asyncio.create_task(websocket_service.notify_task_finished(task_data))
+        if task_data:
+            self._notify(websocket_service.notify_task_finished(task_data))
 
         return task
 
-    def handle_status_webhook(self, data: WebhookStatus) -> Optional[Task]:
+    def handle_status_webhook(self, data: WebhookStatus) -> Optional[Union[Task, TaskProgressState]]:
         """Обработать вебхук статуса задачи"""
-        task = self.db.query(Task).filter(Task.task_id == data.task_id).first()
-
-        if not task:
+        # Обновление без смены статуса только запоминается и сбрасывается в БД позже.
+        # Статус берётся из кэша буфера, а из БД - только если в кэше нет подтверждённого
+        if progress_buffer.enabled:
+            current = progress_buffer.known_status(data.task_id)
+            if current is None:
+                row = self.db.execute(select(Task.id, Task.status).where(Task.task_id == data.task_id)).first()
+                current = progress_buffer.confirm(data.task_id, *row) if row else None
+            buffered = progress_buffer.try_buffer(data, *current) if current else None
+            if buffered:
+                return buffered
+
+        # Прежний статус читается тем же UPDATE из CTE: RETURNING видит уже новые
+        # значения. CTE материализуется и используется в WHERE, поэтому вычисляется
+        # до изменения строки (в PostgreSQL ещё и блокирует её)
+        old = (
+            select(Task.id, Task.status)
+            .where(Task.task_id == data.task_id)
+            .with_for_update()
+            .cte("old_task")
+            .prefix_with("MATERIALIZED")
+        )
+        status_changed = select(old.c.status).scalar_subquery().is_distinct_from(data.status)
+        row = self._update_task(
+            data.task_id,
+            self._status_values(data),
+            Task.id == select(old.c.id).scalar_subquery(),
+            returning=(status_changed.label("status_changed"),)
+        )
+
+        if not row:
             return None
 
-        old_status = task.status
-        task.status = data.status
-        task.progress = data.progress
-        task.task_metadata = data.metadata
-
-        if data.message:
-            task.description = data.message
+        task, project_name, agent_name, status_changed = row
+        task_data = None
+        if status_changed and project_name:
+            task_data = self._status_payload(task, project_name, agent_name, data.message)
+        task_state = self._task_state(task)
 
         self.db.commit()
-        self.db.refresh(task)
+        progress_buffer.remember(*task_state)
 
         # Отправляем WebSocket уведомление только если статус изменился
-        if old_status != data.status:
-            project = self.db.query(Project).filter(Project.id == task.project_id).first()
-            agent = self.db.query(Agent).filter(Agent.id == task.agent_id).first()
-
-            if project:
-                task_data = {
-                    "task_id": task.task_id,
-                    "title": task.title,
-                    "project": project.name,
-                    "agent": agent.name if agent else "Unknown",
-                    "status": task.status,
-                    "progress": task.progress,
-                    "message": data.message,
-                    "project_id": project.id
-                }
-                import asyncio
-                asyncio.create_task(websocket_service.notify_task_status_updated(task_data))
+        if task_data:
+            self._notify(websocket_service.notify_task_status_updated(task_data))
 
         return task
 
     def handle_error_webhook(self, data: WebhookError) -> Optional[Task]:
         """Обработать вебхук ошибки задачи"""
-        task = self.db.query(Task).filter(Task.task_id == data.task_id).first()
+        row = self._update_task(data.task_id, self._error_values(data))
 
-        if not task:
+        if not row:
             return None
 
-        task.status = "failed"
-        task.finished_at = datetime.utcnow()
-        task.error_message = f"{data.error_type}: {data.error_message}"
-        task.task_metadata = data.metadata
-
-        if data.stack_trace:
-            task.description = data.stack_trace
+        task, project_name, agent_name = row
+        task_data = self._error_payload(task, project_name, agent_name, data) if project_name else None
+        task_state = self._task_state(task)
 
         self.db.commit()
-        self.db.refresh(task)
+        progress_buffer.remember(*task_state)
 
         # Отправляем WebSocket уведомление
-        project = self.db.query(Project).filter(Project.id == task.project_id).first()
-        agent = self.db.query(Agent).filter(Agent.id == task.agent_id).first()
+        if task_data:
+            self._notify(websocket_service.notify_task_error(task_data))
 
-        if project:
-            task_data = {
-                "task_id": task.task_id,
-                "title": task.title,
-                "project": project.name,
-                "agent": agent.name if agent else "Unknown",
-                "status": task.status,
-                "error_type": data.error_type,
-                "error_message": data.error_message,
-                "finished_at": task.finished_at.isoformat() if task.finished_at else None,
-                "project_id": project.id
+        return task
+
+    def handle_batch(self, events: List[Any], notify: bool = True) -> List[Dict[str, Any]]:
+        """
+        Обработать пачку вебхуков в одной транзакции
+
+        Проекты, агенты и задачи загружаются пачкой, события применяются
+        по порядку, изменения сбрасываются одним flush и фиксируются одним commit.
+
+        Args:
+            events: События WebhookBatchStart/Finish/Status/Error в порядке применения
+            notify: Отправлять ли WebSocket уведомления после commit
+
+        Returns:
+            Список результатов по каждому событию
+        """
+        starts = [event for event in events if event.event == "start"]
+        projects = self._resolve_ids(Project, project_id_cache, (event.project for event in starts))
+        agents = self._resolve_ids(Agent, agent_id_cache, (event.agent for event in starts))
+
+        task_ids = {event.task_id for event in events}
+        tasks: Dict[str, Task] = {
+            task.task_id: task
+            for task in self.db.query(Task).filter(Task.task_id.in_(task_ids)).all()
+        }
+
+        # Имена для уведомлений: по одному запросу на таблицу
+        project_names = {project_id: name for name, project_id in projects.items()}
+        agent_names = {agent_id: name for name, agent_id in agents.items()}
+        project_names.update(self._load_names(
+            Project, project_id_cache, {task.project_id for task in tasks.values()} - project_names.keys()
+        ))
+        agent_names.update(self._load_names(
+            Agent, agent_id_cache, {task.agent_id for task in tasks.values()} - agent_names.keys()
+        ))
+
+        applied = []  # (index, event, task, status_in_db)
+        results: List[Optional[Dict[str, Any]]] = []
+        notifications = []  # (метод websocket_service, данные)
+
+        for index, event in enumerate(events):
+            task = tasks.get(event.task_id)
+
+            if event.event != "start" and not task:
+                results.append({
+                    "index": index,
+                    "event": event.event,
+                    "task_id": event.task_id,
+                    "status": "not_found"
+                })
+                continue
+
+            if event.event == "start":
+                if not task:
+                    task = Task(task_id=event.task_id)
+                    self.db.add(task)
+                    tasks[event.task_id] = task
+                self._apply_start(task, event, projects[event.project], agents[event.agent])
+            elif event.event == "finish":
+                self._apply_finish(task, event)
+            elif event.event == "status":
+                old_status = task.status
+                self._apply_status(task, event)
+            else:
+                self._apply_error(task, event)
+
+            applied.append((index, event, task, task.status))
+            results.append(None)
+
+            project_name = project_names.get(task.project_id)
+            agent_name = agent_names.get(task.agent_id)
+            if not notify or project_name is None:
+                continue
+
+            if event.event == "start":
+                notifications.append((websocket_service.notify_task_started,
+                                      self._started_payload(task, project_name, agent_name)))
+            elif event.event == "finish":
+                notifications.append((websocket_service.notify_task_finished,
+                                      self._finished_payload(task, project_name, agent_name)))
+            elif event.event == "status":
+                if old_status != event.status:
+                    notifications.append((websocket_service.notify_task_status_updated,
+                                          self._status_payload(task, project_name, agent_name, event.message)))
+            else:
+                notifications.append((websocket_service.notify_task_error,
+                                      self._error_payload(task, project_name, agent_name, event)))
+
+        self.db.flush()
+
+        for index, event, task, status_in_db in applied:
+            results[index] = {
+                "index": index,
+                "event": event.event,
+                "task_id": event.task_id,
+                "status": "accepted",
+                "database_id": task.id,
+                "status_in_db": status_in_db
+            }
+
+        task_states = [self._task_state(task) for task in tasks.values()]
+
+        self._commit()
+
+        for task_state in task_states:
+            progress_buffer.remember(*task_state)
+
+        for notify_method, payload in notifications:
+            self._notify(notify_method(payload))
+
+        return results
+
+    # Колонки задачи, которые заполняет импорт (полная строка для задач со start)
+    IMPORT_COLUMNS = (
+        "task_id", "title", "description", "status", "project_id", "agent_id",
+        "started_at", "finished_at", "result", "error_message", "duration_seconds",
+        "progress", "task_metadata", "created_at"
+    )
+
+    def import_events(self, events: List[Any]) -> Dict[str, int]:
+        """
+        Применить пачку исторических событий массовой записью
+
+        События сворачиваются в итоговое состояние каждой задачи, время событий
+        берётся из occurred_at (если есть). Задачи со start
+        в пачке записываются целиком одним upsert (на PostgreSQL - через COPY во
+        временную таблицу), остальным задачам применяются изменённые колонки
+        пакетными UPDATE. WebSocket уведомления не отправляются.
+
+        Returns:
+            Счётчики: events, tasks, upserted, updated, not_found
+        """
+        starts = [event for event in events if event.event == "start"]
+        projects = self._resolve_ids(Project, project_id_cache, (event.project for event in starts))
+        agents = self._resolve_ids(Agent, agent_id_cache, (event.agent for event in starts))
+
+        event_values = {
+            "finish": self._finish_values,
+            "status": self._status_values,
+            "error": self._error_values
+        }
+
+        rows: Dict[str, Dict[str, Any]] = {}
+        started = set()
+        for event in events:
+            if event.event == "start":
+                # Перезапуск отбрасывает предыдущее состояние задачи
+                rows[event.task_id] = {
+                    **self._start_values(event, projects[event.project], agents[event.agent]),
+                    "created_at": self._event_time(event)
+                }
+                started.add(event.task_id)
+            else:
+                rows.setdefault(event.task_id, {"task_id": event.task_id}).update(event_values[event.event](event))
+
+        defaults = {"progress": 0.0}
+        upserts = [
+            {name: rows[task_id].get(name, defaults.get(name)) for name in self.IMPORT_COLUMNS}
+            for task_id in started
+        ]
+        if upserts:
+            self._upsert_tasks(upserts)
+
+        updates = [values for task_id, values in rows.items() if task_id not in started]
+        found = self._update_tasks(updates) if updates else 0
+
+        self._commit()
+
+        for task_id in rows:
+            progress_buffer.forget(task_id)
+
+        return {
+            "events": len(events),
+            "tasks": len(rows),
+            "upserted": len(upserts),
+            "updated": found,
+            "not_found": len(updates) - found
+        }
+
+    def _upsert_tasks(self, rows: List[Dict[str, Any]]):
+        """Вставить или перезаписать задачи целиком"""
+        columns = self.IMPORT_COLUMNS
+
+        if supports_copy(self.db):
+            self.db.execute(text(
+                f"CREATE TEMP TABLE tasks_import ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM tasks WITH NO DATA"
+            ))
+            records = [
+                tuple(json.dumps(row[name]) if name == "task_metadata" and row[name] is not None else row[name]
+                      for name in columns)
+                for row in rows
+            ]
+            copy_records(self.db, "tasks_import", columns, records)
+            staging = table("tasks_import", *[column(name) for name in columns])
+            stmt = postgresql.insert(Task).from_select(list(columns), select(*staging.c))
+            params = None
+        else:
+            stmt = dialect_insert(self.db, Task)
+            params = rows
+
+        # Перезапуск задачи сохраняет время её создания
+        update_values = {name: stmt.excluded[name] for name in columns if name not in ("task_id", "created_at")}
+        update_values["updated_at"] = func.now()
+        stmt = stmt.on_conflict_do_update(index_elements=[Task.task_id], set_=update_values)
+        self.db.execute(stmt, params)
+
+    def _update_tasks(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        Применить изменённые колонки к существующим задачам
+
+        Строки группируются по набору колонок, каждая группа - один executemany UPDATE.
+
+        Returns:
+            Число найденных задач
+        """
+        existing = set(self.db.scalars(
+            select(Task.task_id).where(Task.task_id.in_([row["task_id"] for row in rows]))
+        ))
+
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            if row["task_id"] not in existing:
+                continue
+            values = {key: value for key, value in row.items() if key != "task_id"}
+            values["b_task_id"] = row["task_id"]
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+
+        stmt = update(Task.__table__).where(Task.__table__.c.task_id == bindparam("b_task_id"))
+        for group in groups.values():
+            self.db.execute(stmt, group)
+
+        return len(existing)
+
+    def flush_progress(self, states: List[TaskProgressState]) -> Dict[str, str]:
+        """
+        Записать отложенные обновления прогресса пакетным UPDATE
+
+        Обновление применяется только если статус задачи в БД не изменился
+        с момента буферизации, чтобы не перезаписать данные завершённой задачи.
+
+        Returns:
+            Текущие статусы задач (task_id -> status): обновлены задачи, статус которых
+            совпал с отложенным, остальные вытеснены более поздней сменой статуса
+        """
+        table = Task.__table__
+        stmt = update(table).where(
+            table.c.task_id == bindparam("b_task_id"),
+            table.c.status == bindparam("b_status")
+        )
+
+        params = {False: [], True: []}  # без сообщения / с сообщением
+        for state in states:
+            values = {
+                "b_task_id": state.task_id,
+                "b_status": state.status,
+                "progress": state.progress,
+                "task_metadata": state.metadata
             }
-            import asyncio
-            asyncio.create_task(websocket_service.notify_task_error(task_data))
+            if state.message:
+                values["description"] = state.message
+            params[bool(state.message)].append(values)
+
+        for group in params.values():
+            if group:
+                self.db.execute(stmt, group)
+
+        # rowcount executemany доступен не во всех драйверах: обновлённые строки
+        # (заблокированные этим UPDATE) определяются по статусу в той же транзакции
+        statuses = dict(self.db.execute(
+            select(Task.task_id, Task.status).where(Task.task_id.in_([state.task_id for state in states]))
+        ).all())
+        self.db.commit()
+        return statuses
+
+    def snapshot_tasks(self, project: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Снимок выполняющихся задач для WebSocket клиента, пропустившего слишком много событий
+
+        Прогресс берётся с учётом ещё не сброшенных в БД обновлений.
+        """
+        stmt = (
+            select(Task.task_id, Task.title, Project.name, Agent.name, Task.status, Task.progress,
+                   Task.description, Task.started_at, Task.project_id)
+            .join(Project, Project.id == Task.project_id)
+            .outerjoin(Agent, Agent.id == Task.agent_id)
+            .where(TASK_IS_RUNNING)
+            .order_by(Task.started_at.desc())
+            .limit(limit or settings.WEBSOCKET_SNAPSHOT_LIMIT)
+        )
+        if project:
+            stmt = stmt.where(Project.name == project)
+
+        tasks = []
+        for task_id, title, project_name, agent_name, status, progress, message, started_at, project_id \
+                in self.db.execute(stmt):
+            pending = progress_buffer.pending(task_id)
+            if pending:
+                progress = pending.progress
+                message = pending.message or message
+            tasks.append({
+                "task_id": task_id,
+                "title": title,
+                "project": project_name,
+                "agent": agent_name or "Unknown",
+                "status": status,
+                "progress": progress,
+                "message": message,
+                "started_at": started_at.isoformat() if started_at else None,
+                "project_id": project_id
+            })
+        return tasks
+
+
+class AsyncWebhookService:
+    """
+    Асинхронная версия WebhookService для обработчиков FastAPI
+
+    Логика обработки общая с WebhookService: она выполняется через
+    AsyncSession.run_sync, поэтому запросы идут через асинхронный драйвер
+    (asyncpg/aiosqlite) и не блокируют event loop.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def handle_start_webhook(self, data: WebhookStart) -> Task:
+        return await self.db.run_sync(lambda session: WebhookService(session).handle_start_webhook(data))
+
+    async def handle_finish_webhook(self, data: WebhookFinish) -> Optional[Task]:
+        return await self.db.run_sync(lambda session: WebhookService(session).handle_finish_webhook(data))
+
+    async def handle_status_webhook(self, data: WebhookStatus) -> Optional[Union[Task, TaskProgressState]]:
+        return await self.db.run_sync(lambda session: WebhookService(session).handle_status_webhook(data))
+
+    async def handle_error_webhook(self, data: WebhookError) -> Optional[Task]:
+        return await self.db.run_sync(lambda session: WebhookService(session).handle_error_webhook(data))
+
+    async def handle_batch(self, events: List[Any], notify: bool = True) -> List[Dict[str, Any]]:
+        return await self.db.run_sync(lambda session: WebhookService(session).handle_batch(events, notify))
+
+    async def import_events(self, events: List[Any]) -> Dict[str, int]:
+        return await self.db.run_sync(lambda session: WebhookService(session).import_events(events))
+
+    async def flush_progress(self, states: List[TaskProgressState]) -> Dict[str, str]:
+        return await self.db.run_sync(lambda session: WebhookService(session).flush_progress(states))
 
-        return task
\ No newline at end of file
+    async def snapshot_tasks(self, project: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self.db.run_sync(lambda session: WebhookService(session).snapshot_tasks(project, limit))
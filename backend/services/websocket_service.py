@@ -1,137 +1,916 @@
-from typing import Dict, List, Set, Any
+from typing import Dict, List, Set, Any, Optional, Iterable, Hashable, Callable, Awaitable
 from fastapi import WebSocket, WebSocketDisconnect
+from collections import OrderedDict, deque
 from datetime import datetime
+from itertools import count, islice
 import json
 import asyncio
+import logging
+import time
+
+from core.config import settings
+from core.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Код закрытия для клиентов, не успевающих принимать сообщения (Try Again Later)
+WS_CLOSE_SLOW_CONSUMER = 1013
+# Код закрытия для соединений, не подававших признаков жизни дольше таймаута (Going Away)
+WS_CLOSE_IDLE = 1001
+
+# Сообщения о прогрессе: можно объединять по task_id и отбрасывать при переполнении очереди
+PROGRESS_MESSAGE_TYPES = {"task_status_updated"}
+
+
+# Фильтры подписки в порядке убывания избирательности: клиент индексируется
+# по первому заданному фильтру, остальные проверяются только для найденных клиентов
+SUBSCRIPTION_FILTERS = ("task_ids", "agents", "projects", "events")
+
+
+def event_values(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Значения события для сопоставления с фильтрами подписки"""
+    data = message.get("data") or {}
+    return {
+        "task_ids": data.get("task_id"),
+        "agents": data.get("agent"),
+        "projects": data.get("project"),
+        "events": message.get("type")
+    }
+
+
+def event_seq(text: str) -> Optional[int]:
+    """Номер события из готового JSON (поле seq записывается последним)"""
+    _, separator, tail = text.rpartition(', "seq": ')
+    if separator and tail[:-1].isdigit():
+        return int(tail[:-1])
+    return None
+
+
+def coalesce_key(message: Dict[str, Any]) -> Optional[Hashable]:
+    """Ключ объединения для сообщений о прогрессе (None - сообщение не объединяется)"""
+    if message.get("type") in PROGRESS_MESSAGE_TYPES:
+        return message["type"], (message.get("data") or {}).get("task_id")
+    return None
+
+
+# Уникальные ключи сообщений без ключа объединения и идентификаторы подключений
+_message_keys = count()
+_connection_ids = count(1)
+
+
+class ClientConnection:
+    """
+    Запись реестра подключений: клиент (WebSocket или SSE) с ограниченной
+    очередью исходящих сообщений
+
+    Запись компактна (__slots__, фильтры создаются только при подписке), а
+    задача-писатель WebSocket клиента существует только пока в очереди есть
+    сообщения, поэтому простаивающее подключение не держит ни задачу, ни
+    объект ожидания. SSE клиенту сообщения отдаёт обработчик потокового ответа.
+    Рассылка не ждёт медленных клиентов. Политика очереди:
+      - новое обновление прогресса задачи заменяет ещё не отправленное
+        обновление той же задачи (и встаёт в конец очереди);
+      - при переполнении отбрасывается самое старое обновление прогресса;
+      - если отбросить нечего или самое старое сообщение ждёт дольше
+        max_lag секунд, клиент отключается.
+    """
+
+    __slots__ = (
+        "id", "websocket", "project", "max_queue", "max_lag", "batch_window", "queue", "writer",
+        "_waiter", "closed", "resuming", "connected_at", "last_seen", "filters", "sent", "frames", "dropped", "coalesced"
+    )
+
+    def __init__(self, websocket: Optional[WebSocket], project: Optional[str], max_queue: int, max_lag: float,
+                 batch_window: float = 0.0):
+        self.id = next(_connection_ids)
+        # None для SSE клиента
+        self.websocket = websocket
+        self.project = project
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        # Окно пакетной отправки в секундах (0 - каждое сообщение отдельным фреймом)
+        self.batch_window = batch_window
+        self.queue: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.writer: Optional[asyncio.Task] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self.closed = False
+        # Пока читаются пропущенные события, новые только копятся в очереди
+        self.resuming = False
+        # Время подключения и последнего входящего сообщения (time.monotonic)
+        self.connected_at = self.last_seen = time.monotonic()
+
+        # Фильтры подписки (только непустые): событие должно подходить под каждый
+        self.filters: Dict[str, Set[str]] = {"projects": {project}} if project else {}
+
+        self.sent = 0
+        self.frames = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, text: str, key: Optional[Hashable] = None) -> bool:
+        """
+        Поставить сообщение в очередь
+
+        Returns:
+            False, если клиент не справляется и должен быть отключен
+        """
+        now = time.monotonic()
+        if self.queue and now - next(iter(self.queue.values()))[1] > self.max_lag:
+            return False
+
+        if key is not None and key in self.queue:
+            del self.queue[key]
+            self.coalesced += 1
+        elif len(self.queue) >= self.max_queue:
+            victim = next((queued for queued in self.queue if isinstance(queued, tuple)), None)
+            if victim is None:
+                return False
+            del self.queue[victim]
+            self.dropped += 1
+
+        # Сообщения без ключа объединения получают уникальный ключ
+        self.queue[key if key is not None else next(_message_keys)] = (text, now)
+        self._wake()
+        return True
+
+    def prepend(self, texts: List[str], seq: Optional[int] = None):
+        """
+        Поставить сообщения в начало очереди (повтор пропущенных событий при переподключении)
+
+        Уже стоящие в очереди события с номером не больше seq входят в повтор
+        (или в снимок) и удаляются.
+        """
+        now = time.monotonic()
+        queued = self.queue
+        self.queue = OrderedDict((next(_message_keys), (text, now)) for text in texts)
+        for key, (text, queued_at) in queued.items():
+            queued_seq = event_seq(text) if seq is not None else None
+            if queued_seq is None or queued_seq > seq:
+                self.queue[key] = (text, queued_at)
+        self._wake()
+
+    @property
+    def key(self) -> Hashable:
+        """Ключ клиента в реестре сервиса: сокет или сам клиент для SSE"""
+        return self.websocket if self.websocket is not None else self
+
+    def close(self):
+        """Пометить клиента отключенным и разбудить ожидающего сообщения"""
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def pop(self) -> str:
+        """Забрать первое сообщение очереди"""
+        _, (text, _) = self.queue.popitem(last=False)
+        return text
+
+    def take_all(self) -> List[str]:
+        """Забрать все сообщения очереди"""
+        texts = [text for text, _ in self.queue.values()]
+        self.queue.clear()
+        return texts
+
+    async def wait_message(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться сообщения в очереди (False - клиент отключен или истёк таймаут)"""
+        while not self.queue:
+            if self.closed:
+                return False
+            # Объект ожидания создаётся только на время ожидания
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                # Сообщение могло прийти после таймаута, но до возврата управления
+                return bool(self.queue)
+            finally:
+                self._waiter = None
+        return True
+
+    async def next_message(self) -> Optional[str]:
+        """Дождаться следующего сообщения из очереди (None - клиент отключен)"""
+        if not await self.wait_message():
+            return None
+        return self.pop()
+
+    def index_filter(self) -> Optional[str]:
+        """Самый избирательный из заданных фильтров (None - клиент получает все события)"""
+        return next((name for name in SUBSCRIPTION_FILTERS if name in self.filters), None)
+
+    def matches(self, values: Dict[str, Any]) -> bool:
+        return all(values[name] in allowed for name, allowed in self.filters.items())
+
+    def lag_seconds(self) -> float:
+        if not self.queue:
+            return 0.0
+        return time.monotonic() - next(iter(self.queue.values()))[1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "id": self.id,
+            "project": self.project,
+            "queue_depth": len(self.queue),
+            "sent": self.sent,
+            "frames": self.frames,
+            "batch_ms": round(self.batch_window * 1000),
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_seconds": round(self.lag_seconds(), 3),
+            "age_seconds": round(now - self.connected_at, 3),
+            "idle_seconds": round(now - self.last_seen, 3),
+            "filters": {name: sorted(values) for name, values in self.filters.items()}
+        }
+
+
+class EventLog:
+    """
+    Журнал последних событий задач в памяти процесса
+
+    Каждое событие получает порядковый номер seq; клиент, переподключившийся
+    с ?since=<seq>, получает пропущенные события из журнала.
+    """
+
+    backend = "memory"
+
+    def __init__(self, size: int):
+        self.events: deque = deque(maxlen=size)
+        self.seq = 0
+
+    async def append(self, project: str, prefix: str, channel: Optional[str] = None) -> str:
+        """
+        Присвоить событию номер и сохранить его
+
+        Args:
+            prefix: JSON сообщения без закрывающей скобки, заканчивающийся на '"seq": '
+
+        Returns:
+            JSON сообщения с номером
+        """
+        self.seq += 1
+        text = f"{prefix}{self.seq}}}"
+        self.events.append((self.seq, project, text))
+        return text
+
+    async def last_seq(self) -> int:
+        return self.seq
+
+    async def since(self, seq: int, project: Optional[str] = None) -> Optional[List[str]]:
+        """
+        События с номерами больше seq (только проекта project, если он задан)
+
+        Returns:
+            None, если часть событий уже вытеснена из журнала или seq из будущего
+            (например, после перезапуска сервера) - клиенту нужен снимок
+        """
+        if seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self.events or self.events[0][0] > seq + 1:
+            return None
+        return [text for event_seq, event_project, text in self.events
+                if event_seq > seq and (project is None or event_project == project)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "last_seq": self.seq, "retained": len(self.events)}
+
+
+# Номер события, запись в журнал и публикация выполняются атомарно.
+# ID записи в stream равен номеру события, поэтому повтор читается XRANGE от since + 1.
+APPEND_EVENT_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+local text = ARGV[1] .. seq .. '}'
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], seq .. '-0', 'project', ARGV[3], 'message', text)
+if ARGV[4] ~= '' then
+    redis.call('PUBLISH', ARGV[4], text)
+end
+return seq
+"""
+
+
+class RedisEventLog:
+    """Общий для всех воркеров журнал событий в Redis stream"""
+
+    backend = "redis"
+
+    def __init__(self, size: int, prefix: Optional[str] = None):
+        self.size = size
+        prefix = prefix or settings.WEBSOCKET_CHANNEL_PREFIX
+        self.seq_key = f"{prefix}:seq"
+        self.stream_key = f"{prefix}:log"
+
+    async def append(self, project: str, prefix: str, channel: Optional[str] = None) -> str:
+        """Присвоить номер, записать в stream и (если задан channel) опубликовать за один round trip"""
+        seq = await redis_client.run_script(
+            APPEND_EVENT_SCRIPT,
+            keys=[self.seq_key, self.stream_key],
+            args=[prefix, self.size, project, channel or ""]
+        )
+        return f"{prefix}{int(seq)}}}"
+
+    async def last_seq(self) -> int:
+        return int(await redis_client.get(self.seq_key) or 0)
+
+    async def since(self, seq: int, project: Optional[str] = None) -> Optional[List[str]]:
+        last_seq = await self.last_seq()
+        if seq > last_seq:
+            return None
+        if seq == last_seq:
+            return []
+        entries = await redis_client.xrange(self.stream_key, min=f"{seq + 1}-0", count=self.size)
+        # Первая запись должна идти сразу за seq, иначе часть событий уже вытеснена
+        if not entries or entries[0][0] != f"{seq + 1}-0":
+            return None
+        return [fields["message"] for _, fields in entries
+                if project is None or fields["project"] == project]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "stream": self.stream_key}
+
+
+class RedisBroadcast:
+    """
+    Рассылка уведомлений через Redis pub/sub между воркерами
+
+    Событие проекта публикуется один раз в канал проекта, сообщения для всех
+    клиентов - в общий канал. Каждый воркер подписан на общий канал и на
+    каналы всех проектов (по шаблону) и доставляет полученные сообщения своим
+    WebSocket клиентам.
+    """
+
+    def __init__(self, service: "WebSocketService", prefix: Optional[str] = None):
+        self.service = service
+        self.prefix = prefix or settings.WEBSOCKET_CHANNEL_PREFIX
+        self.global_channel = f"{self.prefix}:all"
+        self.project_prefix = f"{self.prefix}:project:"
+        self.pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.received = 0
+        self.publish_errors = 0
+
+    def project_channel(self, project: str) -> str:
+        return f"{self.project_prefix}{project}"
+
+    @property
+    def listening(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        """Подписаться на общий канал и каналы проектов"""
+        if self._task:
+            return
+        self.pubsub = redis_client.redis.pubsub()
+        await self.pubsub.subscribe(self.global_channel)
+        await self.pubsub.psubscribe(f"{self.project_prefix}*")
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """Остановить приём сообщений"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pubsub:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def publish(self, channel: str, text: str) -> bool:
+        """Опубликовать сообщение; False, если Redis недоступен"""
+        try:
+            await redis_client.redis.publish(channel, text)
+        except Exception as e:
+            self.publish_errors += 1
+            logger.warning(f"Failed to publish WebSocket message to {channel}: {e}")
+            return False
+        self.published += 1
+        return True
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message:
+                    await self.handle_message(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket broadcast listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def handle_message(self, channel, data):
+        """Доставить сообщение из Redis локальным подключениям"""
+        if isinstance(channel, bytes):
+            channel = channel.decode("utf-8")
+        text = data.decode("utf-8") if isinstance(data, bytes) else data
+        self.received += 1
+
+        if channel == self.global_channel:
+            await self.service.deliver_to_all(text)
+        elif channel.startswith(self.project_prefix):
+            # Сообщение разбирается один раз на воркер для маршрутизации по подпискам
+            await self.service.deliver_event(text, json.loads(text))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "listening": self.listening,
+            "published": self.published,
+            "received": self.received,
+            "publish_errors": self.publish_errors
+        }
 
 
 class WebSocketService:
-    def __init__(self):
-        # Хранилище активных подключений по проектам
-        self.project_connections: Dict[str, Set[WebSocket]] = {}
-        # Хранилище всех подключений
-        self.active_connections: Set[WebSocket] = set()
-
-    async def connect(self, websocket: WebSocket, project: str = None):
-        """Принять новое WebSocket подключение"""
-        await websocket.accept()
-        self.active_connections.add(websocket)
+    def __init__(self, broadcast_backend: Optional[str] = None, send_timeout: Optional[float] = None,
+                 max_queue: Optional[int] = None, max_lag: Optional[float] = None,
+                 ping_interval: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 writer_linger: Optional[float] = None):
+        # Клиенты по сокетам, индекс подписок (фильтр -> значение -> клиенты)
+        # и клиенты без фильтров (глобальный дашборд)
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.subscriptions: Dict[str, Dict[str, Set[ClientConnection]]] = {name: {} for name in SUBSCRIPTION_FILTERS}
+        self.global_connections: Set[ClientConnection] = set()
+        # Межпроцессная рассылка (None - только подключения текущего процесса)
+        backend = broadcast_backend or settings.WEBSOCKET_BROADCAST_BACKEND
+        self.broadcast: Optional[RedisBroadcast] = RedisBroadcast(self) if backend == "redis" else None
+        # Сколько ждать отправки одному клиенту, прежде чем отключить его
+        self.send_timeout = send_timeout if send_timeout is not None else settings.WEBSOCKET_SEND_TIMEOUT
+        # Размер очереди исходящих сообщений и допустимое отставание клиента
+        self.max_queue = max_queue or settings.WEBSOCKET_QUEUE_SIZE
+        self.max_lag = max_lag if max_lag is not None else settings.WEBSOCKET_MAX_LAG_SECONDS
+        # Журнал событий для повтора при переподключении: общий в Redis при рассылке через Redis
+        replay_size = settings.WEBSOCKET_REPLAY_SIZE
+        self.event_log = RedisEventLog(replay_size) if self.broadcast else EventLog(replay_size)
+        # Ping от сервера и закрытие WebSocket без входящих сообщений дольше idle_timeout
+        self.ping_interval = ping_interval if ping_interval is not None else settings.WEBSOCKET_PING_INTERVAL
+        self.idle_timeout = idle_timeout if idle_timeout is not None else settings.WEBSOCKET_IDLE_TIMEOUT
+        # Задача-писатель живёт, пока у клиента есть сообщения, и ещё writer_linger секунд,
+        # чтобы при потоке событий не пересоздаваться на каждое сообщение
+        self.writer_linger = (
+            writer_linger if writer_linger is not None else settings.WEBSOCKET_WRITER_LINGER_SECONDS
+        )
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.evicted = 0
+        self.reaped = 0
+        self.replayed = 0
+        self.snapshots = 0
+
+    @property
+    def active_connections(self):
+        """Все подключенные сокеты"""
+        return self.clients.keys()
+
+    @property
+    def project_connections(self) -> Dict[str, Set[ClientConnection]]:
+        """Клиенты, проиндексированные по проекту"""
+        return self.subscriptions["projects"]
+
+    async def start_broadcast(self):
+        """Начать приём сообщений других воркеров"""
+        if self.broadcast:
+            await self.broadcast.start()
+
+    async def stop_broadcast(self):
+        if self.broadcast:
+            await self.broadcast.stop()
+
+    async def start_heartbeat(self):
+        """Запустить фоновую рассылку ping и закрытие не отвечающих соединений"""
+        if self._heartbeat or self.ping_interval <= 0:
+            return
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
 
-        if project:
-            if project not in self.project_connections:
-                self.project_connections[project] = set()
-            self.project_connections[project].add(websocket)
+    async def stop_heartbeat(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+
+    async def close(self):
+        """Отключить всех клиентов и дождаться завершения задач-писателей"""
+        writers = [client.writer for client in self.clients.values() if client.writer]
+        for key in list(self.clients):
+            self.disconnect(key)
+        await asyncio.gather(*writers, return_exceptions=True)
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"WebSocket heartbeat failed: {e}")
+
+    def heartbeat(self) -> int:
+        """
+        Закрыть WebSocket, от которых ничего не приходило дольше idle_timeout,
+        остальным отправить ping
 
-        # Отправляем приветственное сообщение
-        await self.send_personal_message({
+        SSE клиенты не проверяются: у них нет входящего канала, а разрыв
+        обнаруживается при отправке keepalive.
+
+        Returns:
+            Число закрытых соединений
+        """
+        now = time.monotonic()
+        ping = json.dumps({"type": "ping", "timestamp": datetime.utcnow().isoformat()})
+        reaped = 0
+        for client in list(self.clients.values()):
+            if client.websocket is None:
+                continue
+            if now - client.last_seen > self.idle_timeout:
+                reaped += 1
+                self.disconnect(client.key)
+                asyncio.create_task(self._close_quietly(client.websocket, WS_CLOSE_IDLE))
+            else:
+                self._enqueue(client, ping)
+        self.reaped += reaped
+        return reaped
+
+    def touch(self, websocket: WebSocket):
+        """Отметить входящее сообщение клиента"""
+        client = self.clients.get(websocket)
+        if client:
+            client.last_seen = time.monotonic()
+
+    async def connect(self, websocket: WebSocket, project: str = None, since: Optional[int] = None,
+                      snapshot: Optional[Callable[[Optional[str]], Awaitable[List[Dict[str, Any]]]]] = None,
+                      batch_ms: int = 0):
+        """
+        Принять новое WebSocket подключение
+
+        Args:
+            since: Номер последнего полученного клиентом события (переподключение)
+            snapshot: Загрузка активных задач проекта, если пропущенные события недоступны
+            batch_ms: Окно пакетной отправки (0 - без пакетов), не больше WEBSOCKET_MAX_BATCH_MS
+        """
+        batch_ms = max(0, min(batch_ms, settings.WEBSOCKET_MAX_BATCH_MS))
+        await websocket.accept()
+
+        # Приветственное сообщение отправляется до запуска писателя
+        await websocket.send_text(json.dumps({
             "type": "connection",
             "message": "Connected to Agent Task Tracker",
             "project": project,
+            "seq": await self._last_seq(),
+            "batch_ms": batch_ms,
             "timestamp": datetime.utcnow().isoformat()
-        }, websocket)
+        }))
+
+        client = ClientConnection(websocket, project, self.max_queue, self.max_lag, batch_ms / 1000)
+        client.resuming = since is not None
+        self.clients[websocket] = client
+        self._index(client)
+
+        # Клиент уже получает новые события; пропущенные ставятся перед ними,
+        # а писатель запускается только после этого
+        if since is not None:
+            try:
+                await self._resume(client, since, snapshot)
+            finally:
+                client.resuming = False
+            self._start_writer(client)
+
+    async def _last_seq(self) -> Optional[int]:
+        try:
+            return await self.event_log.last_seq()
+        except Exception as e:
+            logger.warning(f"Failed to read WebSocket event sequence: {e}")
+            return None
+
+    async def _resume(self, client: ClientConnection, since: int, snapshot=None):
+        """Повторить пропущенные клиентом события или отправить снимок активных задач"""
+        try:
+            missed = await self.event_log.since(since, client.project)
+        except Exception as e:
+            logger.warning(f"Failed to read WebSocket event log: {e}")
+            missed = None
+
+        if missed is not None:
+            self.replayed += len(missed)
+            client.prepend(missed, event_seq(missed[-1]) if missed else since)
+            return
+
+        # Номер читается до снимка: события после него придут отдельно
+        seq = await self._last_seq()
+        tasks = await snapshot(client.project) if snapshot else []
+        self.snapshots += 1
+        client.prepend([json.dumps({
+            "type": "snapshot",
+            "data": {"project": client.project, "tasks": tasks},
+            "timestamp": datetime.utcnow().isoformat(),
+            "seq": seq
+        })], seq)
+
+    async def open_stream(self, project: Optional[str] = None, since: Optional[int] = None,
+                          snapshot: Optional[Callable[[Optional[str]], Awaitable[List[Dict[str, Any]]]]] = None
+                          ) -> ClientConnection:
+        """
+        Зарегистрировать SSE клиента
+
+        Задача-писатель не создаётся: сообщения из очереди забирает обработчик
+        потокового ответа, который должен вызвать disconnect(client) при завершении.
+        """
+        client = ClientConnection(None, project, self.max_queue, self.max_lag)
+        self.clients[client] = client
+        self._index(client)
+        if since is not None:
+            await self._resume(client, since, snapshot)
+        return client
+
+    def disconnect(self, websocket, project: str = None):
+        """Отключить WebSocket (или SSE клиента)"""
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+
+        self._unindex(client)
+        client.close()
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def _index(self, client: ClientConnection):
+        name = client.index_filter()
+        if name is None:
+            self.global_connections.add(client)
+            return
+        index = self.subscriptions[name]
+        for value in client.filters[name]:
+            index.setdefault(value, set()).add(client)
+
+    def _unindex(self, client: ClientConnection):
+        name = client.index_filter()
+        if name is None:
+            self.global_connections.discard(client)
+            return
+        index = self.subscriptions[name]
+        for value in client.filters[name]:
+            subscribers = index.get(value)
+            if subscribers is not None:
+                subscribers.discard(client)
+                # Удаляем пустые значения
+                if not subscribers:
+                    del index[value]
+
+    def update_subscription(self, websocket: WebSocket, action: str, filters: Dict[str, Any]) -> Dict[str, List[str]]:
+        """
+        Добавить (subscribe) или убрать (unsubscribe) значения фильтров клиента
 
-    def disconnect(self, websocket: WebSocket, project: str = None):
-        """Отключить WebSocket"""
-        self.active_connections.discard(websocket)
+        Unsubscribe без фильтров снимает все фильтры - клиент снова получает все события.
 
-        if project and project in self.project_connections:
-            self.project_connections[project].discard(websocket)
-            # Удаляем пустые проекты
-            if not self.project_connections[project]:
-                del self.project_connections[project]
+        Returns:
+            Текущие фильтры клиента
+
+        Raises:
+            ValueError: Неизвестное действие или фильтр, значение не строка, клиент отключен
+        """
+        if action not in ("subscribe", "unsubscribe"):
+            raise ValueError(f"Unknown action: {action}")
+        unknown = set(filters) - set(SUBSCRIPTION_FILTERS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+        changes = {}
+        for name, values in filters.items():
+            values = [values] if isinstance(values, str) else values
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError(f"Filter {name} must be a string or a list of strings")
+            changes[name] = values
+
+        client = self.clients.get(websocket)
+        if client is None:
+            raise ValueError("Connection is closed")
+        self._unindex(client)
+        if action == "subscribe":
+            for name, values in changes.items():
+                if values:
+                    client.filters.setdefault(name, set()).update(values)
+        elif changes:
+            for name, values in changes.items():
+                remaining = client.filters.get(name, set()).difference(values)
+                if remaining:
+                    client.filters[name] = remaining
+                else:
+                    client.filters.pop(name, None)
+        else:
+            client.filters = {}
+        self._index(client)
+        return {name: sorted(client.filters.get(name, ())) for name in SUBSCRIPTION_FILTERS}
+
+    def _route(self, values: Dict[str, Any]) -> Set[ClientConnection]:
+        """Клиенты, подписки которых подходят под событие"""
+        recipients = set(self.global_connections)
+        for name in SUBSCRIPTION_FILTERS:
+            candidates = self.subscriptions[name].get(values[name])
+            if candidates:
+                recipients.update(client for client in candidates if client.matches(values))
+        return recipients
 
     async def send_personal_message(self, message: Dict[str, Any], websocket: WebSocket):
         """Отправить сообщение конкретному клиенту"""
+        client = self.clients.get(websocket)
+        if client:
+            self._enqueue(client, json.dumps(message))
+            return
         try:
             await websocket.send_text(json.dumps(message))
         except Exception as e:
             # Если соединение сломалось, удаляем его
-            self.active_connections.discard(websocket)
+            self.disconnect(websocket)
 
-    async def broadcast_to_project(self, message: Dict[str, Any], project: str):
-        """Отправить сообщение всем клиентам конкретного проекта"""
-        if project in self.project_connections:
-            disconnected_clients = []
-            for connection in self.project_connections[project]:
+    def _start_writer(self, client: ClientConnection):
+        """Запустить задачу-писатель WebSocket клиента, если в очереди есть сообщения"""
+        if (client.websocket is not None and client.writer is None and client.queue
+                and not client.closed and not client.resuming):
+            client.writer = asyncio.create_task(self._write(client))
+
+    async def _write(self, client: ClientConnection):
+        """
+        Задача-писатель: отправляет сообщения из очереди клиента и завершается,
+        если новых сообщений нет дольше writer_linger секунд
+
+        В пакетном режиме все сообщения за окно отправляются одним фреймом - JSON массивом.
+        """
+        task = asyncio.current_task()
+        try:
+            while not client.closed and await client.wait_message(self.writer_linger):
+                if client.batch_window:
+                    # Обновления прогресса одной задачи за окно объединяются очередью
+                    await asyncio.sleep(client.batch_window)
+                    texts = client.take_all()
+                    if not texts:
+                        break
+                    # Сообщения уже сериализованы, массив собирается без повторного json.dumps
+                    text = f"[{','.join(texts)}]"
+                else:
+                    texts = None
+                    text = client.pop()
                 try:
-                    await connection.send_text(json.dumps(message))
+                    await asyncio.wait_for(client.websocket.send_text(text), timeout=self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict(client)
+                    return
                 except Exception:
-                    disconnected_clients.append(connection)
+                    self.disconnect(client.key)
+                    return
+                client.sent += len(texts) if texts else 1
+                client.frames += 1
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Между проверкой очереди и этой строкой нет await, поэтому новые
+            # сообщения не потеряются: следующий put запустит нового писателя
+            if client.writer is task:
+                client.writer = None
+
+    def _evict(self, client: ClientConnection):
+        """Отключить клиента, не успевающего принимать сообщения"""
+        self.evicted += 1
+        self.disconnect(client.key)
+        if client.websocket is not None:
+            asyncio.create_task(self._close_quietly(client.websocket, WS_CLOSE_SLOW_CONSUMER))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _enqueue(self, client: ClientConnection, text: str, key: Optional[Hashable] = None):
+        if client.put(text, key):
+            self._start_writer(client)
+        else:
+            self._evict(client)
+
+    def _send_many(self, clients: Iterable[ClientConnection], text: str, key: Optional[Hashable] = None):
+        """Поставить сообщение в очереди клиентов (без ожидания отправки)"""
+        for client in list(clients):
+            self._enqueue(client, text, key)
+
+    async def broadcast_to_project(self, message: Dict[str, Any], project: str):
+        """
+        Отправить событие проекта (на всех воркерах)
 
-            # Удаляем отключенных клиентов
-            for client in disconnected_clients:
-                self.disconnect(client, project)
+        Получают клиенты, подписки которых подходят под событие, и клиенты без фильтров;
+        каждый клиент получает сообщение один раз.
+        """
+        text = json.dumps(message)
+        if self.broadcast and await self.broadcast.publish(self.broadcast.project_channel(project), text):
+            return
+        await self.deliver_event(text, message)
 
     async def broadcast_to_all(self, message: Dict[str, Any]):
-        """Отправить сообщение всем подключенным клиентам"""
-        disconnected_clients = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception:
-                disconnected_clients.append(connection)
+        """Отправить сообщение всем подключенным клиентам (на всех воркерах)"""
+        text = json.dumps(message)
+        if self.broadcast and await self.broadcast.publish(self.broadcast.global_channel, text):
+            return
+        await self.deliver_to_all(text)
 
-        # Удаляем отключенных клиентов
-        for client in disconnected_clients:
-            self.disconnect(client)
+    async def deliver_event(self, text: str, message: Dict[str, Any]):
+        """Отправить готовое событие задачи подписанным клиентам текущего процесса"""
+        self._send_many(self._route(event_values(message)), text, coalesce_key(message))
 
-    async def notify_task_started(self, task_data: Dict[str, Any]):
-        """Отправить уведомление о начале задачи"""
+    async def deliver_to_all(self, text: str):
+        """Отправить готовое сообщение всем клиентам текущего процесса"""
+        self._send_many(self.clients.values(), text)
+
+    async def _notify(self, message_type: str, task_data: Dict[str, Any]):
+        """Отправить событие задачи с порядковым номером seq"""
         message = {
-            "type": "task_started",
+            "type": message_type,
             "data": task_data,
             "timestamp": datetime.utcnow().isoformat()
         }
+        project = task_data["project"]
+        # Номер подставляется в готовый JSON, сообщение сериализуется один раз
+        prefix = json.dumps(message)[:-1] + ', "seq": '
+        channel = self.broadcast.project_channel(project) if self.broadcast else None
 
-        # Отправляем всем клиентам проекта
-        await self.broadcast_to_project(message, task_data["project"])
+        try:
+            text = await self.event_log.append(project, prefix, channel)
+        except Exception as e:
+            logger.warning(f"Failed to append WebSocket event to log: {e}")
+            # Без журнала событие рассылается как раньше, без номера
+            await self.broadcast_to_project(message, project)
+            return
 
-        # Также отправляем всем (для глобального дашборда)
-        await self.broadcast_to_all(message)
+        if self.broadcast:
+            # Скрипт журнала уже опубликовал событие для всех воркеров
+            self.broadcast.published += 1
+            return
+        await self.deliver_event(text, message)
+
+    async def notify_task_started(self, task_data: Dict[str, Any]):
+        """Отправить уведомление о начале задачи"""
+        await self._notify("task_started", task_data)
 
     async def notify_task_finished(self, task_data: Dict[str, Any]):
         """Отправить уведомление о завершении задачи"""
-        message = {
-            "type": "task_finished",
-            "data": task_data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-
-        await self.broadcast_to_project(message, task_data["project"])
-        await self.broadcast_to_all(message)
+        await self._notify("task_finished", task_data)
 
     async def notify_task_status_updated(self, task_data: Dict[str, Any]):
         """Отправить уведомление об обновлении статуса задачи"""
-        message = {
-            "type": "task_status_updated",
-            "data": task_data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-
-        await self.broadcast_to_project(message, task_data["project"])
-        await self.broadcast_to_all(message)
+        await self._notify("task_status_updated", task_data)
 
     async def notify_task_error(self, task_data: Dict[str, Any]):
         """Отправить уведомление об ошибке задачи"""
-        message = {
-            "type": "task_error",
-            "data": task_data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        await self._notify("task_error", task_data)
 
-        await self.broadcast_to_project(message, task_data["project"])
-        await self.broadcast_to_all(message)
+    def get_connection_stats(self, connections: bool = False, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+        """
+        Получить статистику подключений
 
-    def get_connection_stats(self) -> Dict[str, Any]:
-        """Получить статистику подключений"""
-        return {
-            "total_connections": len(self.active_connections),
+        По умолчанию только агрегаты: при большом числе подключений список по
+        каждому из них велик и дорог. Страница этого списка (в порядке
+        подключения) возвращается в поле connections с connections=True.
+        """
+        now = time.monotonic()
+        clients = self.clients.values()
+        stats = {
+            "total_connections": len(self.clients),
+            "global_connections": len(self.global_connections),
+            "sse_connections": sum(client.websocket is None for client in self.clients.values()),
             "project_connections": {
                 project: len(connections)
                 for project, connections in self.project_connections.items()
-            }
+            },
+            "subscriptions": {name: len(index) for name, index in self.subscriptions.items()},
+            "evicted_slow_clients": self.evicted,
+            "reaped_idle_clients": self.reaped,
+            "oldest_connection_seconds": round(max((now - client.connected_at for client in clients), default=0.0), 3),
+            "heartbeat": {
+                "running": self._heartbeat is not None,
+                "ping_interval": self.ping_interval,
+                "idle_timeout": self.idle_timeout
+            },
+            "queued_messages": sum(len(client.queue) for client in clients),
+            "max_queue_depth": max((len(client.queue) for client in clients), default=0),
+            "max_lag_seconds": round(max((client.lag_seconds() for client in clients if client.queue), default=0.0), 3),
+            "dropped_messages": sum(client.dropped for client in clients),
+            "coalesced_messages": sum(client.coalesced for client in clients),
+            "replayed_events": self.replayed,
+            "snapshots_sent": self.snapshots,
+            "event_log": self.event_log.get_stats()
         }
+        if self.broadcast:
+            stats["broadcast"] = self.broadcast.get_stats()
+        if connections:
+            stats["connections"] = [client.get_stats() for client in islice(clients, offset, offset + limit)]
+        return stats
 
 
 # Глобальный экземпляр сервиса
-websocket_service = WebSocketService()
\ No newline at end of file
+websocket_service = WebSocketService()
@@ -0,0 +1,118 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from main import app
+from core.config import settings
+from models.schemas import WebhookStart
+from services.idempotency_service import idempotency_service, MAX_DEDUP_TTL
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+start_payload = {"project": "p", "task": "t", "task_id": "idem_1", "agent": "a"}
+
+
+@pytest.fixture
+def redis_store():
+    """Redis-клиент поверх словаря: SET NX, GET, DELETE"""
+    store = {}
+
+    async def fake_set(key, value, expire=None, nx=False):
+        if nx and key in store:
+            return False
+        store[key] = value
+        return True
+
+    with patch("services.idempotency_service.redis_client") as mock_redis:
+        mock_redis.redis = MagicMock()
+        mock_redis.set = AsyncMock(side_effect=fake_set)
+        mock_redis.get = AsyncMock(side_effect=lambda key: store.get(key))
+        mock_redis.delete = AsyncMock(side_effect=lambda key: store.pop(key, None))
+        yield store
+
+
+@pytest.fixture
+def webhook_service():
+    with patch("webhook.routes.AsyncWebhookService") as service_class:
+        service = service_class.return_value
+        service.handle_start_webhook = AsyncMock(return_value=MagicMock(id=7, status="running"))
+        yield service
+
+
+def test_retry_with_same_key_is_replayed(redis_store, webhook_service):
+    """Повтор с тем же Idempotency-Key получает сохранённый ответ без обработки"""
+    hits_before = idempotency_service.hits
+    request_headers = {**headers, "Idempotency-Key": "retry-1"}
+
+    first = client.post("/webhook/start", json=start_payload, headers=request_headers)
+    second = client.post("/webhook/start", json=start_payload, headers=request_headers)
+
+    assert first.status_code == second.status_code == 202
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert webhook_service.handle_start_webhook.await_count == 1
+    assert idempotency_service.hits == hits_before + 1
+
+
+def test_duplicate_payload_without_key_is_processed(redis_store, webhook_service):
+    """Без заголовка одинаковые вебхуки по умолчанию обрабатываются каждый раз"""
+    client.post("/webhook/start", json=start_payload, headers=headers)
+    client.post("/webhook/start", json=start_payload, headers=headers)
+
+    assert webhook_service.handle_start_webhook.await_count == 2
+    assert redis_store == {}
+
+
+def test_duplicate_payload_without_key_is_suppressed(redis_store, webhook_service, monkeypatch):
+    """С WEBHOOK_DEDUP_TTL ключ вычисляется по типу события, task_id и содержимому"""
+    monkeypatch.setattr(settings, "WEBHOOK_DEDUP_TTL", 5)
+    client.post("/webhook/start", json=start_payload, headers=headers)
+    client.post("/webhook/start", json=start_payload, headers=headers)
+    client.post("/webhook/start", json={**start_payload, "task": "other"}, headers=headers)
+
+    assert webhook_service.handle_start_webhook.await_count == 2
+
+
+def test_dedup_window_is_capped(monkeypatch):
+    """Окно дедупликации без заголовка ограничено секундами - только повторы транспорта"""
+    monkeypatch.setattr(settings, "WEBHOOK_DEDUP_TTL", 300)
+
+    key = idempotency_service.make_key("start", WebhookStart(**start_payload))
+
+    assert idempotency_service._ttl(key) == MAX_DEDUP_TTL
+
+
+def test_request_in_progress_returns_conflict(redis_store, webhook_service):
+    key = idempotency_service.make_key("start", None, "busy")
+    redis_store[key] = "pending"
+
+    response = client.post("/webhook/start", json=start_payload, headers={**headers, "Idempotency-Key": "busy"})
+
+    assert response.status_code == 409
+    webhook_service.handle_start_webhook.assert_not_awaited()
+
+
+def test_failed_request_releases_key(redis_store, webhook_service):
+    """После ошибки обработки повтор обрабатывается заново"""
+    webhook_service.handle_start_webhook.side_effect = [RuntimeError("db down"), MagicMock(id=8, status="running")]
+    request_headers = {**headers, "Idempotency-Key": "retry-2"}
+
+    assert client.post("/webhook/start", json=start_payload, headers=request_headers).status_code == 500
+    response = client.post("/webhook/start", json=start_payload, headers=request_headers)
+
+    assert response.status_code == 202
+    assert response.json()["database_id"] == 8
+
+
+def test_redis_unavailable_processes_webhook(webhook_service):
+    """Без подключения к Redis вебхуки обрабатываются как обычно"""
+    with patch("services.idempotency_service.redis_client") as mock_redis:
+        mock_redis.redis = None
+        client.post("/webhook/start", json=start_payload, headers=headers)
+        client.post("/webhook/start", json=start_payload, headers=headers)
+
+    assert webhook_service.handle_start_webhook.await_count == 2
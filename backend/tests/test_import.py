@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from unittest.mock import patch
+
+from main import app
+from core.config import settings
+from core.database import get_async_database_url
+from models.models import Base, Task
+from services.id_cache import clear_id_caches
+from services.import_service import WebhookImportService, iter_lines
+
+# Отдельная тестовая база данных для импорта
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_import.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+@pytest.fixture(scope="function")
+def import_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    yield TestingSessionLocal
+    clear_id_caches()
+    Base.metadata.drop_all(bind=engine)
+
+
+def ndjson(*events) -> bytes:
+    return "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+
+
+def event(kind, task_id, **data):
+    return {"event": kind, "project": "imp", "task": f"Task {task_id}", "task_id": task_id, "agent": "imp-agent", **data}
+
+
+async def chunked(data: bytes, size: int):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_handles_split_gzip_stream():
+    body = gzip.compress(b'{"a": 1}\n{"b": 2}\n{"c": 3}')
+
+    lines = [line async for line in iter_lines(chunked(body, 7))]
+
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+@pytest.mark.asyncio
+async def test_import_applies_events_in_chunks(import_db):
+    service = WebhookImportService(session_factory=TestingAsyncSessionLocal, chunk_size=2)
+    body = ndjson(
+        event("start", "imp_1"),
+        event("status", "imp_1", status="running", progress=30),
+        event("start", "imp_2"),
+        event("finish", "imp_1", result="ok", duration_seconds=2),
+        event("error", "imp_2", error_type="E", error_message="boom"),
+        event("finish", "imp_missing"),
+    ) + b"not json\n"
+
+    reports = [report async for report in service.run(chunked(body, 64))]
+
+    assert [report["status"] for report in reports] == ["in_progress"] * 3 + ["completed"]
+    summary = reports[-1]
+    assert summary["events"] == 6
+    assert summary["invalid"] == 1
+    assert summary["not_found"] == 1
+    assert summary["errors"][0]["line"] == 7
+
+    db = import_db()
+    tasks = {task.task_id: task for task in db.query(Task).all()}
+    assert set(tasks) == {"imp_1", "imp_2"}
+    assert tasks["imp_1"].status == "completed"
+    assert tasks["imp_1"].progress == 30
+    assert tasks["imp_1"].result == "ok"
+    assert tasks["imp_2"].status == "failed"
+    assert tasks["imp_2"].error_message == "E: boom"
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_import_restart_overwrites_task(import_db):
+    service = WebhookImportService(session_factory=TestingAsyncSessionLocal)
+    first = ndjson(event("start", "imp_3"), event("error", "imp_3", error_type="E", error_message="boom"))
+    second = ndjson(event("start", "imp_3"))
+
+    [report async for report in service.run(chunked(first, 1024))]
+    reports = [report async for report in service.run(chunked(second, 1024))]
+
+    assert reports[-1]["upserted"] == 1
+    db = import_db()
+    task = db.query(Task).filter(Task.task_id == "imp_3").one()
+    assert task.status == "running"
+    assert task.error_message is None
+    assert db.query(Task).count() == 1
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_import_uses_event_timestamps(import_db):
+    service = WebhookImportService(session_factory=TestingAsyncSessionLocal)
+    body = ndjson(
+        event("start", "imp_4", occurred_at="2024-03-01T10:00:00Z"),
+        event("finish", "imp_4", occurred_at="2024-03-01T10:01:30Z"),
+        event("start", "imp_5", occurred_at="2024-03-01T12:00:00+02:00"),
+        event("error", "imp_5", error_type="E", error_message="boom", occurred_at="2024-03-01T10:00:05Z"),
+    )
+
+    [report async for report in service.run(chunked(body, 1024))]
+
+    db = import_db()
+    tasks = {task.task_id: task for task in db.query(Task).all()}
+    completed, failed = tasks["imp_4"], tasks["imp_5"]
+    assert completed.created_at.replace(tzinfo=None) == datetime(2024, 3, 1, 10, 0, 0)
+    assert (completed.finished_at - completed.started_at).total_seconds() == 90
+    # Время с часовым поясом приводится к UTC
+    assert failed.started_at.replace(tzinfo=None) == datetime(2024, 3, 1, 10, 0, 0)
+    assert (failed.finished_at - failed.started_at).total_seconds() == 5
+    db.close()
+
+
+def test_import_endpoint_streams_progress(import_db):
+    service = WebhookImportService(session_factory=TestingAsyncSessionLocal, chunk_size=1)
+    body = gzip.compress(ndjson(event("start", "imp_4"), event("finish", "imp_4", result="ok")))
+
+    with patch("webhook.routes.import_service", service):
+        response = client.post(
+            "/webhook/import",
+            content=body,
+            headers={**headers, "Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+
+    assert response.status_code == 200
+    reports = [json.loads(line) for line in response.text.splitlines()]
+    assert len(reports) == 3
+    assert reports[-1]["status"] == "completed"
+    assert reports[-1]["events"] == 2
+
+
+def test_import_endpoint_rejects_other_content_types():
+    response = client.post("/webhook/import", json={"events": []}, headers=headers)
+
+    assert response.status_code == 415
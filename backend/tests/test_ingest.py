@@ -0,0 +1,300 @@
+import os
+import tempfile
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from unittest.mock import AsyncMock, patch
+
+from main import app
+from core.config import settings
+from core.database import get_async_database_url
+from services.id_cache import clear_id_caches
+from models.models import Base, Task
+from services.ingest_service import WebhookStreamConsumer
+from services.webhook_service import AsyncWebhookService
+
+# Отдельная тестовая база данных для воркера
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_ingest.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+@pytest.fixture(scope="function")
+def ingest_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    yield TestingSessionLocal
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def stream_mode(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_INGEST_MODE", "stream")
+
+
+def stream_entry(entry_id, event, **data):
+    return entry_id, {"event": event, "data": json.dumps(data)}
+
+
+class TestStreamIngestRoutes:
+    """Тесты постановки вебхуков в Redis stream"""
+
+    def test_start_is_enqueued(self, stream_mode):
+        """В режиме stream вебхук ставится в очередь без обращения к БД"""
+        with patch("services.ingest_service.redis_client") as mock_redis, \
+                patch("webhook.routes.AsyncWebhookService") as mock_service:
+            mock_redis.xadd = AsyncMock(return_value="1700000000000-0")
+
+            response = client.post("/webhook/start", json={
+                "project": "p", "task": "t", "task_id": "stream_1", "agent": "a"
+            }, headers=headers)
+
+            assert response.status_code == 202
+            data = response.json()
+            assert data["status"] == "queued"
+            assert data["stream_id"] == "1700000000000-0"
+            mock_service.assert_not_called()
+
+            stream, fields = mock_redis.xadd.call_args.args
+            assert stream == settings.WEBHOOK_STREAM_KEY
+            assert fields["event"] == "start"
+            assert json.loads(fields["data"])["task_id"] == "stream_1"
+
+    def test_batch_is_enqueued(self, stream_mode):
+        """Пакетный вебхук ставится в очередь одним pipeline"""
+        with patch("services.ingest_service.redis_client") as mock_redis:
+            mock_redis.xadd_many = AsyncMock(return_value=["1-0", "1-1"])
+
+            response = client.post("/webhook/batch", json={"events": [
+                {"event": "start", "project": "p", "task": "t", "task_id": "s1", "agent": "a"},
+                {"event": "finish", "project": "p", "task": "t", "task_id": "s1", "agent": "a", "result": "ok"},
+            ]}, headers=headers)
+
+            assert response.status_code == 202
+            data = response.json()
+            assert data["status"] == "queued"
+            assert [item["status"] for item in data["results"]] == ["queued", "queued"]
+            assert len(mock_redis.xadd_many.call_args.args[1]) == 2
+
+    def test_enqueue_failure(self, stream_mode):
+        """Недоступность Redis возвращает 503"""
+        with patch("services.ingest_service.redis_client") as mock_redis:
+            mock_redis.xadd = AsyncMock(side_effect=ConnectionError("redis down"))
+
+            response = client.post("/webhook/finish", json={
+                "project": "p", "task": "t", "task_id": "s2", "agent": "a"
+            }, headers=headers)
+
+            assert response.status_code == 503
+
+
+class TestWebhookStreamConsumer:
+    """Тесты потребителя Redis stream"""
+
+    @pytest.mark.asyncio
+    async def test_process_once_applies_and_acks(self, ingest_db):
+        """Пачка применяется одним commit и подтверждается XACK"""
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        entries = [
+            stream_entry("1-0", "start", project="p", task="t", task_id="c1", agent="a"),
+            stream_entry("1-1", "finish", project="p", task="t", task_id="c1", agent="a", result="ok"),
+            ("1-2", {"event": "start", "data": "not json"}),
+        ]
+
+        with patch("services.ingest_service.redis_client") as mock_redis:
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=[])
+            mock_redis.xreadgroup = AsyncMock(return_value=entries)
+            mock_redis.xack = AsyncMock(return_value=3)
+            mock_redis.xadd_many = AsyncMock(return_value=["9-0"])
+
+            processed = await consumer.process_once()
+
+            assert processed == 3
+            ack_ids = mock_redis.xack.call_args.args[2:]
+            assert set(ack_ids) == {"1-0", "1-1", "1-2"}
+
+            dead_stream, dead_entries = mock_redis.xadd_many.call_args.args
+            assert dead_stream == settings.WEBHOOK_STREAM_DEAD_LETTER_KEY
+            assert dead_entries[0]["source_id"] == "1-2"
+
+        db = ingest_db()
+        task = db.query(Task).filter(Task.task_id == "c1").first()
+        assert task.status == "completed"
+        assert task.result == "ok"
+        db.close()
+
+        stats = consumer.get_stats()
+        assert stats["processed"] == 2
+        assert stats["failed"] == 1
+        assert stats["batches"] == 1
+
+    @pytest.mark.asyncio
+    async def test_process_once_prefers_reclaimed_entries(self, ingest_db):
+        """Зависшие у других потребителей записи обрабатываются первыми"""
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        entries = [stream_entry("2-0", "start", project="p", task="t", task_id="c2", agent="a")]
+
+        with patch("services.ingest_service.redis_client") as mock_redis:
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=entries)
+            mock_redis.xreadgroup = AsyncMock(return_value=[])
+            mock_redis.xack = AsyncMock(return_value=1)
+
+            assert await consumer.process_once() == 1
+            mock_redis.xreadgroup.assert_not_called()
+            assert mock_redis.xack.call_args.args[2:] == ("2-0",)
+
+    @pytest.mark.asyncio
+    async def test_transient_error_leaves_entries_pending(self, ingest_db):
+        """При временной ошибке БД записи не подтверждаются и не попадают в dead-letter"""
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        entries = [
+            stream_entry("3-0", "start", project="p", task="t", task_id="c3", agent="a"),
+            stream_entry("3-1", "finish", project="p", task="t", task_id="c3", agent="a"),
+            ("3-2", {"event": "start", "data": "not json"}),
+        ]
+        outage = OperationalError("UPDATE tasks", {}, Exception("database is locked"))
+
+        with patch("services.ingest_service.redis_client") as mock_redis, \
+                patch("services.ingest_service.AsyncWebhookService") as mock_service:
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=[])
+            mock_redis.xreadgroup = AsyncMock(return_value=entries)
+            mock_redis.xack = AsyncMock(return_value=1)
+            mock_redis.xadd_many = AsyncMock(return_value=["9-0"])
+            mock_redis.xdelivery_counts = AsyncMock(return_value={"3-0": 1, "3-1": 1})
+            mock_service.return_value.handle_batch = AsyncMock(side_effect=outage)
+
+            assert await consumer.process_once() == 3
+
+            # Подтверждена и отправлена в dead-letter только невалидная запись
+            assert mock_redis.xack.call_args.args[2:] == ("3-2",)
+            [dead] = mock_redis.xadd_many.call_args.args[1]
+            assert dead["source_id"] == "3-2"
+
+        stats = consumer.get_stats()
+        assert (stats["processed"], stats["failed"], stats["deferred"]) == (0, 1, 2)
+
+    @pytest.mark.asyncio
+    async def test_deferred_entries_are_applied_before_new_ones(self, ingest_db):
+        """Отложенный start применяется раньше пришедшего после него finish"""
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        new_entries = [
+            stream_entry("6-0", "start", project="p", task="t", task_id="c8", agent="a"),
+            stream_entry("6-1", "finish", project="p", task="t", task_id="c8", agent="a", result="ok"),
+        ]
+        pending = {}
+
+        async def xreadgroup(group, consumer_name, stream, count=None, block=None, last_id=">"):
+            if last_id == "0":
+                return list(pending.items())
+            if not new_entries:
+                return []
+            entry_id, fields = new_entries.pop(0)
+            pending[entry_id] = fields
+            return [(entry_id, fields)]
+
+        async def xack(stream, group, *ids):
+            for entry_id in ids:
+                pending.pop(entry_id, None)
+            return len(ids)
+
+        real_service = AsyncWebhookService
+        outage = OperationalError("INSERT INTO tasks", {}, Exception("database is locked"))
+
+        def service(db):
+            webhook_service = real_service(db)
+            if not consumer.deferred:
+                webhook_service.handle_batch = AsyncMock(side_effect=outage)
+            return webhook_service
+
+        with patch("services.ingest_service.redis_client") as mock_redis, \
+                patch("services.ingest_service.AsyncWebhookService", side_effect=service):
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=[])
+            mock_redis.xreadgroup = AsyncMock(side_effect=xreadgroup)
+            mock_redis.xack = AsyncMock(side_effect=xack)
+            mock_redis.xdelivery_counts = AsyncMock(return_value={"6-0": 1})
+
+            for _ in range(3):
+                await consumer.process_once()
+
+        assert pending == {}
+        db = ingest_db()
+        task = db.query(Task).filter(Task.task_id == "c8").first()
+        assert task.status == "completed"
+        assert task.result == "ok"
+        db.close()
+
+        stats = consumer.get_stats()
+        assert (stats["processed"], stats["failed"], stats["deferred"]) == (2, 0, 1)
+
+    @pytest.mark.asyncio
+    async def test_dead_letter_after_max_deliveries(self, ingest_db, monkeypatch):
+        """Запись с временной ошибкой уходит в dead-letter после WEBHOOK_CONSUMER_MAX_DELIVERIES доставок"""
+        monkeypatch.setattr(settings, "WEBHOOK_CONSUMER_MAX_DELIVERIES", 3)
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        entries = [
+            stream_entry("4-0", "start", project="p", task="t", task_id="c4", agent="a"),
+            stream_entry("4-1", "start", project="p", task="t", task_id="c5", agent="a"),
+        ]
+        outage = OperationalError("UPDATE tasks", {}, Exception("server closed the connection"))
+
+        with patch("services.ingest_service.redis_client") as mock_redis, \
+                patch("services.ingest_service.AsyncWebhookService") as mock_service:
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=entries)
+            mock_redis.xack = AsyncMock(return_value=1)
+            mock_redis.xadd_many = AsyncMock(return_value=["9-0"])
+            mock_redis.xdelivery_counts = AsyncMock(return_value={"4-0": 3, "4-1": 2})
+            mock_service.return_value.handle_batch = AsyncMock(side_effect=outage)
+
+            await consumer.process_once()
+
+            assert mock_redis.xack.call_args.args[2:] == ("4-0",)
+            [dead] = mock_redis.xadd_many.call_args.args[1]
+            assert dead["source_id"] == "4-0"
+            assert "after 3 deliveries" in dead["error"]
+
+    @pytest.mark.asyncio
+    async def test_permanent_error_is_dead_lettered(self, ingest_db):
+        """Событие с постоянной ошибкой уходит в dead-letter, остальные применяются"""
+        consumer = WebhookStreamConsumer(session_factory=TestingAsyncSessionLocal, consumer_name="test")
+        entries = [
+            stream_entry("5-0", "start", project="p", task="t", task_id="c6", agent="a"),
+            stream_entry("5-1", "start", project="p", task="t", task_id="c7", agent="a"),
+        ]
+
+        async def handle_batch(events):
+            if any(event.task_id == "c7" for event in events):
+                raise ValueError("bad event")
+
+        with patch("services.ingest_service.redis_client") as mock_redis, \
+                patch("services.ingest_service.AsyncWebhookService") as mock_service:
+            mock_redis.xgroup_create = AsyncMock()
+            mock_redis.xautoclaim = AsyncMock(return_value=entries)
+            mock_redis.xack = AsyncMock(return_value=2)
+            mock_redis.xadd_many = AsyncMock(return_value=["9-0"])
+            mock_redis.xdelivery_counts = AsyncMock(return_value={})
+            mock_service.return_value.handle_batch = AsyncMock(side_effect=handle_batch)
+
+            await consumer.process_once()
+
+            assert set(mock_redis.xack.call_args.args[2:]) == {"5-0", "5-1"}
+            [dead] = mock_redis.xadd_many.call_args.args[1]
+            assert (dead["source_id"], dead["error"]) == ("5-1", "bad event")
+            mock_redis.xdelivery_counts.assert_not_called()
@@ -4,7 +4,7 @@
 
 import pytest
 import asyncio
-from unittest.mock import AsyncMock, patch, MagicMock
+from unittest.mock import AsyncMock, patch, MagicMock, ANY
 from datetime import datetime
 
 from mcp import MCPAdapter, MCPConfig, MCPContextManager, create_mcp_context
@@ -115,7 +115,8 @@ class TestMCPAdapter:
                 "task_id": "test-task-123",
                 "agent": "test-agent",
                 "metadata": {"priority": "high"}
-            }
+            },
+            headers={"Idempotency-Key": ANY}
         )
 
     @pytest.mark.asyncio
@@ -153,7 +154,8 @@ class TestMCPAdapter:
                 "result": "Task completed",
                 "duration_seconds": 300,
                 "metadata": {"files": ["result.txt"]}
-            }
+            },
+            headers={"Idempotency-Key": ANY}
         )
 
     @pytest.mark.asyncio
@@ -192,7 +194,8 @@ class TestMCPAdapter:
                 "progress": 75,
                 "message": "Processing data",
                 "metadata": {}
-            }
+            },
+            headers={"Idempotency-Key": ANY}
         )
 
     @pytest.mark.asyncio
@@ -232,7 +235,8 @@ class TestMCPAdapter:
                 "error_message": "Invalid input data",
                 "stack_trace": "Traceback...",
                 "metadata": {"attempt": 2}
-            }
+            },
+            headers={"Idempotency-Key": ANY}
         )
 
     @pytest.mark.asyncio
@@ -288,6 +292,33 @@ class TestMCPAdapter:
             )
 
 
+    @pytest.mark.asyncio
+    async def test_retries_reuse_idempotency_key(self, mock_config, mock_session):
+        """Повторы после сетевой ошибки отправляются с тем же Idempotency-Key"""
+        import httpx
+
+        mock_response = MagicMock()
+        mock_response.status_code = 202
+        mock_response.json.return_value = {"status": "accepted"}
+        mock_session.request.side_effect = [httpx.ConnectError("connection reset"), mock_response]
+
+        adapter = MCPAdapter(mock_config)
+        adapter.session = mock_session
+
+        with patch("mcp.asyncio.sleep", new=AsyncMock()):
+            result = await adapter.start_task(
+                project="test-project",
+                task="Test task",
+                task_id="test-task-123",
+                agent="test-agent"
+            )
+
+        assert result["status"] == "accepted"
+        keys = [call.kwargs["headers"]["Idempotency-Key"] for call in mock_session.request.call_args_list]
+        assert len(keys) == 2
+        assert keys[0] == keys[1]
+
+
 class TestMCPContextManager:
     """Тесты для MCPContextManager"""
 
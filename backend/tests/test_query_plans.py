@@ -0,0 +1,183 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from api.pagination import count_cache
+from models.models import Base, Project, Agent, Task
+from services.id_cache import clear_id_caches
+from services.webhook_service import WebhookService
+
+# Отдельная тестовая база данных для проверки планов запросов
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_plans.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+STATUSES = ("running", "completed", "failed", "completed", "completed")
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="module")
+def plans_db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    count_cache.clear()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    start = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        projects = [Project(name=f"project-{i}", created_at=start + timedelta(days=i)) for i in range(10)]
+        agents = [Agent(name=f"agent-{i}") for i in range(10)]
+        db.add_all(projects + agents)
+        db.flush()
+        db.add_all([
+            Task(
+                task_id=f"task-{i}", title=f"Task {i}", status=STATUSES[i % len(STATUSES)],
+                project_id=projects[i % 10].id, agent_id=agents[i // 10 % 10].id,
+                created_at=start + timedelta(minutes=i), started_at=start + timedelta(minutes=i),
+                finished_at=start + timedelta(minutes=i + 1)
+            )
+            for i in range(2000)
+        ])
+        db.commit()
+    # Статистика для планировщика SQLite, как после ANALYZE на рабочей базе
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+    yield
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+    clear_id_caches()
+
+
+@contextmanager
+def captured_statements(target):
+    """Записать SQL запросы (с параметрами), выполненные через движок"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, tuple(parameters)))
+
+    event.listen(target, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(target, "before_cursor_execute", record)
+
+
+def query_plans(path, **params):
+    """Планы (EXPLAIN QUERY PLAN) всех запросов к БД, выполненных эндпоинтом"""
+    with captured_statements(async_engine.sync_engine) as statements:
+        response = client.get(path, params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return explain(statements)
+
+
+def explain(statements):
+    with engine.connect() as connection:
+        return [
+            (statement, [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)])
+            for statement, parameters in statements
+        ]
+
+
+def main_query(plans):
+    """План выборки строк страницы (запрос с ORDER BY)"""
+    return next(plan for statement, plan in plans if "ORDER BY" in statement)
+
+
+def assert_indexed(plans):
+    """Ни один запрос не читает tasks или projects полным сканированием таблицы"""
+    for statement, plan in plans:
+        for step in plan:
+            if step.startswith(("SCAN tasks", "SCAN projects")):
+                assert "INDEX" in step, f"{step}\n{statement}"
+
+
+class TestQueryPlans:
+    """Основные запросы эндпоинтов используют индексы"""
+
+    @pytest.mark.parametrize("params, index", [
+        ({}, "ix_tasks_project_created"),
+        ({"status": "failed"}, "ix_tasks_project_created"),
+    ])
+    def test_project_tasks(self, plans_db, params, index):
+        plans = query_plans("/api/projects/project-3/tasks", limit=20, **params)
+
+        assert_indexed(plans)
+        plan = main_query(plans)
+        assert any(step.startswith("SEARCH tasks USING") and index in step for step in plan), plan
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+    def test_project_tasks_cursor_page(self, plans_db):
+        first = client.get("/api/projects/project-3/tasks", params={"limit": 20}, headers=headers).json()
+        plans = query_plans("/api/projects/project-3/tasks", limit=20, cursor=first["next_cursor"], total="none")
+
+        assert_indexed(plans)
+        plan = main_query(plans)
+        assert any("ix_tasks_project_created (project_id=? AND created_at<?)" in step for step in plan), plan
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+    @pytest.mark.parametrize("params, index", [
+        ({}, "ix_tasks_created"),
+        ({"status": "failed"}, "ix_tasks_status_created"),
+        ({"agent": "agent-4"}, "ix_tasks_agent_created"),
+    ])
+    def test_search(self, plans_db, params, index):
+        plans = query_plans("/api/tasks/search", limit=20, **params)
+
+        assert_indexed(plans)
+        plan = main_query(plans)
+        assert any(index + " " in step or step.endswith(index) for step in plan), plan
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+    def test_projects(self, plans_db):
+        plans = query_plans("/api/projects", limit=5)
+
+        assert_indexed(plans)
+        plan = main_query(plans)
+        assert any("ix_projects_created_at" in step for step in plan), plan
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan
+
+    def test_stats(self, plans_db):
+        plans = query_plans("/api/stats")
+
+        assert_indexed(plans)
+        # Статистика задач читается из счётчиков, без запросов к tasks
+        for statement, plan in plans:
+            assert not any(" tasks" in step for step in plan), (statement, plan)
+
+    def test_running_snapshot_uses_partial_index(self, plans_db):
+        with Session(engine) as db, captured_statements(engine) as statements:
+            WebhookService(db).snapshot_tasks()
+            WebhookService(db).snapshot_tasks("project-3")
+
+        for statement, plan in explain(statements):
+            assert any("ix_tasks_running_started" in step for step in plan), plan
+            assert "USE TEMP B-TREE FOR ORDER BY" not in plan
@@ -2,10 +2,12 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from unittest.mock import patch
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from unittest.mock import patch, AsyncMock
 
 from main import app
-from core.database import get_db
+from core.database import get_db, get_async_db, get_async_database_url
 from core.config import settings
 from models.models import Base, UserSettings
 
@@ -13,6 +15,8 @@ from models.models import Base, UserSettings
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_settings.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
@@ -23,7 +27,12 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -234,12 +243,12 @@ class TestSettingsAPI:
         response = client.get("/api/settings")
         assert response.status_code == 401  # Ожидается ошибка аутентификации
 
-    @patch('api.routes_settings.SettingsService')
+    @patch('api.routes_settings.AsyncSettingsService')
     def test_settings_service_integration(self, mock_settings_service):
         """Тест интеграции с сервисом настроек"""
         # Создаем мок сервиса
         mock_instance = mock_settings_service.return_value
-        mock_instance.get_all_settings.return_value = [
+        mock_instance.get_all_settings = AsyncMock(return_value=[
             {
                 "id": 1,
                 "key": "test",
@@ -249,7 +258,7 @@ class TestSettingsAPI:
                 "created_at": "2025-01-17T10:00:00Z",
                 "updated_at": "2025-01-17T10:00:00Z"
             }
-        ]
+        ])
 
         response = client.get("/api/settings", headers=headers)
         assert response.status_code == 200
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from main import app
+from core.config import settings
+from services.websocket_service import WebSocketService
+from webhook.sse_routes import event_stream, sse_endpoint, sse_frame
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def service():
+    """Отдельный экземпляр сервиса рассылки для SSE"""
+    service = WebSocketService(broadcast_backend="memory")
+    with patch("webhook.sse_routes.websocket_service", service):
+        yield service
+
+
+async def next_frame(stream):
+    return await asyncio.wait_for(stream.__anext__(), timeout=1)
+
+
+class TestSSEStream:
+    """Тесты потока Server-Sent Events"""
+
+    @pytest.mark.asyncio
+    async def test_project_events_are_streamed_with_ids(self, service):
+        sse_client = await service.open_stream("proj")
+        stream = event_stream(sse_client)
+        assert await next_frame(stream) == f"retry: {settings.SSE_RETRY_MS}\n\n"
+
+        await service.notify_task_started({"project": "other", "task_id": "t0"})
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+
+        frame = await next_frame(stream)
+        event_id, data = frame.rstrip("\n").split("\n")
+        assert event_id == "id: 2"
+        message = json.loads(data[len("data: "):])
+        assert (message["type"], message["data"]["task_id"], message["seq"]) == ("task_started", "t1", 2)
+
+        await stream.aclose()
+        assert service.get_connection_stats()["total_connections"] == 0
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_missed_events(self, service):
+        for task_id in ("t1", "t2", "t3"):
+            await service.notify_task_started({"project": "proj", "task_id": task_id})
+
+        stream = event_stream(await service.open_stream("proj", since=1))
+        await next_frame(stream)
+
+        assert (await next_frame(stream)).startswith("id: 2\n")
+        assert (await next_frame(stream)).startswith("id: 3\n")
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_keepalive_when_idle(self, service, monkeypatch):
+        monkeypatch.setattr(settings, "SSE_KEEPALIVE_SECONDS", 0.01)
+        stream = event_stream(await service.open_stream())
+        await next_frame(stream)
+
+        assert await next_frame(stream) == ": keepalive\n\n"
+        await stream.aclose()
+
+    @pytest.mark.asyncio
+    async def test_evicted_stream_ends(self, service):
+        sse_client = await service.open_stream()
+        stream = event_stream(sse_client)
+        await next_frame(stream)
+
+        service._evict(sse_client)
+
+        with pytest.raises(StopAsyncIteration):
+            await next_frame(stream)
+        assert service.get_connection_stats()["evicted_slow_clients"] == 1
+
+    def test_frame_without_seq_has_no_id(self):
+        assert sse_frame('{"type": "task_started"}') == 'data: {"type": "task_started"}\n\n'
+
+
+class TestSSEEndpoint:
+    """Тесты эндпоинта /webhook/events"""
+
+    def test_invalid_api_key(self):
+        response = client.get("/webhook/events?api_key=wrong")
+        assert response.status_code == 401
+
+    @pytest.mark.asyncio
+    async def test_last_event_id_takes_precedence(self, service):
+        service.open_stream = AsyncMock(return_value=MagicMock())
+
+        response = await sse_endpoint(
+            project="proj", api_key=None, since=1, last_event_id=5, header_api_key=settings.API_KEY
+        )
+
+        assert response.media_type == "text/event-stream"
+        assert response.headers["X-Accel-Buffering"] == "no"
+        assert service.open_stream.call_args.args == ("proj",)
+        assert service.open_stream.call_args.kwargs["since"] == 5
+
+    @pytest.mark.asyncio
+    async def test_snapshot_opens_short_lived_session(self, service):
+        """Сессия БД открывается только на время запроса снимка, а не на весь поток"""
+        with patch("webhook.websocket_routes.AsyncSessionLocal") as session_factory, \
+                patch("webhook.websocket_routes.AsyncWebhookService") as webhook_service:
+            session_factory.return_value.__aenter__ = AsyncMock()
+            session_factory.return_value.__aexit__ = AsyncMock(return_value=False)
+            webhook_service.return_value.snapshot_tasks = AsyncMock(return_value=[])
+
+            await service.notify_task_started({"project": "proj", "task_id": "t1"})
+            response = await sse_endpoint(
+                project="proj", api_key=None, since=999, last_event_id=None, header_api_key=settings.API_KEY
+            )
+            session_factory.return_value.__aexit__.assert_awaited_once()
+
+            stream = response.body_iterator
+            await next_frame(stream)
+            snapshot = json.loads((await next_frame(stream)).split("data: ", 1)[1])
+            assert snapshot["type"] == "snapshot"
+            await stream.aclose()
@@ -0,0 +1,247 @@
+import json
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event as sa_event, func, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from models.models import Base, Project, Task, TaskCounter, TaskCounterDelta
+from services.id_cache import clear_id_caches
+from services.import_service import WebhookImportService
+from services.task_counters import PROJECT_STATUS, TaskCounterService, TaskCountersJob, ensure_task_counters
+
+# Отдельная тестовая база данных для счётчиков
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_counters.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def counters_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    yield
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+    clear_id_caches()
+
+
+def event(kind, task_id, project="alpha", **data):
+    return {"event": kind, "project": project, "task": f"Task {task_id}", "task_id": task_id, "agent": "counter", **data}
+
+
+def send(*events):
+    response = client.post("/webhook/batch", json={"events": list(events)}, headers=headers)
+    assert response.status_code == 202
+
+
+def stats(project=None):
+    path = f"/api/stats/projects/{project}" if project else "/api/stats"
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def counted(project=None):
+    """Статистика, посчитанная COUNT и AVG по tasks"""
+    with Session(engine) as db:
+        query = select(Task.status, func.count()).group_by(Task.status)
+        duration = text(
+            "avg((julianday(finished_at) - julianday(started_at)) * 86400.0) FROM tasks "
+            "WHERE status = 'completed' AND finished_at IS NOT NULL AND started_at IS NOT NULL"
+        )
+        if project:
+            query = query.join(Task.project).where(Project.name == project)
+            duration = text(f"{duration.text} AND project_id = (SELECT id FROM projects WHERE name = :project)")
+        by_status = dict(db.execute(query).all())
+        average = db.execute(select(duration), {"project": project}).scalar()
+    return {
+        "total_tasks": sum(by_status.values()),
+        "active_tasks": by_status.get("running", 0),
+        "completed_tasks": by_status.get("completed", 0),
+        "failed_tasks": by_status.get("failed", 0),
+        "average_duration": average
+    }
+
+
+def assert_matches_tasks(data, project=None):
+    expected = counted(project)
+    assert data["average_duration"] == pytest.approx(expected.pop("average_duration"))
+    assert {key: data[key] for key in expected} == expected
+
+
+def delta_rows():
+    with Session(engine) as db:
+        return db.scalar(select(func.count()).select_from(TaskCounterDelta))
+
+
+class TestTaskCounters:
+    """Тесты счётчиков задач для /api/stats"""
+
+    def test_counters_follow_task_transitions(self, counters_db):
+        send(event("start", "a"), event("start", "b"), event("start", "c"), event("start", "d", project="beta"))
+        assert stats() == {"total_projects": 2, "total_tasks": 4, "active_tasks": 4,
+                           "completed_tasks": 0, "failed_tasks": 0, "average_duration": None}
+
+        send(event("finish", "a", result="ok"), event("error", "b", error_type="E", error_message="boom"))
+        send(event("status", "c", status="pending", progress=0, message="queued"))
+        client.post("/webhook/finish", json={
+            "project": "beta", "task": "Task d", "task_id": "d", "agent": "counter", "result": "ok"
+        }, headers=headers)
+
+        data = stats()
+        assert (data["total_tasks"], data["active_tasks"], data["completed_tasks"], data["failed_tasks"]) == (4, 0, 2, 1)
+        assert data["average_duration"] is not None
+        assert_matches_tasks(data)
+
+        # Перезапуск выполненной задачи возвращает её в running
+        send(event("start", "a"))
+        assert_matches_tasks(stats())
+        assert stats()["active_tasks"] == 1
+
+    def test_project_stats(self, counters_db):
+        send(event("start", "a"), event("start", "b"), event("start", "c", project="beta"))
+        send(event("finish", "a"), event("error", "c", project="beta", error_type="E", error_message="x"))
+
+        data = stats("alpha")
+        assert data["project"] == "alpha"
+        assert (data["total_tasks"], data["active_tasks"], data["completed_tasks"], data["failed_tasks"]) == (2, 1, 1, 0)
+        assert_matches_tasks(data, "alpha")
+        assert stats("beta")["failed_tasks"] == 1
+
+        response = client.get("/api/stats/projects/missing", headers=headers)
+        assert response.status_code == 404
+
+    def test_project_count_is_read_from_counters(self, counters_db):
+        send(event("start", "a"), event("start", "b", project="beta"), event("start", "c", project="gamma"))
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DELETE FROM tasks WHERE task_id = 'c'")
+            connection.exec_driver_sql("DELETE FROM projects WHERE name = 'gamma'")
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sa_event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            data = stats()
+        finally:
+            sa_event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+        assert data["total_projects"] == 2
+        assert not any("projects" in statement for statement in statements)
+        assert "total_projects" not in stats("beta")
+
+        with Session(engine) as db:
+            assert TaskCounterService(db).reconcile() == 0
+
+    def test_progress_updates_do_not_touch_counters(self, counters_db):
+        send(event("start", "a"))
+        before = delta_rows()
+
+        for progress in (10, 20, 30):
+            response = client.post("/webhook/status", json=event(
+                "status", "a", status="running", progress=progress, message="working"
+            ), headers=headers)
+            assert response.status_code == 202
+
+        assert delta_rows() == before
+
+    @pytest.mark.asyncio
+    async def test_imported_tasks_are_counted(self, counters_db):
+        service = WebhookImportService(session_factory=TestingAsyncSessionLocal)
+        body = "".join(json.dumps(line) + "\n" for line in (
+            event("start", "i1"), event("start", "i2"), event("start", "i3"),
+            event("finish", "i1"), event("error", "i2", error_type="E", error_message="x"),
+        )).encode()
+
+        async def chunks():
+            yield body
+
+        [report async for report in service.run(chunks())]
+
+        data = stats()
+        assert (data["total_tasks"], data["active_tasks"], data["completed_tasks"], data["failed_tasks"]) == (3, 1, 1, 1)
+        assert_matches_tasks(data)
+
+    @pytest.mark.asyncio
+    async def test_flush_folds_journal_into_counters(self, counters_db):
+        send(event("start", "a"), event("start", "b"), event("start", "c", project="beta"))
+        send(event("finish", "a"), event("error", "b", error_type="E", error_message="x"))
+        before = stats()
+        journal = delta_rows()
+
+        job = TaskCountersJob(flush_interval=1.0, reconcile_interval=0, session_factory=TestingAsyncSessionLocal)
+        assert await job.flush() == journal
+
+        assert delta_rows() == 0
+        assert stats() == before
+        with Session(engine) as db:
+            counters = {(row.status, row.tasks) for row in db.scalars(select(TaskCounter)) if row.tasks}
+        assert counters == {("completed", 1), ("failed", 1), ("running", 1), (PROJECT_STATUS, 1)}
+
+        # Новые изменения снова попадают в журнал поверх свёрнутых счётчиков
+        send(event("finish", "c", project="beta"))
+        assert_matches_tasks(stats())
+        assert await job.flush() == 2
+        assert_matches_tasks(stats())
+
+    def test_reconcile_corrects_drift(self, counters_db):
+        send(event("start", "a"), event("start", "b"), event("finish", "a"))
+        with Session(engine) as db:
+            TaskCounterService(db).flush()
+            # Изменения в обход триггеров
+            db.execute(text("UPDATE task_counters SET tasks = tasks + 5 WHERE status = 'running'"))
+            db.execute(text("INSERT INTO task_counter_deltas (project_id, status, tasks, duration_sum, duration_count) "
+                            "VALUES (999, 'failed', 3, 0, 0)"))
+            db.commit()
+        assert stats()["active_tasks"] == 6
+
+        with Session(engine) as db:
+            assert TaskCounterService(db).reconcile() == 2
+            assert TaskCounterService(db).reconcile() == 0
+
+        assert_matches_tasks(stats())
+        assert delta_rows() == 0
+
+    def test_counters_are_created_for_existing_database(self, counters_db):
+        send(event("start", "a"), event("start", "b"), event("finish", "a"))
+        with engine.begin() as connection:
+            for trigger in ("task_counters_insert", "task_counters_update", "task_counters_delete",
+                            "task_counters_project_insert", "task_counters_project_delete"):
+                connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+            connection.exec_driver_sql("DELETE FROM task_counter_deltas")
+
+        ensure_task_counters(engine)
+
+        assert_matches_tasks(stats())
+        assert stats()["total_projects"] == 1
+        send(event("start", "c"), event("start", "d", project="beta"))
+        assert stats()["active_tasks"] == 3
+        assert stats()["total_projects"] == 2
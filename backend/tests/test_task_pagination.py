@@ -0,0 +1,286 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, insert, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from api.pagination import count_cache, decode_cursor, explain
+from models.models import Base, Task, Project, Agent
+from models.schemas import TaskResponse
+
+# Отдельная тестовая база данных для пагинации
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_pagination.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def pagination_db():
+    Base.metadata.create_all(bind=engine)
+    count_cache.clear()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    db = TestingSessionLocal()
+    project = Project(name="paged")
+    other = Project(name="other")
+    agent = Agent(name="paged_agent")
+    other_agent = Agent(name="other_agent")
+    db.add_all([project, other, agent, other_agent])
+    db.flush()
+    started = datetime(2024, 1, 1, 10, 0, 0)
+    for index in range(7):
+        # У t3 и t4 одинаковое время создания: порядок задаётся id
+        created_at = started + timedelta(minutes=min(index, 3) if index == 4 else index)
+        db.add(Task(task_id=f"t{index}", title=f"Task {index}", status="running",
+                    project_id=project.id, agent_id=agent.id, created_at=created_at))
+    db.add(Task(task_id="x0", title="Other", status="running", project_id=other.id, agent_id=other_agent.id,
+                created_at=started, duration_seconds=1800, task_metadata={"files": ["a.py"]}))
+    db.commit()
+    db.close()
+
+    yield
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+
+
+def task_ids(data):
+    return [item["task_id"] for item in data["items"]]
+
+
+class StatementCounter:
+    """Запросы, выполненные тестовым async engine"""
+
+    def __init__(self):
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, *args):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(async_engine.sync_engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(async_engine.sync_engine, "before_cursor_execute", self.record)
+
+
+class TestKeysetPagination:
+    """Тесты курсорной пагинации списков задач"""
+
+    def test_cursor_walk_matches_offset_order(self, pagination_db):
+        url = "/api/projects/paged/tasks"
+        full = client.get(url, params={"limit": 10}, headers=headers).json()
+        assert task_ids(full) == ["t6", "t5", "t4", "t3", "t2", "t1", "t0"]
+
+        first = client.get(url, params={"limit": 3}, headers=headers).json()
+        assert task_ids(first) == ["t6", "t5", "t4"]
+        assert first["prev_cursor"] is None
+
+        second = client.get(url, params={"limit": 3, "cursor": first["next_cursor"]}, headers=headers).json()
+        assert task_ids(second) == ["t3", "t2", "t1"]
+        assert (second["has_prev"], second["has_next"]) == (True, True)
+
+        last = client.get(url, params={"limit": 3, "cursor": second["next_cursor"]}, headers=headers).json()
+        assert task_ids(last) == ["t0"]
+        assert (last["has_next"], last["next_cursor"]) == (False, None)
+        assert last["total"] == 7
+
+        # Обратно по prev_cursor возвращаются те же страницы
+        back = client.get(url, params={"limit": 3, "cursor": last["prev_cursor"]}, headers=headers).json()
+        assert task_ids(back) == ["t3", "t2", "t1"]
+        back = client.get(url, params={"limit": 3, "cursor": back["prev_cursor"]}, headers=headers).json()
+        assert task_ids(back) == ["t6", "t5", "t4"]
+        assert (back["has_prev"], back["prev_cursor"]) == (False, None)
+
+    def test_cursor_query_uses_keyset_condition(self, pagination_db):
+        page = client.get("/api/projects/paged/tasks", params={"limit": 2}, headers=headers).json()
+        with StatementCounter() as counter:
+            client.get("/api/projects/paged/tasks", params={"limit": 2, "cursor": page["next_cursor"]},
+                       headers=headers)
+
+        # Страница выбирается условием по (created_at, id); SQLite всегда добавляет OFFSET 0
+        [(statement, parameters)] = [
+            (statement, parameters) for statement, parameters in counter.statements
+            if "FROM tasks" in statement and "count(" not in statement
+        ]
+        assert "(tasks.created_at, tasks.id) < (?, ?)" in statement
+        assert parameters[-1] == 0
+
+    def test_search_with_cursor_and_filters(self, pagination_db):
+        first = client.get("/api/tasks/search", params={"limit": 4}, headers=headers).json()
+        assert first["total"] == 8
+        rest = client.get("/api/tasks/search", params={"limit": 4, "cursor": first["next_cursor"]},
+                          headers=headers).json()
+        assert len(set(task_ids(first)) | set(task_ids(rest))) == 8
+
+        filtered = client.get("/api/tasks/search", params={"limit": 5, "project_name": "paged"},
+                              headers=headers).json()
+        rest = client.get("/api/tasks/search", params={
+            "limit": 5, "project_name": "paged", "cursor": filtered["next_cursor"]
+        }, headers=headers).json()
+        assert task_ids(rest) == ["t1", "t0"]
+
+    def test_cursor_walk_with_server_default_timestamps(self, pagination_db):
+        with engine.begin() as connection:
+            project_id = connection.execute(insert(Project).values(name="burst").returning(Project.id)).scalar()
+            agent_id = connection.scalar(select(Agent.id).where(Agent.name == "paged_agent"))
+            # Одна вставка: у всех задач одинаковый CURRENT_TIMESTAMP без дробной части
+            connection.execute(insert(Task).values([
+                {"task_id": f"b{index}", "title": f"Burst {index}", "status": "running",
+                 "project_id": project_id, "agent_id": agent_id}
+                for index in range(6)
+            ]))
+            stored = connection.execute(text("SELECT DISTINCT created_at FROM tasks WHERE task_id LIKE 'b%'")).scalars().all()
+        assert len(stored) == 1 and "." not in stored[0]
+
+        url = "/api/projects/burst/tasks"
+        first = client.get(url, params={"limit": 3}, headers=headers).json()
+        assert task_ids(first) == ["b5", "b4", "b3"]
+
+        second = client.get(url, params={"limit": 3, "cursor": first["next_cursor"]}, headers=headers).json()
+        assert task_ids(second) == ["b2", "b1", "b0"]
+        assert (second["has_next"], second["next_cursor"]) == (False, None)
+
+        back = client.get(url, params={"limit": 3, "cursor": second["prev_cursor"]}, headers=headers).json()
+        assert task_ids(back) == ["b5", "b4", "b3"]
+        assert back["has_prev"] is False
+
+        # Граница фильтра по дате - та же секунда
+        created_at, _, _ = decode_cursor(first["next_cursor"])
+        bounded = client.get(url, params={"from_date": created_at.isoformat(), "to_date": created_at.isoformat()},
+                             headers=headers).json()
+        assert bounded["total"] == 6
+
+    def test_offset_mode_returns_cursor_for_next_page(self, pagination_db):
+        page = client.get("/api/projects/paged/tasks", params={"limit": 2, "offset": 2}, headers=headers).json()
+        assert task_ids(page) == ["t4", "t3"]
+        created_at, _, direction = decode_cursor(page["next_cursor"])
+        assert (created_at, direction) == (datetime(2024, 1, 1, 10, 3), "next")
+
+    @pytest.mark.parametrize("cursor", ["garbage", "W10", "WyJ4IiwxLCJuZXh0Il0"])
+    def test_invalid_cursor(self, pagination_db, cursor):
+        response = client.get("/api/projects/paged/tasks", params={"cursor": cursor}, headers=headers)
+        assert response.status_code == 400
+
+
+class TestTaskListingQueries:
+    """Списки задач выбираются фиксированным числом запросов независимо от размера страницы"""
+
+    def test_project_tasks_query_count(self, pagination_db):
+        with StatementCounter() as counter:
+            data = client.get("/api/projects/paged/tasks", params={"limit": 100}, headers=headers).json()
+
+        assert len(data["items"]) == 7
+        # Проект, число задач, страница с именами агентов
+        assert len(counter.statements) == 3
+
+    def test_search_query_count_with_several_agents(self, pagination_db):
+        with StatementCounter() as counter:
+            data = client.get("/api/tasks/search", params={"limit": 100}, headers=headers).json()
+
+        assert {item["agent"] for item in data["items"]} == {"paged_agent", "other_agent"}
+        assert len(counter.statements) == 2
+
+    def test_items_match_task_response(self, pagination_db):
+        data = client.get("/api/tasks/search", params={"agent": "other_agent"}, headers=headers).json()
+        [item] = data["items"]
+
+        assert list(item) == list(TaskResponse.model_fields)
+        assert TaskResponse.model_validate(item).model_dump(mode="json") == item
+        assert (item["task"], item["agent"], item["agent_name"]) == ("Other", "other_agent", "other_agent")
+        assert (item["duration_seconds"], item["task_metadata"]) == (1800.0, {"files": ["a.py"]})
+        assert item["created_at"] == "2024-01-01T10:00:00"
+
+    def test_get_task_is_one_query(self, pagination_db):
+        with StatementCounter() as counter:
+            response = client.get("/api/tasks/x0", headers=headers)
+
+        assert response.status_code == 200
+        assert response.json()["agent_name"] == "other_agent"
+        assert len(counter.statements) == 1
+
+
+def count_statements(counter):
+    return [statement for statement, _ in counter.statements if "count(" in statement]
+
+
+class TestTotalModes:
+    """Тесты режимов подсчёта total"""
+
+    def test_total_none_skips_count(self, pagination_db):
+        with StatementCounter() as counter:
+            page = client.get("/api/projects/paged/tasks", params={"limit": 3, "total": "none"},
+                              headers=headers).json()
+
+        assert page["total"] is None
+        assert (task_ids(page), page["has_next"]) == (["t6", "t5", "t4"], True)
+        assert count_statements(counter) == []
+
+        last = client.get("/api/projects/paged/tasks", params={"limit": 3, "offset": 6, "total": "none"},
+                          headers=headers).json()
+        assert (task_ids(last), last["has_next"]) == (["t0"], False)
+
+        with StatementCounter() as counter:
+            rest = client.get("/api/tasks/search", params={"cursor": page["next_cursor"], "total": "none"},
+                              headers=headers).json()
+        assert rest["total"] is None and len(rest["items"]) == 5
+        assert count_statements(counter) == []
+
+    def test_estimate_is_cached_by_filter(self, pagination_db):
+        params = {"limit": 2, "total": "estimate", "status": "running"}
+        with StatementCounter() as counter:
+            first = client.get("/api/projects/paged/tasks", params=params, headers=headers).json()
+            second = client.get("/api/projects/paged/tasks", params={**params, "offset": 2},
+                                headers=headers).json()
+
+        # SQLite без статистики планировщика: малая выборка считается точно и кэшируется
+        assert first["total"] == second["total"] == 7
+        assert len(count_statements(counter)) == 1
+
+        with StatementCounter() as counter:
+            other = client.get("/api/projects/paged/tasks", params={**params, "status": "completed"},
+                               headers=headers).json()
+        assert other["total"] == 0
+        assert len(count_statements(counter)) == 1
+
+    def test_projects_total_modes(self, pagination_db):
+        page = client.get("/api/projects", params={"limit": 1, "total": "none"}, headers=headers).json()
+        assert (page["total"], len(page["items"]), page["has_next"]) == (None, 1, True)
+
+        page = client.get("/api/projects", params={"limit": 5}, headers=headers).json()
+        assert (page["total"], page["has_next"]) == (2, False)
+
+    def test_unknown_total_mode_is_rejected(self, pagination_db):
+        response = client.get("/api/tasks/search", params={"total": "approximate"}, headers=headers)
+        assert response.status_code == 422
+
+    def test_estimate_uses_explain_on_postgresql(self):
+        sql = str(explain(select(Task.id).where(Task.status == "running")).compile(dialect=postgresql.dialect()))
+        assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT tasks.id")
+        assert "tasks.status = %(status_1)s" in sql
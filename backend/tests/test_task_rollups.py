@@ -0,0 +1,262 @@
+import math
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event as sa_event, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from models.models import Base, Project, Agent, Task, TaskFinishEvent, TaskRollup
+from services.id_cache import clear_id_caches
+from services.task_counters import TaskCountersJob
+from services.task_rollups import DurationSketch, TaskRollupService, ensure_task_rollups
+
+# Отдельная тестовая база данных для агрегатов
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_rollups.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+START = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def rollups_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    yield
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+    clear_id_caches()
+
+
+def add_tasks(*specs):
+    """Задачи (task_id, project, agent, status, finished_at, duration) напрямую в БД"""
+    with Session(engine) as db:
+        ids = {}
+        for model, names in ((Project, {spec[1] for spec in specs}), (Agent, {spec[2] for spec in specs})):
+            for name in sorted(names):
+                entity = db.scalar(select(model).where(model.name == name)) or model(name=name)
+                db.add(entity)
+                db.flush()
+                ids[model, name] = entity.id
+        for task_id, project, agent, status, finished_at, duration in specs:
+            db.add(Task(
+                task_id=task_id, title=task_id, status=status,
+                project_id=ids[Project, project], agent_id=ids[Agent, agent],
+                started_at=finished_at - timedelta(seconds=duration), finished_at=finished_at
+            ))
+        db.commit()
+
+
+def flush():
+    with Session(engine) as db:
+        return TaskRollupService(db).flush()
+
+
+def timeseries(**params):
+    params.setdefault("from_date", START.isoformat())
+    params.setdefault("to_date", (START + timedelta(hours=3)).isoformat())
+    response = client.get("/api/stats/timeseries", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+class TestDurationSketch:
+    """Тесты логарифмической гистограммы длительностей"""
+
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(7)
+        values = sorted(rng.lognormvariate(3, 1.5) for _ in range(20000))
+        sketch = DurationSketch()
+        for value in values:
+            sketch.add(value)
+
+        for q in (0.5, 0.95, 0.99):
+            exact = values[math.ceil(q * len(values)) - 1]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=DurationSketch.RELATIVE_ACCURACY * 1.01)
+
+    def test_merge_equals_single_sketch(self):
+        values = [0.0, 0.0005, 1.5, 2.0, 30.0, 3600.0, 86400.0]
+        whole, left, right = DurationSketch(), DurationSketch(), DurationSketch()
+        for index, value in enumerate(values):
+            whole.add(value)
+            (left if index % 2 else right).add(value)
+        left.merge(right)
+
+        assert left.bins == whole.bins
+        assert DurationSketch().quantile(0.5) is None
+
+
+class TestTaskRollups:
+    """Тесты агрегатов и /api/stats/timeseries"""
+
+    def test_hourly_series(self, rollups_db):
+        add_tasks(
+            ("a1", "alpha", "bot", "completed", START + timedelta(minutes=5), 10),
+            ("a2", "alpha", "bot", "completed", START + timedelta(minutes=50), 20),
+            ("a3", "alpha", "bot", "failed", START + timedelta(minutes=55), 5),
+            ("b1", "beta", "bot", "completed", START + timedelta(hours=2, minutes=1), 100),
+            ("r1", "alpha", "bot", "running", START + timedelta(minutes=1), 1),
+        )
+        assert flush() == 4
+
+        data = timeseries(granularity="hour")
+        assert [point["bucket"][:19] for point in data["points"]] == [
+            "2024-01-01T10:00:00", "2024-01-01T11:00:00", "2024-01-01T12:00:00"
+        ]
+        first, empty, last = data["points"]
+        assert (first["completed"], first["failed"]) == (2, 1)
+        assert first["failure_rate"] == pytest.approx(1 / 3)
+        assert first["average_duration"] == pytest.approx(15, rel=1e-3)
+        assert first["p50"] == pytest.approx(10, rel=0.011)
+        assert first["p99"] == pytest.approx(20, rel=0.011)
+        assert empty == {"bucket": empty["bucket"], "completed": 0, "failed": 0, "failure_rate": None,
+                         "average_duration": None, "p50": None, "p95": None, "p99": None}
+        assert last["p50"] == pytest.approx(100, rel=0.011)
+
+        summary = data["summary"]
+        assert (summary["completed"], summary["failed"]) == (3, 1)
+        assert summary["p50"] == pytest.approx(20, rel=0.011)
+
+    def test_minute_and_day_granularity(self, rollups_db):
+        add_tasks(
+            ("a1", "alpha", "bot", "completed", START + timedelta(minutes=5, seconds=10), 1),
+            ("a2", "alpha", "bot", "completed", START + timedelta(minutes=5, seconds=50), 3),
+            ("a3", "alpha", "bot", "failed", START + timedelta(days=1), 1),
+        )
+        flush()
+
+        minutes = timeseries(granularity="minute", to_date=(START + timedelta(minutes=10)).isoformat())
+        assert len(minutes["points"]) == 10
+        assert minutes["points"][5]["completed"] == 2
+
+        days = timeseries(granularity="day", to_date=(START + timedelta(days=2)).isoformat())
+        # Окно выравнивается по началу суток
+        assert [(point["completed"], point["failed"]) for point in days["points"]] == [(2, 0), (0, 1), (0, 0)]
+
+    def test_project_and_agent_filters(self, rollups_db):
+        add_tasks(
+            ("a1", "alpha", "bot", "completed", START + timedelta(minutes=1), 10),
+            ("a2", "alpha", "helper", "failed", START + timedelta(minutes=2), 10),
+            ("b1", "beta", "bot", "completed", START + timedelta(minutes=3), 10),
+        )
+        flush()
+
+        assert timeseries(project="alpha")["summary"]["failed"] == 1
+        assert timeseries(agent="bot")["summary"]["completed"] == 2
+        assert timeseries(project="alpha", agent="bot")["summary"]["completed"] == 1
+        for params in ({"project": "missing"}, {"agent": "missing"}):
+            response = client.get("/api/stats/timeseries", params=params, headers=headers)
+            assert response.status_code == 404
+
+    def test_webhook_transitions_are_recorded_once(self, rollups_db):
+        def send(*events):
+            response = client.post("/webhook/batch", json={"events": [
+                {"project": "alpha", "task": "Task", "agent": "bot", **event} for event in events
+            ]}, headers=headers)
+            assert response.status_code == 202
+
+        send({"event": "start", "task_id": "t1"}, {"event": "start", "task_id": "t2"})
+        send({"event": "finish", "task_id": "t1"}, {"event": "finish", "task_id": "t1"},
+             {"event": "error", "task_id": "t2", "error_type": "E", "error_message": "x"})
+        # Перезапуск и повторное завершение - новое событие завершения
+        send({"event": "start", "task_id": "t1"})
+        send({"event": "finish", "task_id": "t1"})
+
+        with Session(engine) as db:
+            assert db.scalar(select(func.count()).select_from(TaskFinishEvent)) == 3
+
+        now = datetime.now(timezone.utc)
+        summary = timeseries(granularity="minute", from_date=(now - timedelta(minutes=5)).isoformat(),
+                             to_date=(now + timedelta(minutes=1)).isoformat())["summary"]
+        # Журнал ещё не свёрнут
+        assert summary["completed"] == 0
+        flush()
+        summary = timeseries(granularity="minute", from_date=(now - timedelta(minutes=5)).isoformat(),
+                             to_date=(now + timedelta(minutes=1)).isoformat())["summary"]
+        assert (summary["completed"], summary["failed"]) == (2, 1)
+
+    @pytest.mark.asyncio
+    async def test_job_flush_folds_counters_and_rollups(self, rollups_db):
+        add_tasks(("a1", "alpha", "bot", "completed", START, 10))
+
+        job = TaskCountersJob(flush_interval=1.0, reconcile_interval=0, session_factory=TestingAsyncSessionLocal)
+        await job.flush()
+
+        assert job.get_stats()["rollup_events"] == 1
+        assert timeseries()["summary"]["completed"] == 1
+
+    def test_timeseries_reads_only_rollups(self, rollups_db):
+        add_tasks(("a1", "alpha", "bot", "completed", START, 10))
+        flush()
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sa_event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            timeseries(project="alpha", agent="bot")
+        finally:
+            sa_event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+        assert not any("FROM tasks" in statement for statement in statements)
+        assert sum("task_rollup" in statement for statement in statements) == 2
+
+    def test_invalid_ranges(self, rollups_db):
+        for params in (
+            {"from_date": "2024-01-02T00:00:00", "to_date": "2024-01-01T00:00:00"},
+            {"granularity": "minute", "from_date": "2023-01-01T00:00:00", "to_date": "2024-01-01T00:00:00"},
+        ):
+            response = client.get("/api/stats/timeseries", params=params, headers=headers)
+            assert response.status_code == 400
+
+    def test_prune_keeps_daily_rollups(self, rollups_db):
+        add_tasks(("old", "alpha", "bot", "completed", START, 10))
+        flush()
+
+        with Session(engine) as db:
+            TaskRollupService(db).prune(now=START + timedelta(days=365))
+            assert set(db.scalars(select(TaskRollup.granularity))) == {"day"}
+
+    def test_rollups_are_built_for_existing_database(self, rollups_db):
+        add_tasks(("a1", "alpha", "bot", "completed", START, 10), ("a2", "alpha", "bot", "failed", START, 10))
+        flush()
+        with engine.begin() as connection:
+            for trigger in ("task_rollups_insert", "task_rollups_update"):
+                connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+            for table in ("task_rollups", "task_rollup_durations"):
+                connection.exec_driver_sql(f"DELETE FROM {table}")
+
+        ensure_task_rollups(engine)
+
+        summary = timeseries()["summary"]
+        assert (summary["completed"], summary["failed"]) == (1, 1)
+        assert summary["p50"] == pytest.approx(10, rel=0.011)
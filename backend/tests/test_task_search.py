@@ -0,0 +1,199 @@
+import json
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from api.pagination import count_cache
+from api.serializers import select_task_rows
+from models.models import Base
+from services.id_cache import clear_id_caches
+from services.import_service import WebhookImportService
+from services.task_search import apply_text_search, ensure_search_index, install_postgres_search
+
+# Отдельная тестовая база данных для поиска
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_search.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def search_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    count_cache.clear()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    yield
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+    clear_id_caches()
+
+
+def event(kind, task_id, task="Task", **data):
+    return {"event": kind, "project": "search", "task": task, "task_id": task_id, "agent": "searcher", **data}
+
+
+def send(*events):
+    response = client.post("/webhook/batch", json={"events": list(events)}, headers=headers)
+    assert response.status_code == 202
+
+
+def search(**params):
+    response = client.get("/api/tasks/search", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return [item["task_id"] for item in response.json()["items"]]
+
+
+class TestTaskSearch:
+    """Тесты поиска задач q= и фильтра task_name"""
+
+    def test_q_searches_all_columns(self, search_db):
+        send(
+            event("start", "deploy", task="Deploy auth service"),
+            event("start", "login", task="Fix login page"),
+            event("start", "docs", task="Write docs"),
+            event("finish", "login", result="Patched authentication flow"),
+            event("error", "docs", error_type="TimeoutError", error_message="contacting auth server"),
+        )
+
+        assert set(search(q="auth")) == {"deploy", "login", "docs"}
+        assert search(q="LOGIN page") == ["login"]
+        assert search(q="timeouterror") == ["docs"]
+        assert search(q="auth missing") == []
+
+    def test_relevance_ordering(self, search_db):
+        send(
+            event("start", "many", task="Audit auth: auth tokens and auth cookies"),
+            event("start", "one", task="Cleanup"),
+            event("error", "one", error_type="E", error_message="auth failed"),
+        )
+
+        assert search(q="auth") == ["many", "one"]
+        # Новые первыми, если сортировка по релевантности не нужна
+        assert search(q="auth", sort="created_at") == ["one", "many"]
+
+    def test_index_follows_updates(self, search_db):
+        send(event("start", "t1", task="Initial title"))
+        send(event("status", "t1", status="running", progress=10, message="Compiling kernel modules"))
+        assert search(q="kernel") == ["t1"]
+
+        # Перезапуск задачи (upsert) заменяет проиндексированный текст
+        send(event("start", "t1", task="Renamed task"))
+        assert search(q="kernel") == []
+        assert search(q="initial") == []
+        assert search(q="renamed") == ["t1"]
+
+        response = client.post("/webhook/finish", json={
+            "project": "search", "task": "Renamed task", "task_id": "t1", "agent": "searcher", "result": "All green"
+        }, headers=headers)
+        assert response.status_code == 202
+        assert search(q="green") == ["t1"]
+
+    @pytest.mark.asyncio
+    async def test_imported_tasks_are_indexed(self, search_db):
+        service = WebhookImportService(session_factory=TestingAsyncSessionLocal)
+        body = "".join(json.dumps(line) + "\n" for line in (
+            event("start", "imp", task="Imported migration task"),
+            event("error", "imp", error_type="E", error_message="deadlock detected"),
+        )).encode()
+
+        async def chunks():
+            yield body
+
+        [report async for report in service.run(chunks())]
+
+        assert search(q="deadlock migration") == ["imp"]
+
+    def test_short_words_and_title_filter(self, search_db):
+        send(
+            event("start", "ui", task="Разработка UI авторизации"),
+            event("start", "api", task="API авторизации"),
+        )
+
+        assert search(q="ui авторизации") == ["ui"]
+        assert search(task_name="АВТОРИЗ", sort="created_at") == ["api", "ui"]
+        assert search(task_name="ui") == ["ui"]
+        response = client.get("/api/projects/search/tasks", params={"task_name": "api авт"}, headers=headers)
+        assert [item["task_id"] for item in response.json()["items"]] == ["api"]
+
+    def test_relevance_ordering_does_not_support_cursor(self, search_db):
+        send(event("start", "a", task="auth one"), event("start", "b", task="auth two"))
+
+        page = client.get("/api/tasks/search", params={"q": "auth", "limit": 1}, headers=headers).json()
+        assert (page["has_next"], page["next_cursor"], page["total"]) == (True, None, 2)
+
+        response = client.get("/api/tasks/search", params={"q": "auth", "sort": "relevance", "cursor": "x"},
+                              headers=headers)
+        assert response.status_code == 400
+
+    def test_index_is_rebuilt_for_existing_database(self, search_db):
+        send(event("start", "old", task="Legacy reporting job"))
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE tasks_fts")
+            for trigger in ("tasks_fts_insert", "tasks_fts_update", "tasks_fts_delete"):
+                connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+
+        ensure_search_index(engine)
+
+        assert search(q="reporting") == ["old"]
+        send(event("start", "new", task="New reporting job"))
+        assert set(search(q="reporting")) == {"old", "new"}
+
+    def test_postgresql_query_uses_indexed_expression(self):
+        query, order = apply_text_search(select_task_rows(), "Auth, fix!", "postgresql")
+        compiled = query.order_by(order).compile(dialect=postgresql.dialect())
+
+        sql = str(compiled)
+        assert "to_tsvector('simple', coalesce(tasks.title, '') || ' ' || coalesce(tasks.description, '')" in sql
+        assert "@@ to_tsquery('simple', %(to_tsquery_1)s)" in sql
+        assert "ts_rank_cd(" in sql and sql.endswith("DESC")
+        assert compiled.params["to_tsquery_1"] == "auth:* & fix:*"
+
+    def test_postgresql_indexes_are_created_without_migrations(self):
+        class RecordingConnection:
+            def __init__(self):
+                self.statements = []
+
+            def exec_driver_sql(self, statement):
+                self.statements.append(statement)
+
+        connection = RecordingConnection()
+        install_postgres_search(connection, concurrently=True)
+
+        extension, search_index, title_index = connection.statements
+        assert extension == "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+        assert search_index.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_search ON tasks USING gin (")
+        assert "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '')" in search_index
+        assert title_index == ("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_title_trgm "
+                               "ON tasks USING gin (title gin_trgm_ops)")
+
+        # При создании tasks таблица пуста, индексы строятся обычным CREATE INDEX
+        connection = RecordingConnection()
+        install_postgres_search(connection)
+        assert all("CONCURRENTLY" not in statement for statement in connection.statements)
@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from core.database import get_async_db, get_async_database_url
+from core.config import settings
+from services.id_cache import clear_id_caches
+from models.models import Base, Task, Project, Agent
+
+# Отдельная тестовая база данных для вебхуков
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_webhooks.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+client = TestClient(app)
+
+# Заголовок с API ключом для тестов
+headers = {"X-API-Key": settings.API_KEY}
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+@pytest.fixture(scope="function")
+def webhook_db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+
+    yield TestingSessionLocal
+
+    if previous:
+        app.dependency_overrides[get_async_db] = previous
+    else:
+        app.dependency_overrides.pop(get_async_db, None)
+    Base.metadata.drop_all(bind=engine)
+
+
+def start_event(task_id, project="batch_project", agent="batch_agent"):
+    return {"event": "start", "project": project, "task": f"Task {task_id}", "task_id": task_id, "agent": agent}
+
+
+class TestWebhookBatch:
+    """Тесты для пакетного вебхука"""
+
+    def test_batch_requires_api_key(self):
+        """Пакетный эндпоинт требует API ключ"""
+        response = client.post("/webhook/batch", json={"events": []})
+        assert response.status_code == 401
+
+    def test_batch_mixed_events(self, webhook_db):
+        """События разных типов применяются по порядку в одной транзакции"""
+        events = [
+            start_event("batch_1"),
+            start_event("batch_2", project="other_project"),
+            {"event": "status", "project": "batch_project", "task": "Task batch_1", "task_id": "batch_1",
+             "agent": "batch_agent", "status": "running", "progress": 50.0},
+            {"event": "finish", "project": "batch_project", "task": "Task batch_1", "task_id": "batch_1",
+             "agent": "batch_agent", "result": "done", "duration_seconds": 12.5},
+            {"event": "error", "project": "other_project", "task": "Task batch_2", "task_id": "batch_2",
+             "agent": "batch_agent", "error_type": "RuntimeError", "error_message": "boom"},
+        ]
+
+        response = client.post("/webhook/batch", json={"events": events}, headers=headers)
+        assert response.status_code == 202
+        data = response.json()
+        assert data["processed"] == 5
+        assert data["accepted"] == 5
+        assert data["not_found"] == 0
+        assert [item["index"] for item in data["results"]] == [0, 1, 2, 3, 4]
+        assert [item["status_in_db"] for item in data["results"]] == [
+            "running", "running", "running", "completed", "failed"
+        ]
+
+        db = webhook_db()
+        tasks = {task.task_id: task for task in db.query(Task).all()}
+        assert tasks["batch_1"].status == "completed"
+        assert tasks["batch_1"].result == "done"
+        assert tasks["batch_1"].progress == 50.0
+        assert tasks["batch_2"].status == "failed"
+        assert tasks["batch_2"].error_message == "RuntimeError: boom"
+        assert db.query(Project).count() == 2
+        assert db.query(Agent).count() == 1
+        db.close()
+
+    def test_batch_unknown_task(self, webhook_db):
+        """Событие для несуществующей задачи не прерывает пачку"""
+        events = [
+            {"event": "finish", "project": "batch_project", "task": "Missing", "task_id": "missing",
+             "agent": "batch_agent", "result": "done"},
+            start_event("batch_3"),
+        ]
+
+        response = client.post("/webhook/batch", json={"events": events}, headers=headers)
+        assert response.status_code == 202
+        data = response.json()
+        assert data["accepted"] == 1
+        assert data["not_found"] == 1
+        assert data["results"][0]["status"] == "not_found"
+        assert data["results"][0]["database_id"] is None
+        assert data["results"][1]["status"] == "accepted"
+
+    def test_batch_invalid_event_type(self, webhook_db):
+        """Неизвестный тип события отклоняется валидацией"""
+        events = [{"event": "unknown", "project": "p", "task": "t", "task_id": "x", "agent": "a"}]
+
+        response = client.post("/webhook/batch", json={"events": events}, headers=headers)
+        assert response.status_code == 422
+
+    def test_batch_size_limit(self, webhook_db, monkeypatch):
+        """Слишком большая пачка отклоняется"""
+        monkeypatch.setattr(settings, "WEBHOOK_BATCH_MAX_SIZE", 1)
+        events = [start_event("batch_4"), start_event("batch_5")]
+
+        response = client.post("/webhook/batch", json={"events": events}, headers=headers)
+        assert response.status_code == 413
@@ -0,0 +1,388 @@
+import os
+import tempfile
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from unittest.mock import patch
+
+from core.database import get_async_database_url
+from models.models import Base, Project, Agent, Task
+from models.schemas import WebhookStart, WebhookStatus, WebhookFinish, WebhookError
+from services.webhook_service import WebhookService
+from services.id_cache import NameIdCache, project_id_cache, agent_id_cache, warm_id_caches, clear_id_caches
+from services.progress_buffer import ProgressCoalescer
+
+# Отдельная тестовая база данных для сервиса вебхуков
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'agent_tracker_test_service.db')}"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    clear_id_caches()
+    session = TestingSessionLocal()
+
+    # WebSocket уведомления в этих тестах не нужны
+    with patch.object(WebhookService, "_notify", staticmethod(lambda coroutine: coroutine.close())):
+        yield session
+
+    session.close()
+    clear_id_caches()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def statements():
+    """Список SQL-запросов, выполненных через engine"""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest_asyncio.fixture
+async def progress_buffer():
+    """Включенный буфер прогресса с тестовой БД (сброс только вручную)"""
+    buffer = ProgressCoalescer(flush_interval=3600, max_known_tasks=100, session_factory=TestingAsyncSessionLocal)
+    await buffer.start()
+    with patch("services.webhook_service.progress_buffer", buffer):
+        yield buffer
+    await buffer.stop()
+
+
+def start(task_id, project="svc_project", agent="svc_agent"):
+    return WebhookStart(project=project, task=f"Task {task_id}", task_id=task_id, agent=agent)
+
+
+class TestNameIdCache:
+    """Тесты LRU-кэша имя -> id"""
+
+    def test_lru_eviction(self):
+        cache = NameIdCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "a" становится самым свежим
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.get_name(2) is None
+        assert cache.get_name(3) == "c"
+        assert len(cache) == 2
+
+    def test_disabled_cache(self):
+        cache = NameIdCache(maxsize=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+
+class TestWebhookServiceStart:
+    """Тесты обработки вебхука начала задачи"""
+
+    def test_start_creates_project_agent_and_task(self, db):
+        task = WebhookService(db).handle_start_webhook(start("svc_1"))
+
+        assert task.status == "running"
+        assert task.started_at is not None
+        assert db.query(Project).filter(Project.name == "svc_project").one().id == task.project_id
+        assert db.query(Agent).filter(Agent.name == "svc_agent").one().id == task.agent_id
+        assert project_id_cache.get("svc_project") == task.project_id
+        assert agent_id_cache.get("svc_agent") == task.agent_id
+
+    def test_hot_path_is_single_statement(self, db, statements):
+        """С прогретым кэшем вебхук start выполняет один запрос на задачу"""
+        WebhookService(db).handle_start_webhook(start("svc_2"))
+        statements.clear()
+
+        WebhookService(db).handle_start_webhook(start("svc_3"))
+
+        assert len(statements) == 1
+        assert statements[0].startswith("INSERT INTO tasks")
+        assert "ON CONFLICT" in statements[0]
+
+    def test_restart_updates_existing_task(self, db):
+        service = WebhookService(db)
+        first = service.handle_start_webhook(start("svc_4"))
+        task_db_id = first.id
+
+        db.query(Task).filter(Task.task_id == "svc_4").update({"status": "failed"})
+        db.commit()
+
+        restarted = service.handle_start_webhook(start("svc_4", project="svc_other"))
+
+        assert restarted.id == task_db_id
+        assert restarted.status == "running"
+        assert restarted.project_id == project_id_cache.get("svc_other")
+        assert db.query(Task).count() == 1
+
+    def test_existing_names_resolved_after_cache_miss(self, db):
+        """Имена, созданные другим процессом, дочитываются после ON CONFLICT DO NOTHING"""
+        db.add(Project(name="svc_existing"))
+        db.commit()
+        existing_id = db.query(Project.id).filter(Project.name == "svc_existing").scalar()
+
+        task = WebhookService(db).handle_start_webhook(start("svc_5", project="svc_existing"))
+
+        assert task.project_id == existing_id
+        assert db.query(Project).filter(Project.name == "svc_existing").count() == 1
+
+    def test_names_cached_only_after_commit(self, db):
+        """Созданный в незафиксированной транзакции проект не попадает в кэш"""
+        service = WebhookService(db)
+        project_id = service._resolve_id(Project, project_id_cache, "svc_pending")
+        assert project_id_cache.get("svc_pending") is None
+
+        service._commit()
+        assert project_id_cache.get("svc_pending") == project_id
+
+    def test_warm_id_caches(self, db):
+        db.add_all([Project(name="warm_p"), Agent(name="warm_a")])
+        db.commit()
+
+        warm_id_caches(db)
+
+        assert project_id_cache.get("warm_p") is not None
+        assert agent_id_cache.get("warm_a") is not None
+
+
+class TestWebhookServiceUpdates:
+    """Тесты вебхуков finish/status/error: один UPDATE ... RETURNING на событие"""
+
+    @pytest.fixture
+    def notifications(self):
+        with patch("services.webhook_service.websocket_service") as mock_websocket:
+            yield mock_websocket
+
+    def test_finish_is_single_statement(self, db, statements, notifications):
+        WebhookService(db).handle_start_webhook(start("svc_u1"))
+        statements.clear()
+
+        task = WebhookService(db).handle_finish_webhook(WebhookFinish(
+            project="svc_project", task="Task svc_u1", task_id="svc_u1", agent="svc_agent",
+            result="done", duration_seconds=5
+        ))
+
+        assert len(statements) == 1
+        assert statements[0].startswith("UPDATE tasks")
+        assert "RETURNING" in statements[0]
+        assert task.status == "completed"
+
+        payload = notifications.notify_task_finished.call_args.args[0]
+        assert payload["project"] == "svc_project"
+        assert payload["agent"] == "svc_agent"
+        assert payload["result"] == "done"
+        assert payload["duration_seconds"] == 5
+
+    def test_status_change_is_single_statement(self, db, statements, notifications):
+        WebhookService(db).handle_start_webhook(start("svc_u2"))
+        statements.clear()
+
+        WebhookService(db).handle_status_webhook(progress("svc_u2", 50, status="paused", message="waiting"))
+
+        assert len(statements) == 1
+        payload = notifications.notify_task_status_updated.call_args.args[0]
+        assert payload["status"] == "paused"
+        assert payload["progress"] == 50
+        assert payload["message"] == "waiting"
+        assert payload["agent"] == "svc_agent"
+
+    def test_unchanged_status_is_not_notified(self, db, statements, notifications):
+        WebhookService(db).handle_start_webhook(start("svc_u3"))
+        statements.clear()
+
+        task = WebhookService(db).handle_status_webhook(progress("svc_u3", 70))
+
+        assert len(statements) == 1
+        assert task.progress == 70
+        notifications.notify_task_status_updated.assert_not_called()
+
+    def test_error_is_single_statement(self, db, statements, notifications):
+        WebhookService(db).handle_start_webhook(start("svc_u4"))
+        statements.clear()
+
+        task = WebhookService(db).handle_error_webhook(WebhookError(
+            project="svc_project", task="Task svc_u4", task_id="svc_u4", agent="svc_agent",
+            error_type="ValueError", error_message="boom"
+        ))
+
+        assert len(statements) == 1
+        assert task.error_message == "ValueError: boom"
+        payload = notifications.notify_task_error.call_args.args[0]
+        assert payload["error_type"] == "ValueError"
+        assert payload["project"] == "svc_project"
+
+    def test_missing_task_returns_none(self, db, notifications):
+        service = WebhookService(db)
+        finish = WebhookFinish(project="p", task="t", task_id="svc_missing", agent="a")
+
+        assert service.handle_finish_webhook(finish) is None
+        assert service.handle_status_webhook(progress("svc_missing", 10)) is None
+        notifications.notify_task_finished.assert_not_called()
+
+
+def progress(task_id, value, status="running", message=None):
+    return WebhookStatus(
+        project="svc_project", task=f"Task {task_id}", task_id=task_id, agent="svc_agent",
+        status=status, progress=value, message=message, metadata={"step": value}
+    )
+
+
+class TestProgressCoalescing:
+    """Тесты слияния обновлений прогресса"""
+
+    @pytest.mark.asyncio
+    async def test_progress_updates_are_buffered(self, db, statements, progress_buffer):
+        """Обновления без смены статуса не пишутся в БД до сброса"""
+        service = WebhookService(db)
+        task_db_id = service.handle_start_webhook(start("svc_p1")).id
+        statements.clear()
+
+        for value in (10, 20, 30):
+            state = service.handle_status_webhook(progress("svc_p1", value, message=f"step {value}"))
+            assert state.id == task_db_id
+            assert state.progress == value
+
+        # Статус известен по записи start: ни записи, ни чтения БД
+        assert statements == []
+        assert progress_buffer.get_stats()["pending"] == 1
+        assert progress_buffer.get_stats()["status_hits"] == 3
+
+        assert await progress_buffer.flush() == 1
+        db.expire_all()
+        task = db.query(Task).filter(Task.task_id == "svc_p1").one()
+        assert task.progress == 30
+        assert task.description == "step 30"
+        assert task.task_metadata == {"step": 30}
+
+    @pytest.mark.asyncio
+    async def test_status_change_is_written_immediately(self, db, progress_buffer):
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_p2"))
+
+        task = service.handle_status_webhook(progress("svc_p2", 50, status="paused"))
+
+        assert isinstance(task, Task)
+        db.expire_all()
+        assert db.query(Task.status).filter(Task.task_id == "svc_p2").scalar() == "paused"
+        assert progress_buffer.get_stats()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_finish_discards_pending_progress(self, db, progress_buffer):
+        """Отложенный прогресс не перезаписывает завершённую задачу"""
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_p3"))
+        service.handle_status_webhook(progress("svc_p3", 40))
+        service.handle_finish_webhook(WebhookFinish(
+            project="svc_project", task="Task svc_p3", task_id="svc_p3", agent="svc_agent", result="ok"
+        ))
+
+        assert await progress_buffer.flush() == 0
+        db.expire_all()
+        task = db.query(Task).filter(Task.task_id == "svc_p3").one()
+        assert task.status == "completed"
+        assert task.progress != 40
+
+    @pytest.mark.asyncio
+    async def test_flush_skips_tasks_with_changed_status(self, db, progress_buffer):
+        """Если статус изменил другой процесс, отложенное обновление не применяется"""
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_p4"))
+        service.handle_status_webhook(progress("svc_p4", 60))
+
+        db.query(Task).filter(Task.task_id == "svc_p4").update({"status": "failed", "progress": 5})
+        db.commit()
+
+        assert await progress_buffer.flush() == 0
+        assert progress_buffer.get_stats()["superseded"] == 1
+        db.expire_all()
+        assert db.query(Task.progress).filter(Task.task_id == "svc_p4").scalar() == 5
+
+    @pytest.mark.asyncio
+    async def test_flush_refreshes_cached_status(self, db, progress_buffer):
+        """Статус, прочитанный при сбросе, исправляет кэш: следующая смена статуса пишется сразу"""
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_p7"))
+        service.handle_status_webhook(progress("svc_p7", 20))
+
+        db.query(Task).filter(Task.task_id == "svc_p7").update({"status": "paused"})
+        db.commit()
+        assert await progress_buffer.flush() == 0
+
+        with patch("services.webhook_service.websocket_service") as notifications:
+            task = service.handle_status_webhook(progress("svc_p7", 30))
+
+        assert isinstance(task, Task)
+        notifications.notify_task_status_updated.assert_called_once()
+        db.expire_all()
+        assert db.query(Task.status, Task.progress).filter(Task.task_id == "svc_p7").one() == ("running", 30)
+
+    @pytest.mark.asyncio
+    async def test_status_changed_elsewhere_is_not_buffered(self, db, progress_buffer, statements):
+        """Статус без свежего подтверждения сверяется с БД: возврат в running пишется сразу"""
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_p5"))
+
+        db.query(Task).filter(Task.task_id == "svc_p5").update({"status": "pending"})
+        db.commit()
+        # Запись кэша устарела
+        progress_buffer.status_ttl = -1
+        statements.clear()
+
+        with patch("services.webhook_service.websocket_service") as notifications:
+            task = service.handle_status_webhook(progress("svc_p5", 80))
+
+        assert isinstance(task, Task)
+        assert statements[0].startswith("SELECT")
+        assert progress_buffer.get_stats()["pending"] == 0
+        notifications.notify_task_status_updated.assert_called_once()
+        db.expire_all()
+        assert db.query(Task.status, Task.progress).filter(Task.task_id == "svc_p5").one() == ("running", 80)
+
+    @pytest.mark.asyncio
+    async def test_tasks_of_other_workers_are_buffered(self, db, progress_buffer):
+        """Задача, запущенная другим воркером, буферизуется по статусу из БД"""
+        WebhookService(db).handle_start_webhook(start("svc_p6"))
+        progress_buffer.forget("svc_p6")
+
+        state = WebhookService(db).handle_status_webhook(progress("svc_p6", 15))
+
+        assert state.progress == 15
+        assert await progress_buffer.flush() == 1
+        db.expire_all()
+        assert db.query(Task.progress).filter(Task.task_id == "svc_p6").scalar() == 15
+
+
+class TestSnapshotTasks:
+    """Тесты снимка выполняющихся задач для переподключившихся WebSocket клиентов"""
+
+    @pytest.mark.asyncio
+    async def test_snapshot_includes_buffered_progress(self, db, progress_buffer):
+        service = WebhookService(db)
+        service.handle_start_webhook(start("svc_s1"))
+        service.handle_start_webhook(start("svc_s2", project="svc_other"))
+        service.handle_start_webhook(start("svc_s3"))
+        service.handle_finish_webhook(WebhookFinish(
+            project="svc_project", task="Task svc_s3", task_id="svc_s3", agent="svc_agent"
+        ))
+        service.handle_status_webhook(progress("svc_s1", 45, message="halfway"))
+
+        tasks = service.snapshot_tasks("svc_project")
+
+        assert [task["task_id"] for task in tasks] == ["svc_s1"]
+        assert tasks[0]["progress"] == 45
+        assert tasks[0]["message"] == "halfway"
+        assert tasks[0]["agent"] == "svc_agent"
+        assert {task["task_id"] for task in service.snapshot_tasks()} == {"svc_s1", "svc_s2"}
@@ -1,18 +1,27 @@
+import asyncio
+
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from unittest.mock import patch
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from main import app
-from core.database import get_db
+from core.database import get_db, get_async_db, get_async_database_url
 from core.config import settings
 from models.models import Base
+from services.websocket_service import WebSocketService, ClientConnection, coalesce_key
 
 # Создаем тестовую базу данных
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base.metadata.create_all(bind=engine)
 
@@ -23,13 +32,34 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
 # Заголовок с API ключом для тестов
 headers = {"X-API-Key": settings.API_KEY}
 
+
+@pytest_asyncio.fixture
+async def make_service():
+    """Фабрика сервисов рассылки: после теста отключает клиентов и дожидается писателей"""
+    services = []
+
+    def make(**kwargs):
+        service = WebSocketService(**kwargs)
+        services.append(service)
+        return service
+
+    yield make
+    for service in services:
+        await service.close()
+
+
 class TestWebSocketAPI:
     """Тесты для WebSocket API"""
 
@@ -57,4 +87,575 @@ class TestWebSocketAPI:
         """Проверка health check"""
         response = client.get("/health")
         assert response.status_code == 200
-        assert response.json() == {"status": "healthy"}
\ No newline at end of file
+        assert response.json() == {"status": "healthy"}
+
+
+def fake_socket():
+    websocket = MagicMock()
+    websocket.accept = AsyncMock()
+    websocket.send_text = AsyncMock()
+    return websocket
+
+
+async def settle():
+    """Дать задачам-писателям отправить сообщения из очередей"""
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def idle_get_message(**kwargs):
+    """get_message без новых сообщений: ждёт, как настоящий Redis"""
+    await asyncio.sleep(0.01)
+    return None
+
+
+class TestRedisBroadcast:
+    """Тесты рассылки уведомлений между воркерами через Redis pub/sub"""
+
+    @pytest.fixture
+    def redis(self):
+        with patch("services.websocket_service.redis_client") as mock_redis:
+            mock_redis.redis.publish = AsyncMock(return_value=1)
+            pubsub = MagicMock()
+            pubsub.subscribe = AsyncMock()
+            pubsub.psubscribe = AsyncMock()
+            pubsub.get_message = AsyncMock(side_effect=idle_get_message)
+            pubsub.aclose = AsyncMock()
+            mock_redis.redis.pubsub.return_value = pubsub
+            yield mock_redis
+
+    @pytest.mark.asyncio
+    async def test_notification_is_published_not_sent_locally(self, make_service, redis):
+        """Номер, запись в журнал и публикация выполняются одним скриптом"""
+        redis.run_script = AsyncMock(return_value=7)
+        service = make_service(broadcast_backend="redis")
+        websocket = fake_socket()
+        await service.connect(websocket, "proj")
+        websocket.send_text.reset_mock()
+
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+        await settle()
+
+        keys = redis.run_script.call_args.kwargs["keys"]
+        prefix, _, project, channel = redis.run_script.call_args.kwargs["args"]
+        assert keys == ["ws:events:seq", "ws:events:log"]
+        assert (project, channel) == ("proj", "ws:events:project:proj")
+        message = json.loads(f"{prefix}7}}")
+        assert (message["type"], message["seq"]) == ("task_started", 7)
+        redis.redis.publish.assert_not_called()
+        websocket.send_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_resume_reads_missed_events_from_stream(self, make_service, redis):
+        redis.get = AsyncMock(return_value="12")
+        redis.xrange = AsyncMock(return_value=[
+            ("11-0", {"project": "proj", "message": '{"type": "task_started", "seq": 11}'}),
+            ("12-0", {"project": "other", "message": '{"type": "task_started", "seq": 12}'}),
+        ])
+        service = make_service(broadcast_backend="redis")
+
+        assert await service.event_log.since(10, "proj") == ['{"type": "task_started", "seq": 11}']
+        assert redis.xrange.call_args.kwargs["min"] == "11-0"
+        # Записи после seq уже вытеснены из stream
+        assert await service.event_log.since(5, "proj") is None
+        assert await service.event_log.since(12) == []
+
+    @pytest.mark.asyncio
+    async def test_received_messages_are_delivered_locally(self, make_service, redis):
+        service = make_service(broadcast_backend="redis")
+        project_socket, other_socket = fake_socket(), fake_socket()
+        await service.connect(project_socket, "proj")
+        await service.connect(other_socket, "other")
+        project_socket.send_text.reset_mock()
+        other_socket.send_text.reset_mock()
+
+        event = b'{"type": "task_started", "data": {"project": "proj", "task_id": "t1"}}'
+        await service.broadcast.handle_message(b"ws:events:project:proj", event)
+        await settle()
+        project_socket.send_text.assert_awaited_once_with(event.decode())
+        other_socket.send_text.assert_not_called()
+
+        await service.broadcast.handle_message(b"ws:events:all", b'{"type": "task_error"}')
+        await settle()
+        assert other_socket.send_text.await_count == 1
+        assert project_socket.send_text.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_listener_subscribes_to_all_channels(self, make_service, redis):
+        service = make_service(broadcast_backend="redis")
+        await service.start_broadcast()
+        pubsub = redis.redis.pubsub.return_value
+
+        pubsub.subscribe.assert_awaited_once_with("ws:events:all")
+        pubsub.psubscribe.assert_awaited_once_with("ws:events:project:*")
+
+        await service.stop_broadcast()
+        pubsub.aclose.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_publish_failure_falls_back_to_local_delivery(self, make_service, redis):
+        redis.redis.publish.side_effect = ConnectionError("redis down")
+        service = make_service(broadcast_backend="redis")
+        websocket = fake_socket()
+        await service.connect(websocket)
+        websocket.send_text.reset_mock()
+
+        await service.broadcast_to_all({"type": "task_finished"})
+        await settle()
+
+        websocket.send_text.assert_awaited_once()
+        assert service.get_connection_stats()["broadcast"]["publish_errors"] == 1
+
+
+class TestWebSocketBroadcast:
+    """Тесты локальной рассылки уведомлений"""
+
+    @pytest.mark.asyncio
+    async def test_event_is_delivered_once_per_socket(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        dashboard, subscriber, other = fake_socket(), fake_socket(), fake_socket()
+        await service.connect(dashboard)
+        await service.connect(subscriber, "proj")
+        await service.connect(other, "other")
+        for websocket in (dashboard, subscriber, other):
+            websocket.send_text.reset_mock()
+
+        with patch("services.websocket_service.json.dumps", wraps=json.dumps) as dumps:
+            await service.notify_task_finished({"project": "proj", "task_id": "t1"})
+        await settle()
+
+        assert dumps.call_count == 1
+        dashboard.send_text.assert_awaited_once()
+        subscriber.send_text.assert_awaited_once()
+        other.send_text.assert_not_called()
+        assert dashboard.send_text.call_args.args[0] == subscriber.send_text.call_args.args[0]
+
+    @pytest.mark.asyncio
+    async def test_slow_client_is_evicted_without_delaying_others(self, make_service):
+        service = make_service(broadcast_backend="memory", send_timeout=0.05)
+        fast, slow = fake_socket(), fake_socket()
+        await service.connect(fast)
+        await service.connect(slow, "proj")
+        slow.close = AsyncMock()
+
+        async def stalled_send(text):
+            await asyncio.sleep(10)
+
+        slow.send_text = AsyncMock(side_effect=stalled_send)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+        await settle()
+        assert loop.time() - started < 1
+        assert fast.send_text.await_count == 2  # приветствие и событие
+
+        await asyncio.sleep(0.1)
+
+        assert slow not in service.active_connections
+        assert "proj" not in service.project_connections
+        slow.close.assert_awaited_once_with(code=1013)
+        assert service.get_connection_stats()["evicted_slow_clients"] == 1
+
+
+def status_message(task_id, progress):
+    return {"type": "task_status_updated", "data": {"project": "proj", "task_id": task_id, "progress": progress}}
+
+
+class TestOutboundQueue:
+    """Тесты ограниченной очереди исходящих сообщений клиента"""
+
+    @pytest.mark.asyncio
+    async def test_progress_updates_are_coalesced_by_task(self):
+        client = ClientConnection(fake_socket(), "proj", max_queue=10, max_lag=30)
+        for progress in (10, 20):
+            message = status_message("t1", progress)
+            assert client.put(json.dumps(message), coalesce_key(message))
+        assert client.put(json.dumps({"type": "task_started"}))
+        message = status_message("t1", 30)
+        assert client.put(json.dumps(message), coalesce_key(message))
+
+        # Последнее обновление заменяет предыдущие и встаёт после task_started
+        assert json.loads(await client.next_message())["type"] == "task_started"
+        assert json.loads(await client.next_message())["data"]["progress"] == 30
+        assert client.get_stats()["coalesced"] == 2
+        assert client.get_stats()["queue_depth"] == 0
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_oldest_progress(self):
+        client = ClientConnection(fake_socket(), "proj", max_queue=2, max_lag=30)
+        first = status_message("t1", 10)
+        assert client.put(json.dumps(first), coalesce_key(first))
+        assert client.put(json.dumps({"type": "task_started"}))
+        assert client.put(json.dumps({"type": "task_finished"}))
+
+        assert [json.loads(await client.next_message())["type"] for _ in range(2)] == [
+            "task_started", "task_finished"
+        ]
+        assert client.get_stats()["dropped"] == 1
+
+    @pytest.mark.asyncio
+    async def test_client_without_droppable_messages_is_evicted(self, make_service):
+        service = make_service(broadcast_backend="memory", max_queue=2)
+        websocket = fake_socket()
+        websocket.close = AsyncMock()
+
+        async def stalled_send(text):
+            await asyncio.sleep(10)
+
+        await service.connect(websocket, "proj")
+        websocket.send_text = AsyncMock(side_effect=stalled_send)
+
+        # Первое событие забирает писатель, два следующих заполняют очередь
+        for task_id in ("t1", "t2", "t3", "t4"):
+            await service.notify_task_started({"project": "proj", "task_id": task_id})
+            await settle()
+
+        assert websocket not in service.active_connections
+        websocket.close.assert_awaited_once_with(code=1013)
+        assert service.get_connection_stats()["evicted_slow_clients"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lagging_client_is_disconnected(self):
+        client = ClientConnection(fake_socket(), "proj", max_queue=10, max_lag=0.01)
+        assert client.put(json.dumps({"type": "task_started"}))
+        await asyncio.sleep(0.02)
+
+        assert not client.put(json.dumps({"type": "task_finished"}))
+
+    @pytest.mark.asyncio
+    async def test_connection_stats_include_queues(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        websocket = fake_socket()
+        await service.connect(websocket, "proj")
+        await service.notify_task_status_updated({"project": "proj", "task_id": "t1", "progress": 5})
+        await settle()
+
+        stats = service.get_connection_stats()
+        assert (stats["queued_messages"], stats["max_queue_depth"], stats["max_lag_seconds"]) == (0, 0, 0.0)
+        assert "connections" not in stats
+        [connection] = service.get_connection_stats(connections=True)["connections"]
+        assert connection["age_seconds"] >= connection["idle_seconds"] >= 0
+        assert connection.pop("id") > 0
+        del connection["age_seconds"], connection["idle_seconds"]
+        assert connection == {
+            "project": "proj", "queue_depth": 0, "sent": 1, "frames": 1, "batch_ms": 0,
+            "dropped": 0, "coalesced": 0, "lag_seconds": 0.0,
+            "filters": {"projects": ["proj"]}
+        }
+
+
+    @pytest.mark.asyncio
+    async def test_connection_list_is_paged(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        for index in range(5):
+            await service.connect(fake_socket(), f"proj{index}")
+
+        page = service.get_connection_stats(connections=True, limit=2, offset=3)["connections"]
+        assert [connection["project"] for connection in page] == ["proj3", "proj4"]
+
+    def test_stats_endpoint_connections_are_opt_in(self):
+        with patch("api.routes.websocket_service") as mock_service:
+            mock_service.get_connection_stats.return_value = {"total_connections": 0}
+
+            assert client.get("/api/websocket/stats", headers=headers).status_code == 200
+            mock_service.get_connection_stats.assert_called_with(False, 100, 0)
+
+            client.get("/api/websocket/stats", params={"connections": "true", "limit": 10, "offset": 20},
+                       headers=headers)
+            mock_service.get_connection_stats.assert_called_with(True, 10, 20)
+
+            assert client.get("/api/websocket/stats", params={"limit": 5000}, headers=headers).status_code == 422
+
+
+class TestEventReplay:
+    """Тесты номеров событий и повтора пропущенных событий при переподключении"""
+
+    @pytest.mark.asyncio
+    async def test_events_carry_increasing_seq(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        websocket = fake_socket()
+        await service.connect(websocket, "proj")
+
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+        await service.notify_task_finished({"project": "proj", "task_id": "t1"})
+        await settle()
+
+        messages = [json.loads(call.args[0]) for call in websocket.send_text.call_args_list]
+        assert messages[0]["type"] == "connection"
+        assert messages[0]["seq"] == 0
+        assert [(message["type"], message["seq"]) for message in messages[1:]] == [
+            ("task_started", 1), ("task_finished", 2)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_reconnect_replays_missed_project_events(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        for task_id, project in (("t1", "proj"), ("t2", "other"), ("t3", "proj")):
+            await service.notify_task_started({"project": project, "task_id": task_id})
+
+        websocket = fake_socket()
+        snapshot = AsyncMock()
+        await service.connect(websocket, "proj", since=1, snapshot=snapshot)
+        await settle()
+
+        replayed = [json.loads(call.args[0]) for call in websocket.send_text.call_args_list[1:]]
+        assert [(message["data"]["task_id"], message["seq"]) for message in replayed] == [("t3", 3)]
+        snapshot.assert_not_called()
+        assert service.get_connection_stats()["replayed_events"] == 1
+
+    @pytest.mark.asyncio
+    async def test_events_during_replay_are_sent_once_in_order(self, make_service, monkeypatch):
+        """Событие, пришедшее во время чтения журнала, не обгоняет повтор и не дублируется"""
+        service = make_service(broadcast_backend="memory")
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+        read_log = service.event_log.since
+
+        async def since(seq, project=None):
+            # Как у журнала в Redis: событие публикуется, пока идёт чтение, и попадает в результат
+            await service.notify_task_finished({"project": "proj", "task_id": "t1"})
+            await settle()
+            return await read_log(seq, project)
+
+        monkeypatch.setattr(service.event_log, "since", since)
+        websocket = fake_socket()
+        await service.connect(websocket, "proj", since=0)
+        await settle()
+
+        messages = [json.loads(call.args[0]) for call in websocket.send_text.call_args_list[1:]]
+        assert [(message["type"], message["seq"]) for message in messages] == [
+            ("task_started", 1), ("task_finished", 2)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_old_gap_falls_back_to_snapshot(self, make_service, monkeypatch):
+        monkeypatch.setattr(settings, "WEBSOCKET_REPLAY_SIZE", 2)
+        service = make_service(broadcast_backend="memory")
+        for task_id in ("t1", "t2", "t3"):
+            await service.notify_task_started({"project": "proj", "task_id": task_id})
+
+        websocket = fake_socket()
+        snapshot = AsyncMock(return_value=[{"task_id": "t3", "status": "running"}])
+        await service.connect(websocket, "proj", since=0, snapshot=snapshot)
+        # Событие во время подключения приходит после снимка
+        await service.notify_task_finished({"project": "proj", "task_id": "t3"})
+        await settle()
+
+        snapshot.assert_awaited_once_with("proj")
+        messages = [json.loads(call.args[0]) for call in websocket.send_text.call_args_list[1:]]
+        assert (messages[0]["type"], messages[0]["seq"]) == ("snapshot", 3)
+        assert messages[0]["data"]["tasks"] == [{"task_id": "t3", "status": "running"}]
+        assert (messages[1]["type"], messages[1]["seq"]) == ("task_finished", 4)
+
+    def test_websocket_does_not_hold_db_session(self):
+        """Подключение без снимка не открывает сессию БД (и не держит соединение из пула)"""
+        with patch("webhook.websocket_routes.AsyncSessionLocal") as session_factory, \
+                client.websocket_connect(f"/webhook/ws?api_key={settings.API_KEY}&project=ws_pool") as ws:
+            assert ws.receive_json()["type"] == "connection"
+            ws.send_text("ping")
+            assert ws.receive_json()["type"] == "pong"
+        session_factory.assert_not_called()
+
+    def test_websocket_resume_from_unknown_seq_sends_snapshot(self):
+        """Номер из будущего (например, после перезапуска сервера) заменяется снимком"""
+        with patch("webhook.websocket_routes.AsyncSessionLocal", TestingAsyncSessionLocal), \
+                client.websocket_connect(f"/webhook/ws?api_key={settings.API_KEY}&project=ws_snapshot&since=999999") as ws:
+            assert ws.receive_json()["type"] == "connection"
+            snapshot = ws.receive_json()
+            assert snapshot["type"] == "snapshot"
+            assert snapshot["data"] == {"project": "ws_snapshot", "tasks": []}
+
+
+class TestSubscriptions:
+    """Тесты подписок по проекту, агенту, задаче и типу события"""
+
+    @staticmethod
+    async def connect(service, project=None):
+        websocket = fake_socket()
+        await service.connect(websocket, project)
+        websocket.send_text.reset_mock()
+        return websocket
+
+    @staticmethod
+    def received(websocket):
+        return [json.loads(call.args[0])["data"]["task_id"] for call in websocket.send_text.call_args_list]
+
+    @pytest.mark.asyncio
+    async def test_events_are_routed_by_filters(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        dashboard = await self.connect(service)
+        task_watcher = await self.connect(service)
+        errors_only = await self.connect(service, "proj")
+        agent_watcher = await self.connect(service)
+        service.update_subscription(task_watcher, "subscribe", {"task_ids": ["t2"]})
+        service.update_subscription(errors_only, "subscribe", {"events": "task_error"})
+        service.update_subscription(agent_watcher, "subscribe", {"agents": ["a2"], "projects": ["other"]})
+
+        await service.notify_task_started({"project": "proj", "agent": "a1", "task_id": "t1"})
+        await service.notify_task_error({"project": "proj", "agent": "a2", "task_id": "t2"})
+        await service.notify_task_error({"project": "other", "agent": "a2", "task_id": "t3"})
+        await settle()
+
+        assert self.received(dashboard) == ["t1", "t2", "t3"]
+        assert self.received(task_watcher) == ["t2"]
+        assert self.received(errors_only) == ["t2"]
+        assert self.received(agent_watcher) == ["t3"]
+
+    @pytest.mark.asyncio
+    async def test_clients_are_indexed_by_most_selective_filter(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        websocket = await self.connect(service, "proj")
+        client = service.clients[websocket]
+        assert service.project_connections == {"proj": {client}}
+
+        service.update_subscription(websocket, "subscribe", {"task_ids": ["t1", "t2"]})
+        assert service.subscriptions["task_ids"] == {"t1": {client}, "t2": {client}}
+        assert service.project_connections == {}
+
+        # Событие другого проекта не проверяется для клиента, индексированного по задаче
+        with patch.object(ClientConnection, "matches", wraps=client.matches) as matches:
+            await service.notify_task_started({"project": "proj", "task_id": "t9"})
+        matches.assert_not_called()
+
+        filters = service.update_subscription(websocket, "unsubscribe", {})
+        assert filters == {"task_ids": [], "agents": [], "projects": [], "events": []}
+        assert service.global_connections == {client}
+
+    @pytest.mark.asyncio
+    async def test_registry_is_compact_and_does_not_leak(self, make_service):
+        service = make_service(broadcast_backend="memory", writer_linger=0)
+        for index in range(50):
+            websocket = await self.connect(service, f"proj-{index % 3}")
+            client = service.clients[websocket]
+            # Без исходящих сообщений у клиента нет задачи-писателя и пустых фильтров
+            assert client.writer is None
+            assert not hasattr(client, "__dict__")
+            service.update_subscription(websocket, "subscribe", {"task_ids": [f"t{index}"], "agents": ["a1"]})
+            service.update_subscription(websocket, "unsubscribe", {"agents": ["a1"]})
+            assert set(client.filters) == {"projects", "task_ids"}
+
+            await service.notify_task_started({"project": f"proj-{index % 3}", "task_id": f"t{index}"})
+            assert client.writer is not None
+            await settle()
+            assert client.writer is None
+            service.disconnect(websocket)
+
+        assert service.clients == {}
+        assert service.global_connections == set()
+        assert all(not index for index in service.subscriptions.values())
+
+    @pytest.mark.asyncio
+    async def test_invalid_subscription_is_rejected(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        websocket = await self.connect(service)
+
+        with pytest.raises(ValueError):
+            service.update_subscription(websocket, "subscribe", {"users": ["x"]})
+        with pytest.raises(ValueError):
+            service.update_subscription(websocket, "subscribe", {"task_ids": [1]})
+        with pytest.raises(ValueError):
+            service.update_subscription(websocket, "mute", {})
+        assert service.global_connections == {service.clients[websocket]}
+
+    def test_control_messages_over_websocket(self):
+        with client.websocket_connect(f"/webhook/ws?api_key={settings.API_KEY}") as ws:
+            assert ws.receive_json()["type"] == "connection"
+
+            ws.send_text(json.dumps({"action": "subscribe", "task_ids": ["t1"], "events": ["task_error"]}))
+            reply = ws.receive_json()
+            assert reply["type"] == "subscription"
+            assert reply["filters"]["task_ids"] == ["t1"]
+            assert reply["filters"]["events"] == ["task_error"]
+
+            ws.send_text(json.dumps({"action": "subscribe", "users": ["x"]}))
+            assert ws.receive_json()["type"] == "error"
+
+            ws.send_text("ping")
+            assert ws.receive_json()["type"] == "pong"
+
+
+class TestEventBatching:
+    """Тесты пакетной отправки событий за временное окно"""
+
+    @pytest.mark.asyncio
+    async def test_window_is_sent_as_one_array_frame(self, make_service):
+        service = make_service(broadcast_backend="memory")
+        websocket = fake_socket()
+        await service.connect(websocket, "proj", batch_ms=50)
+        assert json.loads(websocket.send_text.call_args.args[0])["batch_ms"] == 50
+        websocket.send_text.reset_mock()
+
+        await service.notify_task_started({"project": "proj", "task_id": "t1"})
+        for progress in (10, 20, 30):
+            await service.notify_task_status_updated({"project": "proj", "task_id": "t1", "progress": progress})
+        await settle()
+        websocket.send_text.assert_not_called()
+
+        await asyncio.sleep(0.1)
+
+        websocket.send_text.assert_awaited_once()
+        frame = json.loads(websocket.send_text.call_args.args[0])
+        assert [message["type"] for message in frame] == ["task_started", "task_status_updated"]
+        assert frame[1]["data"]["progress"] == 30
+        stats = service.get_connection_stats(connections=True)["connections"][0]
+        assert (stats["sent"], stats["frames"], stats["coalesced"]) == (2, 1, 2)
+        assert service.get_connection_stats()["coalesced_messages"] == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_window_is_capped(self, make_service, monkeypatch):
+        monkeypatch.setattr(settings, "WEBSOCKET_MAX_BATCH_MS", 200)
+        service = make_service(broadcast_backend="memory")
+        websocket = fake_socket()
+        await service.connect(websocket, batch_ms=5000)
+
+        assert service.clients[websocket].batch_window == 0.2
+
+
+class TestHeartbeat:
+    """Тесты ping от сервера и закрытия не отвечающих соединений"""
+
+    @pytest.mark.asyncio
+    async def test_idle_sockets_are_reaped_and_live_ones_pinged(self, make_service):
+        service = make_service(broadcast_backend="memory", idle_timeout=0.05)
+        idle, active = fake_socket(), fake_socket()
+        idle.close = AsyncMock()
+        await service.connect(idle)
+        await service.connect(active)
+        sse_client = await service.open_stream()
+        await asyncio.sleep(0.1)
+        service.touch(active)
+        active.send_text.reset_mock()
+
+        assert service.heartbeat() == 1
+        await settle()
+
+        assert idle not in service.active_connections
+        idle.close.assert_awaited_once_with(code=1001)
+        assert json.loads(active.send_text.call_args.args[0])["type"] == "ping"
+        assert sse_client.key in service.active_connections
+        stats = service.get_connection_stats()
+        assert stats["reaped_idle_clients"] == 1
+        assert stats["oldest_connection_seconds"] >= 0.1
+
+    @pytest.mark.asyncio
+    async def test_heartbeat_task_lifecycle(self, make_service):
+        service = make_service(broadcast_backend="memory", ping_interval=0.01, idle_timeout=60)
+        websocket = fake_socket()
+        await service.connect(websocket)
+        websocket.send_text.reset_mock()
+
+        await service.start_heartbeat()
+        assert service.get_connection_stats()["heartbeat"]["running"]
+        await asyncio.sleep(0.05)
+        await service.stop_heartbeat()
+
+        assert json.loads(websocket.send_text.call_args.args[0])["type"] == "ping"
+        assert not service.get_connection_stats()["heartbeat"]["running"]
+
+    def test_pong_is_not_answered(self):
+        with client.websocket_connect(f"/webhook/ws?api_key={settings.API_KEY}") as ws:
+            assert ws.receive_json()["type"] == "connection"
+            ws.send_text(json.dumps({"action": "pong"}))
+            ws.send_text("ping")
+            # Первый ответ - pong на ping, на pong клиента сервер не отвечает
+            assert ws.receive_json()["type"] == "pong"
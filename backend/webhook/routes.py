@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
-from typing import Dict, Any
-from sqlalchemy.orm import Session
+from typing import Dict, Any, Optional, Callable, Awaitable, AsyncIterator
+import json
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models.schemas import WebhookStart, WebhookFinish, WebhookStatus, WebhookError
+from models.schemas import WebhookStart, WebhookFinish, WebhookStatus, WebhookError, WebhookBatchRequest, WebhookBatchResponse
 from core.config import settings
 from core.security import get_api_key
-from core.database import get_db
-from services.webhook_service import WebhookService
+from core.database import get_async_db
+from services.webhook_service import AsyncWebhookService
+from services.ingest_service import ingest_service
+from services.import_service import import_service
+from services.progress_buffer import progress_buffer
+from services.idempotency_service import idempotency_service, IdempotencyConflict
 # from services.websocket_service import websocket_service  # Временно отключен
 
 webhook_router = APIRouter()
@@ -15,19 +21,82 @@ webhook_router = APIRouter()
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 
+async def _idempotent(
+    event: str,
+    data,
+    idempotency_key: Optional[str],
+    response: Response,
+    process: Callable[[], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Обработать вебхук один раз: повтор с тем же ключом получает сохранённый ответ"""
+    key = idempotency_service.make_key(event, data, idempotency_key)
+    try:
+        cached = await idempotency_service.begin(key)
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Request with the same idempotency key is being processed"
+        )
+
+    if cached is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return cached
+
+    try:
+        result = await process()
+    except BaseException:
+        await idempotency_service.release(key)
+        raise
+
+    await idempotency_service.complete(key, result)
+    return result
+
+
+def _stream_mode() -> bool:
+    return settings.WEBHOOK_INGEST_MODE == "stream"
+
+
+async def _enqueue(event: str, data) -> Dict[str, Any]:
+    """Поставить событие в Redis stream вместо записи в БД"""
+    try:
+        stream_id = await ingest_service.enqueue(event, data)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to enqueue webhook: {str(e)}"
+        )
+
+    return {
+        "status": "queued",
+        "message": "Event queued for processing",
+        "task_id": data.task_id,
+        "project": data.project,
+        "stream_id": stream_id
+    }
+
+
 @webhook_router.post("/start", status_code=status.HTTP_202_ACCEPTED)
 async def webhook_start(
     data: WebhookStart,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """
     Принимает вебхук о начале выполнения задачи
     """
-    webhook_service = WebhookService(db)
+    return await _idempotent("start", data, idempotency_key, response, lambda: _process_start(data, db))
+
+
+async def _process_start(data: WebhookStart, db: AsyncSession) -> Dict[str, Any]:
+    if _stream_mode():
+        return await _enqueue("start", data)
+
+    webhook_service = AsyncWebhookService(db)
 
     try:
-        task = webhook_service.handle_start_webhook(data)
+        task = await webhook_service.handle_start_webhook(data)
 
         # TODO: Отправить WebSocket уведомление (временно отключено)
         # await websocket_service.notify_task_started({
@@ -59,16 +128,25 @@ async def webhook_start(
 @webhook_router.post("/finish", status_code=status.HTTP_202_ACCEPTED)
 async def webhook_finish(
     data: WebhookFinish,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """
     Принимает вебхук о завершении задачи
     """
-    webhook_service = WebhookService(db)
+    return await _idempotent("finish", data, idempotency_key, response, lambda: _process_finish(data, db))
+
+
+async def _process_finish(data: WebhookFinish, db: AsyncSession) -> Dict[str, Any]:
+    if _stream_mode():
+        return await _enqueue("finish", data)
+
+    webhook_service = AsyncWebhookService(db)
 
     try:
-        task = webhook_service.handle_finish_webhook(data)
+        task = await webhook_service.handle_finish_webhook(data)
 
         if not task:
             raise HTTPException(
@@ -111,16 +189,25 @@ async def webhook_finish(
 @webhook_router.post("/status", status_code=status.HTTP_202_ACCEPTED)
 async def webhook_status(
     data: WebhookStatus,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """
     Принимает вебхук о статусе задачи
     """
-    webhook_service = WebhookService(db)
+    return await _idempotent("status", data, idempotency_key, response, lambda: _process_status(data, db))
+
+
+async def _process_status(data: WebhookStatus, db: AsyncSession) -> Dict[str, Any]:
+    if _stream_mode():
+        return await _enqueue("status", data)
+
+    webhook_service = AsyncWebhookService(db)
 
     try:
-        task = webhook_service.handle_status_webhook(data)
+        task = await webhook_service.handle_status_webhook(data)
 
         if not task:
             raise HTTPException(
@@ -162,16 +249,25 @@ async def webhook_status(
 @webhook_router.post("/error", status_code=status.HTTP_202_ACCEPTED)
 async def webhook_error(
     data: WebhookError,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """
     Принимает вебхук об ошибке
     """
-    webhook_service = WebhookService(db)
+    return await _idempotent("error", data, idempotency_key, response, lambda: _process_error(data, db))
+
+
+async def _process_error(data: WebhookError, db: AsyncSession) -> Dict[str, Any]:
+    if _stream_mode():
+        return await _enqueue("error", data)
+
+    webhook_service = AsyncWebhookService(db)
 
     try:
-        task = webhook_service.handle_error_webhook(data)
+        task = await webhook_service.handle_error_webhook(data)
 
         if not task:
             raise HTTPException(
@@ -208,4 +304,143 @@ async def webhook_error(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process webhook: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+@webhook_router.post("/batch", status_code=status.HTTP_202_ACCEPTED, response_model=WebhookBatchResponse)
+async def webhook_batch(
+    data: WebhookBatchRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db)
+) -> Dict[str, Any]:
+    """
+    Принимает пачку вебхуков start/status/finish/error и применяет их в одной транзакции
+    """
+    if len(data.events) > settings.WEBHOOK_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch size exceeds limit of {settings.WEBHOOK_BATCH_MAX_SIZE} events"
+        )
+
+    return await _idempotent("batch", data, idempotency_key, response, lambda: _process_batch(data, db))
+
+
+async def _process_batch(data: WebhookBatchRequest, db: AsyncSession) -> Dict[str, Any]:
+    if _stream_mode():
+        try:
+            stream_ids = await ingest_service.enqueue_many(data.events)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Failed to enqueue webhook batch: {str(e)}"
+            )
+        return {
+            "status": "queued",
+            "processed": len(stream_ids),
+            "accepted": len(stream_ids),
+            "not_found": 0,
+            "results": [
+                {"index": index, "event": event.event, "task_id": event.task_id, "status": "queued"}
+                for index, event in enumerate(data.events)
+            ]
+        }
+
+    webhook_service = AsyncWebhookService(db)
+
+    try:
+        results = await webhook_service.handle_batch(data.events)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to process webhook batch: {str(e)}"
+        )
+
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return {
+        "status": "accepted",
+        "processed": len(results),
+        "accepted": accepted,
+        "not_found": len(results) - accepted,
+        "results": results
+    }
+
+
+IMPORT_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/gzip", "application/octet-stream"}
+
+
+class ImportProgressResponse(StreamingResponse):
+    """
+    Потоковый ответ, который пишется одновременно с чтением тела запроса
+
+    StreamingResponse параллельно ждёт http.disconnect через receive() и
+    перехватил бы части тела, которые читает импорт.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+@webhook_router.post("/import")
+async def webhook_import(
+    request: Request,
+    api_key: str = Depends(get_api_key)
+) -> ImportProgressResponse:
+    """
+    Потоковый импорт исторических событий в формате NDJSON (опционально gzip)
+
+    Тело разбирается по мере получения, события применяются пачками;
+    в ответ построчно (NDJSON) отдаётся прогресс после каждой пачки.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in IMPORT_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Expected application/x-ndjson body"
+        )
+
+    gzipped = request.headers.get("content-encoding") == "gzip" or content_type == "application/gzip" or None
+
+    async def progress() -> AsyncIterator[str]:
+        async for report in import_service.run(request.stream(), gzipped):
+            yield json.dumps(report, ensure_ascii=False) + "\n"
+
+    return ImportProgressResponse(progress(), media_type="application/x-ndjson")
+
+
+@webhook_router.get("/ingest/stats")
+async def webhook_ingest_stats(
+    api_key: str = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Статистика очереди приёма вебхуков: длина stream, отставание и pending по группам
+    """
+    try:
+        return await ingest_service.get_stats()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Failed to read ingest stats: {str(e)}"
+        )
+
+
+@webhook_router.get("/progress/stats")
+async def webhook_progress_stats(
+    api_key: str = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Статистика буфера слияния обновлений прогресса
+    """
+    return progress_buffer.get_stats()
+
+
+@webhook_router.get("/idempotency/stats")
+async def webhook_idempotency_stats(
+    api_key: str = Depends(get_api_key)
+) -> Dict[str, Any]:
+    """
+    Статистика подавления повторных вебхуков: попадания (повторы) и промахи
+    """
+    return idempotency_service.get_stats()
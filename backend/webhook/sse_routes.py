@@ -0,0 +1,72 @@
+from fastapi import APIRouter, Query, Header, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from typing import Optional, AsyncIterator
+import asyncio
+
+from core.config import settings
+from core.security import api_key_header, verify_websocket_connection
+from services.websocket_service import websocket_service, event_seq, ClientConnection
+from webhook.websocket_routes import load_snapshot
+
+sse_router = APIRouter()
+
+
+def sse_frame(text: str) -> str:
+    """Событие SSE; номер события передаётся в id для возобновления через Last-Event-ID"""
+    seq = event_seq(text)
+    if seq is None:
+        return f"data: {text}\n\n"
+    return f"id: {seq}\ndata: {text}\n\n"
+
+
+async def event_stream(client: ClientConnection) -> AsyncIterator[str]:
+    """Поток SSE из очереди клиента с комментариями keepalive в простое"""
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        while True:
+            try:
+                text = await asyncio.wait_for(client.next_message(), timeout=settings.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Комментарий держит соединение через прокси и выявляет отключившихся клиентов
+                yield ": keepalive\n\n"
+                continue
+            if text is None:
+                return
+            client.sent += 1
+            client.frames += 1
+            yield sse_frame(text)
+    finally:
+        websocket_service.disconnect(client)
+
+
+@sse_router.get("/events")
+async def sse_endpoint(
+    project: Optional[str] = Query(None),
+    api_key: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID", ge=0),
+    header_api_key: Optional[str] = Depends(api_key_header)
+) -> StreamingResponse:
+    """
+    Server-Sent Events: те же события задач, что и WebSocket /webhook/ws
+
+    Фильтр project работает так же, как у WebSocket. При переподключении
+    браузер передаёт Last-Event-ID (или клиент указывает ?since=<seq>) и
+    получает пропущенные события, а если они уже недоступны - снимок
+    выполняющихся задач. Сессия БД открывается только на время запроса снимка.
+    """
+    if not await verify_websocket_connection(header_api_key or api_key):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key")
+
+    resume_from = last_event_id if last_event_id is not None else since
+    client = await websocket_service.open_stream(project, since=resume_from, snapshot=load_snapshot)
+
+    return StreamingResponse(
+        event_stream(client),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключает буферизацию ответа в nginx
+            "X-Accel-Buffering": "no"
+        }
+    )
@@ -1,27 +1,84 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPException, status
-from typing import Optional
+from typing import Optional, Dict, Any
+import json
+from core.database import AsyncSessionLocal
 from core.security import verify_websocket_connection
 from services.websocket_service import websocket_service
+from services.webhook_service import AsyncWebhookService
 
 websocket_router = APIRouter()
 
 
+async def load_snapshot(project: Optional[str]):
+    """
+    Снимок выполняющихся задач для переподключившегося клиента
+
+    Сессия открывается только на время запроса: подключение не держит соединение
+    из пула БД всё время своей жизни.
+    """
+    async with AsyncSessionLocal() as db:
+        return await AsyncWebhookService(db).snapshot_tasks(project)
+
+
+def parse_control_message(data: str) -> Optional[Dict[str, Any]]:
+    """Управляющее сообщение клиента (JSON объект с полем action) или None для ping"""
+    if not data.startswith("{"):
+        return None
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) and "action" in message else None
+
+
+def handle_control_message(websocket: WebSocket, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Применить subscribe/unsubscribe и сформировать ответ клиенту (None - ответ не нужен)"""
+    action = message.pop("action")
+    if action == "pong":
+        # Ответ на ping сервера: достаточно отметки о входящем сообщении
+        return None
+    try:
+        filters = websocket_service.update_subscription(websocket, action, message)
+    except ValueError as e:
+        return {"type": "error", "action": action, "message": str(e)}
+    return {"type": "subscription", "action": action, "filters": filters}
+
+
 @websocket_router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, project: Optional[str] = Query(None), api_key: Optional[str] = Query(None)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    project: Optional[str] = Query(None),
+    api_key: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    batch_ms: int = Query(0, ge=0)
+):
     """
     WebSocket эндпоинт для реальных уведомлений
+
+    При переподключении с ?since=<seq> клиент получает пропущенные события,
+    а если они уже недоступны - снимок выполняющихся задач. С ?batch_ms=<мс>
+    сообщения за окно приходят одним фреймом - JSON массивом.
     """
     # Проверка API ключа
     if not await verify_websocket_connection(api_key):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid API Key")
         return
 
-    await websocket_service.connect(websocket, project)
+    await websocket_service.connect(websocket, project, since=since, snapshot=load_snapshot, batch_ms=batch_ms)
 
     try:
         while True:
-            # Получаем сообщение от клиента (ping)
+            # Получаем сообщение от клиента (ping или управление подпиской)
             data = await websocket.receive_text()
+            # Любое входящее сообщение подтверждает, что соединение живо
+            websocket_service.touch(websocket)
+
+            control = parse_control_message(data)
+            if control is not None:
+                reply = handle_control_message(websocket, control)
+                if reply:
+                    await websocket_service.send_personal_message(reply, websocket)
+                continue
 
             # Отправляем pong в ответ
             await websocket_service.send_personal_message({